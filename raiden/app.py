@@ -22,6 +22,29 @@ class App(object):  # pylint: disable=too-few-public-methods
         # throttle policy for token bucket
         throttle_capacity=10.,
         throttle_fill_rate=10.,
+        # number of times a message is sent to a node without an Ack before
+        # giving up, the interval between the retries depends on the node's
+        # round trip time
+        protocol_max_retries=5,
+        # for how long the Acks are remembered to detect duplicated messages
+        # (time in seconds) and how many Acks are remembered at most
+        protocol_ack_ttl=600,
+        protocol_ack_maxsize=100000,
+        # number of worker processes used to recover the senders of the
+        # received messages, 0 recovers them in the node's process
+        signature_recovery_processes=0,
+        # number of worker processes used to sign the outbound messages that
+        # are not stored in the channels, 0 signs them in the node's process
+        signing_processes=0,
+        # number of channels and channel managers registered concurrently
+        # when the node starts
+        startup_concurrency=10,
+        # directory used to persist the off-chain state of the channels, the
+        # state is kept only in memory if empty
+        channel_store_path='',
+        # implementation of the routing graph, `networkx` or `compact` for
+        # large networks
+        channel_graph_backend='networkx',
     )
 
     def __init__(self, config, chain, discovery, transport_class=UDPTransport):
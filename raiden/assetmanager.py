@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import logging
-from collections import defaultdict
 
 from ethereum import slogging
 from ethereum.abi import ContractTranslator
@@ -9,14 +8,42 @@ from ethereum.utils import sha3
 from raiden.channel import Channel, ChannelEndState, ChannelExternalState
 from raiden.blockchain.abi import NETTING_CHANNEL_ABI
 from raiden.transfermanager import TransferManager
-from raiden.messages import Secret, RevealSecret
 from raiden.utils import isaddress, pex
 
 log = slogging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
+class RouteStats(object):  # pylint: disable=too-few-public-methods
+    """ Recent results of the transfers forwarded to a partner. """
+
+    # weight of the previous results in the failure rate
+    failure_decay = 0.8
+
+    def __init__(self):
+        self.failure_rate = 0.
+        self.results = 0
+
+    def register_result(self, success):
+        failure = 0. if success else 1.
+        self.failure_rate = (
+            self.failure_decay * self.failure_rate +
+            (1 - self.failure_decay) * failure
+        )
+        self.results += 1
+
+
 class AssetManager(object):  # pylint: disable=too-many-instance-attributes
-    """ Manages netting contracts for a given asset. """
+    """ Manages netting contracts for a given asset.
+
+    The routes are ranked with `first_hop_penalty`, the weights are in units
+    of hops: `capacity_weight` for using all the distributable balance of the
+    first hop, `failure_weight` for a next hop that always failed and
+    `latency_weight` per second of round trip time to the next hop.
+    """
+
+    capacity_weight = 1.
+    failure_weight = 2.
+    latency_weight = 1.
 
     def __init__(self, raiden, asset_address, channel_manager_address, channel_graph):
         """
@@ -31,12 +58,7 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
 
         self.partneraddress_channel = dict()  #: maps the partner address to the channel instance
         self.address_channel = dict()  #: maps the channel address to the channel instance
-
-        # This is a map from a hashlock to a list of channels, the same
-        # hashlock can be used in more than one AssetManager (for exchanges), a
-        # channel should be removed from this list only when the lock is
-        # released/withdrawed but not when the secret is registered.
-        self.hashlock_channel = defaultdict(list)  #: channels waiting on the conditional lock
+        self.partneraddress_routestats = dict()  #: maps the partner address to its RouteStats
 
         self.asset_address = asset_address
         self.channel_manager_address = channel_manager_address
@@ -144,6 +166,11 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
             channel_details['settle_timeout'],
         )
 
+        channel_store = self.raiden.channel_store
+        if channel_store is not None:
+            channel_store.restore(channel)
+            channel.channel_store = channel_store
+
         self.partneraddress_channel[partner_state.address] = channel
         self.address_channel[netting_channel.address] = channel
 
@@ -171,11 +198,24 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
             translator,
         )
 
-    def register_channel_for_hashlock(self, channel, hashlock):
-        channels_registered = self.hashlock_channel[hashlock]
+    def register_channel_for_hashlock(self, channel, hashlock, expiration=None):
+        """ Register `channel` as waiting for the secret of `hashlock`.
 
-        if channel not in channels_registered:
-            channels_registered.append(channel)
+        The channels are kept in the node's hashlock index, the same hashlock
+        can be used in more than one AssetManager (for exchanges). A channel
+        is removed only when the lock is released/withdrawed or expired but
+        not when the secret is registered.
+        """
+        self.raiden.hashlock_index.register_channel(
+            self.asset_address,
+            channel,
+            hashlock,
+            expiration,
+        )
+
+    def unregister_channels_for_hashlock(self, hashlock):
+        """ Remove all the channels of this asset waiting for `hashlock`. """
+        self.raiden.hashlock_index.unregister_channels(self.asset_address, hashlock)
 
     def register_secret(self, secret):
         """ Register the secret with the interested channels.
@@ -185,10 +225,8 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
             `register_channel_for_hashlock`.
         """
         hashlock = sha3(secret)
-        revealsecret_message = RevealSecret(secret)
-        self.raiden.sign(revealsecret_message)
 
-        channels_list = self.hashlock_channel[hashlock]
+        channels_list = self.raiden.hashlock_index.get_channels(hashlock, self.asset_address)
         for channel in channels_list:
             channel.register_secret(secret)
 
@@ -198,7 +236,7 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
             # received.
             self.raiden.send_async(
                 channel.partner_state.address,
-                revealsecret_message,
+                self.raiden.get_revealsecret_message(secret, hashlock),
             )
 
     def handle_secret(self, identifier, secret):
@@ -248,18 +286,23 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
         self._secret(identifier, secret, partner_secret_message, hashlock)
 
     def _secret(self, identifier, secret, partner_secret_message, hashlock):
-        channels_list = self.hashlock_channel[hashlock]
+        hashlock_index = self.raiden.hashlock_index
+        channels_list = hashlock_index.get_channels(hashlock, self.asset_address)
         channels_to_remove = list()
 
-        # Dont use the partner_secret_message.asset since it might not match with the
+        # The messages are signed only if a channel needs them and are
+        # reused from the node's cache. Dont use the
+        # partner_secret_message.asset since it might not match with the
         # current asset manager
-        our_secret_message = Secret(identifier, secret, self.asset_address)
-        self.raiden.sign(our_secret_message)
+        raiden = self.raiden
+        asset_address = self.asset_address
 
-        revealsecret_message = RevealSecret(secret)
-        self.raiden.sign(revealsecret_message)
+        # the channels_list may change while waiting for a transfer
+        for channel in list(channels_list):
+            # a transfer that is being signed was created with the lock, so
+            # the lock is released after the transfer is registered
+            raiden.wait_transfer_registered(channel)
 
-        for channel in channels_list:
             # critical read/write section
             # - the `release_lock` might raise if the `balance_proof` changes
             #   after the check
@@ -278,7 +321,13 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
 
                 # notify our partner that our state is updated and it can
                 # withdraw the asset
-                self.raiden.send_async(channel.partner_state.address, our_secret_message)
+                our_secret_message = raiden.get_secret_message(
+                    identifier,
+                    secret,
+                    asset_address,
+                    hashlock,
+                )
+                raiden.send_async(channel.partner_state.address, our_secret_message)
 
                 channels_to_remove.append(channel)
 
@@ -298,27 +347,72 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
                     else:
                         # assume our partner does not know the secret and reveal it
                         channel.register_secret(secret)
-                        self.raiden.send_async(channel.partner_state.address, revealsecret_message)
+                        raiden.send_async(
+                            channel.partner_state.address,
+                            raiden.get_revealsecret_message(secret, hashlock),
+                        )
                 else:
                     channel.register_secret(secret)
-                    self.raiden.send_async(channel.partner_state.address, revealsecret_message)
+                    raiden.send_async(
+                        channel.partner_state.address,
+                        raiden.get_revealsecret_message(secret, hashlock),
+                    )
             # /critical read/write section
 
+        # the index drops the hashlock once no channel waits for it
         for channel in channels_to_remove:
-            channels_list.remove(channel)
-
-        # delete the list from defaultdict, it wont be used again
-        if len(channels_list) == 0:
-            del self.hashlock_channel[hashlock]
+            hashlock_index.unregister_channel(self.asset_address, channel, hashlock)
 
     def channel_isactive(self, partner_address):
         """ True if the channel with `partner_address` is open. """
         # TODO: check if the partner's network is alive
         return self.get_channel_by_partner_address(partner_address).isopen
 
+    def register_route_result(self, partner_address, success):
+        """ Register the outcome of a transfer forwarded to `partner_address`,
+        used to rank the routes.
+        """
+        routestats = self.partneraddress_routestats.get(partner_address)
+
+        if routestats is None:
+            routestats = RouteStats()
+            self.partneraddress_routestats[partner_address] = routestats
+
+        routestats.register_result(success)
+
+    def first_hop_penalty(self, channel, amount, distributable=None):
+        """ Return the penalty of transferring `amount` through `channel`, in
+        units of hops.
+
+        The penalty grows with the fraction of the distributable balance used
+        by the transfer, the recent failures of the partner and the round trip
+        time to it.
+        """
+        partner = channel.partner_state.address
+
+        if distributable is None:
+            distributable = channel.distributable
+
+        penalty = 0.
+        if distributable > 0:
+            penalty += self.capacity_weight * float(amount) / distributable
+
+        routestats = self.partneraddress_routestats.get(partner)
+        if routestats is not None:
+            penalty += self.failure_weight * routestats.failure_rate
+
+        timer = self.raiden.protocol.address_timer.get(partner)
+        if timer is not None and timer.smoothed_rtt is not None:
+            penalty += self.latency_weight * timer.smoothed_rtt
+
+        return penalty
+
     def get_best_routes(self, amount, target, lock_timeout=None):
         """ Yield a two-tuple (path, channel) that can be used to mediate the
         transfer. The result is ordered from the best to worst path.
+
+        The routes are ranked by the number of hops plus the
+        `first_hop_penalty` of the channel.
         """
         available_paths = self.channelgraph.get_shortest_paths(
             self.raiden.address,
@@ -333,6 +427,11 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
         # distributable amount, but to sort them based on available balance and
         # let the task use as many as required to finish the transfer.
 
+        # the paths through the same partner share the validation and the
+        # penalty of the first hop, None marks an unusable channel
+        partner_penalty = dict()
+        scored_routes = list()
+
         for path in available_paths:
             assert path[0] == self.raiden.address
             assert path[1] in self.partneraddress_channel
@@ -341,48 +440,80 @@ class AssetManager(object):  # pylint: disable=too-many-instance-attributes
             partner = path[1]
             channel = self.partneraddress_channel[partner]
 
-            if not channel.isopen:
-                if log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'channel %s - %s is close, ignoring',
-                        pex(path[0]),
-                        pex(path[1]),
-                    )
+            if partner not in partner_penalty:
+                distributable = channel.distributable
 
-                continue
-
-            # we can't intermediate the transfer if we don't have enough funds
-            if amount > channel.distributable:
-                if log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'channel %s - %s doesnt have enough funds [%s], ignoring',
-                        pex(path[0]),
-                        pex(path[1]),
+                if self._channel_usable(path, channel, amount, lock_timeout, distributable):
+                    partner_penalty[partner] = self.first_hop_penalty(
+                        channel,
                         amount,
+                        distributable,
                     )
-                continue
-
-            if lock_timeout:
-                # Our partner wont accept a lock timeout that:
-                # - is larger than the settle timeout, otherwise the lock's
-                # secret could be release /after/ the channel is settled.
-                # - is smaller than the reveal timeout, because that is the
-                # minimum number of blocks required by the partner to learn the
-                # secret.
-                valid_timeout = channel.reveal_timeout <= lock_timeout < channel.settle_timeout
-
-                if not valid_timeout and log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'lock_expiration is too large, channel/path cannot be used',
-                        lock_timeout=lock_timeout,
-                        reveal_timeout=channel.reveal_timeout,
-                        settle_timeout=channel.settle_timeout,
-                        nodeid=pex(path[0]),
-                        partner=pex(path[1]),
-                    )
+                else:
+                    partner_penalty[partner] = None
+
+            penalty = partner_penalty[partner]
+            if penalty is not None:
+                scored_routes.append((len(path) - 1 + penalty, path, channel))
 
-                # do not try the route since we know the transfer will be rejected.
-                if not valid_timeout:
-                    continue
+        # stable sort, routes with the same score keep the graph order
+        scored_routes.sort(key=lambda route: route[0])
 
+        for _, path, channel in scored_routes:
             yield (path, channel)
+
+    def _channel_usable(  # pylint: disable=no-self-use,too-many-arguments
+            self,
+            path,
+            channel,
+            amount,
+            lock_timeout,
+            distributable):
+        """ True if `channel`, with `distributable` available, can be used as
+        the first hop of `path`.
+        """
+        if not channel.isopen:
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    'channel %s - %s is close, ignoring',
+                    pex(path[0]),
+                    pex(path[1]),
+                )
+
+            return False
+
+        # we can't intermediate the transfer if we don't have enough funds
+        if amount > distributable:
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    'channel %s - %s doesnt have enough funds [%s], ignoring',
+                    pex(path[0]),
+                    pex(path[1]),
+                    amount,
+                )
+            return False
+
+        if lock_timeout:
+            # Our partner wont accept a lock timeout that:
+            # - is larger than the settle timeout, otherwise the lock's
+            # secret could be release /after/ the channel is settled.
+            # - is smaller than the reveal timeout, because that is the
+            # minimum number of blocks required by the partner to learn the
+            # secret.
+            valid_timeout = channel.reveal_timeout <= lock_timeout < channel.settle_timeout
+
+            if not valid_timeout and log.isEnabledFor(logging.INFO):
+                log.info(
+                    'lock_expiration is too large, channel/path cannot be used',
+                    lock_timeout=lock_timeout,
+                    reveal_timeout=channel.reveal_timeout,
+                    settle_timeout=channel.settle_timeout,
+                    nodeid=pex(path[0]),
+                    partner=pex(path[1]),
+                )
+
+            # do not try the route since we know the transfer will be rejected.
+            if not valid_timeout:
+                return False
+
+        return True
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Sources of the new blocks used by the AlarmTask, a block source either polls
+the chain for the current block number or is notified by the chain.
+
+The AlarmTask also expires the BlockTimers used to wait for a block number.
+"""
+import heapq
+import itertools
+import time
+
+import gevent
+from gevent.event import Event
+
+ESTIMATED_BLOCK_TIME = 7
+MIN_POLL_INTERVAL = 0.5
+
+
+class PollingBlockSource(object):
+    """ Polls the chain for the current block number.
+
+    A new block is not expected right after the previous one, so the chain is
+    polled at half of the time remaining until the next block is expected, the
+    interval is never shorter than `min_poll_interval` and that is the interval
+    used once the block is due or while the time of the last block is unknown.
+    """
+
+    def __init__(
+            self,
+            chain,
+            block_time=ESTIMATED_BLOCK_TIME,
+            min_poll_interval=MIN_POLL_INTERVAL):
+
+        self.chain = chain
+        self.block_time = block_time
+        self.min_poll_interval = min_poll_interval
+        self.last_block_time = None
+
+    def poll_interval(self):
+        if self.last_block_time is None:
+            return self.min_poll_interval
+
+        remaining = self.block_time - (time.time() - self.last_block_time)
+        return max(remaining / 2.0, self.min_poll_interval)
+
+    def wait_for_block(self, block_number, stop_event):
+        """ Wait for a block number different from `block_number`.
+
+        Returns:
+            int: The new block number or None if `stop_event` was set first.
+        """
+        while True:
+            current_block = self.chain.block_number()
+
+            if current_block != block_number:
+                self.last_block_time = time.time()
+                return current_block
+
+            if stop_event.wait(self.poll_interval()) is not None:
+                return None
+
+
+class PushBlockSource(object):
+    """ Block source for chains that call `new_block` for every new block, e.g.
+    a local chain used for testing, the new blocks are handled without any
+    polling delay.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.new_block_event = Event()
+
+    def new_block(self, block_number):  # pylint: disable=unused-argument
+        self.new_block_event.set()
+
+    def wait_for_block(self, block_number, stop_event):
+        """ Wait for a block number different from `block_number`.
+
+        Returns:
+            int: The new block number or None if `stop_event` was set first.
+        """
+        while True:
+            self.new_block_event.clear()
+            current_block = self.chain.block_number()
+
+            if current_block != block_number:
+                return current_block
+
+            gevent.wait([self.new_block_event, stop_event], count=1)
+
+            if stop_event.ready():
+                return None
+
+
+class BlockTimer(object):  # pylint: disable=too-few-public-methods
+    """ A callback scheduled for a block number, see BlockTimers. """
+
+    __slots__ = ('block_number', 'callback', 'timers')
+
+    def __init__(self, block_number, callback, timers):
+        self.block_number = block_number
+        self.callback = callback
+        self.timers = timers
+
+    def cancel(self):
+        """ Do not call the callback, does nothing if it was already called. """
+        if self.callback is not None:
+            self.callback = None
+            self.timers.cancelled += 1
+
+
+class BlockTimers(object):
+    """ Callbacks to be called once a given block number is reached.
+
+    The timers are kept in a heap ordered by the block number, so a new block
+    only touches the timers that expire. The cancelled timers are left in the
+    heap until they expire or until they are half of the heap.
+    """
+
+    def __init__(self):
+        self.heap = list()
+        self.counter = itertools.count()
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def schedule(self, block_number, callback):
+        """ Call `callback(current_block)` once the block `block_number` is
+        reached.
+
+        Returns:
+            BlockTimer: The handle used to cancel the timer.
+        """
+        timer = BlockTimer(block_number, callback, self)
+        heapq.heappush(self.heap, (block_number, next(self.counter), timer))
+
+        if self.cancelled > len(self.heap) // 2:
+            self._compact()
+
+        return timer
+
+    def _compact(self):
+        self.heap = [
+            entry
+            for entry in self.heap
+            if entry[2].callback is not None
+        ]
+        heapq.heapify(self.heap)
+        self.cancelled = 0
+
+    def expire(self, current_block):
+        """ Pop the timers of the blocks up to `current_block`.
+
+        Returns:
+            List[callable]: The callbacks of the expired timers, in the order
+            they must be called.
+        """
+        callbacks = list()
+
+        while self.heap and self.heap[0][0] <= current_block:
+            _, _, timer = heapq.heappop(self.heap)
+
+            if timer.callback is None:
+                self.cancelled -= 1
+            else:
+                callbacks.append(timer.callback)
+                timer.callback = None
+
+        return callbacks
@@ -15,7 +15,7 @@ from raiden.messages import (
     LockedTransfer,
     TransferTimeout,
 )
-from raiden.mtree import merkleroot, get_proof
+from raiden.mtree import MutableMerkletree, get_proof, get_proofs
 from raiden.utils import sha3, pex, lpex
 from raiden.tasks import REMOVE_CALLBACK
 from raiden.transfermanager import UnknownAddress
@@ -81,19 +81,25 @@ class BalanceProof(object):
         # as a proof
         self.transfer = None
 
+        # the lockhashes of the pending and unclaimed locks, the tree is
+        # updated in place so that a new transfer does not rebuild it
+        self.unclaimed_tree = MutableMerkletree()
+
+        # the sum of the amounts of the pending and unclaimed locks, updated
+        # as the locks are registered and released
+        self.locked_amount = 0
+
     def unclaimed_merkletree(self):
-        alllocks = chain(
-            self.hashlock_pendinglocks.values(),
-            self.hashlock_unclaimedlocks.values()
-        )
-        return [lock.lockhashed for lock in alllocks]
+        return list(self.unclaimed_tree.leaves)
 
     def merkleroot_for_unclaimed(self):
-        alllocks = chain(
-            self.hashlock_pendinglocks.values(),
-            self.hashlock_unclaimedlocks.values()
-        )
-        return merkleroot(lock.lockhashed for lock in alllocks)
+        return self.unclaimed_tree.merkleroot
+
+    def merkleroot_for_unclaimed_with(self, lockhashed):
+        """ Return the locksroot with the `lockhashed` included, the state is
+        not changed.
+        """
+        return self.unclaimed_tree.merkleroot_with(lockhashed)
 
     def is_pending(self, hashlock):
         """ True if a secret is not known for the given `hashlock`. """
@@ -118,16 +124,7 @@ class BalanceProof(object):
         )
 
     def locked(self):
-        alllocks = chain(
-            self.hashlock_pendinglocks.values(),
-            self.hashlock_unclaimedlocks.values(),
-            # self.hashlock_unlockedlocks.values()
-        )
-
-        return sum(
-            lock.lock.amount
-            for lock in alllocks
-        )
+        return self.locked_amount
 
     def register_locked_transfer(self, locked_transfer):
         if not isinstance(locked_transfer, LockedTransfer):
@@ -139,11 +136,11 @@ class BalanceProof(object):
         if self.is_known(lock.hashlock):
             raise ValueError('hashlock is already registered')
 
-        merkletree = self.unclaimed_merkletree()
-        merkletree.append(lockhashed)
-        new_locksroot = merkleroot(merkletree)
+        new_locksroot = self.unclaimed_tree.add(lockhashed)
 
         if locked_transfer.locksroot != new_locksroot:
+            self.unclaimed_tree.remove(lockhashed)
+
             raise ValueError(
                 'locksroot mismatch expected:{} got:{}'.format(
                     pex(new_locksroot),
@@ -152,6 +149,7 @@ class BalanceProof(object):
             )
 
         self.hashlock_pendinglocks[lock.hashlock] = PendingLock(lock, lockhashed)
+        self.locked_amount += lock.amount
         self.transfer = locked_transfer
         self.hashlock_unlockedlocks = dict()
 
@@ -211,20 +209,24 @@ class BalanceProof(object):
         if self.is_pending(hashlock):
             pendinglock = self.hashlock_pendinglocks[hashlock]
             del self.hashlock_pendinglocks[hashlock]
+            self.unclaimed_tree.remove(pendinglock.lockhashed)
 
             self.hashlock_unlockedlocks[hashlock] = UnlockPartialProof(
                 pendinglock.lock,
                 pendinglock.lockhashed,
                 secret,
             )
+            self.locked_amount -= pendinglock.lock.amount
 
             return pendinglock.lock
 
         elif self.is_unclaimed(hashlock):
             unclaimedlock = self.hashlock_unclaimedlocks[hashlock]
             del self.hashlock_unclaimedlocks[hashlock]
+            self.unclaimed_tree.remove(unclaimedlock.lockhashed)
 
             self.hashlock_unlockedlocks[hashlock] = unclaimedlock
+            self.locked_amount -= unclaimedlock.lock.amount
 
             return unclaimedlock.lock
 
@@ -232,31 +234,42 @@ class BalanceProof(object):
 
     def get_known_unlocks(self):
         """ Generate unlocking proofs for the known secrets. """
-        allpartialproof = chain(
+        allpartialproof = list(chain(
             self.hashlock_unclaimedlocks.itervalues(),
             self.hashlock_unlockedlocks.itervalues(),
+        ))
+
+        merkle_proofs = get_proofs(
+            self.all_merkletree(),
+            [partialproof.lockhashed for partialproof in allpartialproof],
         )
 
         return [
-            self.compute_proof_for_lock(
+            UnlockProof(
+                merkle_proof,
+                # forcing bytes because ethereum.abi doesnt work with bytearray
+                bytes(partialproof.lock.as_bytes),
                 partialproof.secret,
-                partialproof.lock,
             )
-            for partialproof in allpartialproof
+            for partialproof, merkle_proof in zip(allpartialproof, merkle_proofs)
         ]
 
-    def compute_proof_for_lock(self, secret, lock):
+    def all_merkletree(self):
+        """ Return the lockhashes of all the locks, including the unlocked
+        ones, this is the tree for the locksroot of the latest transfer.
+        """
         alllocks = chain(
             self.hashlock_pendinglocks.values(),
             self.hashlock_unclaimedlocks.values(),
             self.hashlock_unlockedlocks.values()
         )
-        merkletree = [l.lockhashed for l in alllocks]
+        return [l.lockhashed for l in alllocks]
 
+    def compute_proof_for_lock(self, secret, lock):
         # forcing bytes because ethereum.abi doesnt work with bytearray
         lock_encoded = bytes(lock.as_bytes)
         lock_hash = sha3(lock_encoded)
-        merkle_proof = get_proof(merkletree, lock_hash)
+        merkle_proof = get_proof(self.all_merkletree(), lock_hash)
 
         return UnlockProof(
             merkle_proof,
@@ -319,9 +332,8 @@ class ChannelEndState(object):
         """ Compute the resulting merkle root if the lock `include` is added in
         the tree.
         """
-        merkletree = self.balance_proof.unclaimed_merkletree()
-        merkletree.append(sha3(include.as_bytes))
-        return merkleroot(merkletree)
+        lockhashed = sha3(include.as_bytes)
+        return self.balance_proof.merkleroot_for_unclaimed_with(lockhashed)
 
     # api design: using specialized methods to force the user to register the
     # transfer and the lock in a single step
@@ -539,6 +551,13 @@ class Channel(object):
         self.on_withdrawable_callbacks = list()  # mapping of transfer to callback list
         self.on_task_completed_callbacks = list()  # XXX naming
 
+        # the storage.ChannelStore that persists the off-chain state, if any
+        self.channel_store = None
+
+        # the PendingSignature of the transfer that is being signed, it is
+        # registered once signed (see RaidenService.register_transfer_async)
+        self.unregistered_transfer = None
+
     @property
     def isopen(self):
         return self.external_state.isopen()
@@ -706,6 +725,9 @@ class Channel(object):
 
             self.partner_state.register_secret(secret)
 
+        if self.channel_store is not None:
+            self.channel_store.log_secret(self, secret)
+
     def release_lock(self, secret):
         """ Release a lock for a transfer that was initiated from this node.
 
@@ -744,6 +766,9 @@ class Channel(object):
 
         self.partner_state.release_lock(self.our_state, secret)
 
+        if self.channel_store is not None:
+            self.channel_store.log_release(self, self.partner_state, secret)
+
     def withdraw_lock(self, secret):
         """ A lock was released by the sender, withdraw it's funds and update
         the state.
@@ -772,6 +797,9 @@ class Channel(object):
 
         self.our_state.release_lock(self.partner_state, secret)
 
+        if self.channel_store is not None:
+            self.channel_store.log_release(self, self.our_state, secret)
+
     def register_transfer(self, transfer):
         """ Register a signed transfer, updating the channel's state accordingly. """
 
@@ -802,6 +830,9 @@ class Channel(object):
                 )
             raise UnknownAddress(transfer)
 
+        if self.channel_store is not None:
+            self.channel_store.log_transfer(self, transfer)
+
     def register_transfer_from_to(self, transfer, from_state, to_state):  # noqa pylint: disable=too-many-branches
         """ Validates and register a signed transfer, updating the channel's state accordingly.
 
@@ -944,6 +975,7 @@ class Channel(object):
             self.external_state.register_channel_for_hashlock(
                 self,
                 transfer.lock.hashlock,
+                transfer.lock.expiration,
             )
 
         if isinstance(transfer, DirectTransfer):
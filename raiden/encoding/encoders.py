@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import codecs
+import binascii
 import sys
 
 from rlp.utils import int_to_big_endian
@@ -35,7 +35,7 @@ class integer(object):  # pylint: disable=invalid-name
 
         @staticmethod
         def decode(value):
-            return int(codecs.encode(value, 'hex'), 16)
+            return int(binascii.hexlify(value), 16)
     else:
         @staticmethod
         def encode(value, length):
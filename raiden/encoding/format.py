@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import struct
 from collections import namedtuple, Counter
 
 try:  # py3k
@@ -6,8 +7,10 @@ try:  # py3k
 except ImportError:
     from repoze.lru import lru_cache
 
+from raiden.encoding.encoders import integer
 
-__all__ = ('Field', 'BYTE', 'namedbuffer', 'buffer_for',)
+
+__all__ = ('Field', 'BYTE', 'namedbuffer', 'buffer_for', 'bytes_at',)
 
 
 Field = namedtuple(
@@ -17,6 +20,14 @@ Field = namedtuple(
 
 BYTE = 2 ** 8
 
+# struct formats for the unsigned integers by size in bytes
+NATIVE_INTEGER = {
+    1: 'B',
+    2: 'H',
+    4: 'I',
+    8: 'Q',
+}
+
 
 @lru_cache(10)  # caching so the factory returns the same object
 def pad(size_bytes):
@@ -42,6 +53,13 @@ def buffer_for(klass):
     return bytearray(klass.size)
 
 
+def bytes_at(data, start, size_bytes):
+    ''' Returns a copy of `size_bytes` bytes of `data` from `start`, `data`
+    can be a string, a bytearray or a memoryview.
+    '''
+    return struct.unpack_from('{}s'.format(size_bytes), data, start)[0]
+
+
 def namedbuffer(buffer_name, fields_spec):  # noqa (ignore ciclomatic complexity)
     ''' Wraps a buffer instance using the field spec.
 
@@ -85,6 +103,11 @@ def namedbuffer(buffer_name, fields_spec):  # noqa (ignore ciclomatic complexity
     # big endian format
     fields_format = '>' + ''.join(field.format_string for field in fields_spec)
 
+    fields_struct = struct.Struct('>' + ''.join(
+        struct_format(field)
+        for field in fields_spec
+    ))
+
     def __init__(self, data):
         if len(data) < size:
             raise ValueError('data buffer is too small')
@@ -92,56 +115,157 @@ def namedbuffer(buffer_name, fields_spec):  # noqa (ignore ciclomatic complexity
         # XXX: validate or initialize the buffer?
         self.data = data
 
-    def __getattr__(self, name):
-        if name in name_slice:
-            slice_ = name_slice[name]
-            field = name_field[name]
+    def unpack_fields(self):
+        """ Returns a dictionary with the decoded value of every field, the
+        buffer is unpacked with a single call.
+        """
+        values = list(fields_struct.unpack_from(self.data))
 
-            value = self.data[slice_]
+        for index, decode in field_decoders:
+            values[index] = decode(values[index])
 
-            if field.encoder:
-                value = field.encoder.decode(value)
+        return dict(zip(fields, values))
 
-            return value
-
-        raise AttributeError
-
-    def __setattr__(self, name, value):
-        if name in name_slice:
-            slice_ = name_slice[name]
-            field = name_field[name]
-
-            if field.encoder:
-                field.encoder.validate(value)
-                value = field.encoder.encode(value, field.size_bytes)
-
-            length = len(value)
-            if length > field.size_bytes:
-                msg = 'value with length {length} for {attr} is too big'.format(
-                    length=length,
-                    attr=name,
-                )
-                raise ValueError(msg)
-            elif length < field.size_bytes:
-                pad_size = field.size_bytes - length
-                pad_value = b'\x00' * pad_size
-                value = pad_value + value
+    def pack_fields(self, **values):
+        """ Sets the value of the given fields, the buffer is packed with a
+        single call and the fields without a value are kept as is.
+        """
+        data = self.data
+        current = fields_struct.unpack_from(data)
 
-            self.data[slice_] = value
-        else:
-            super(self.__class__, self).__setattr__(name, value)
+        fields_struct.pack_into(data, 0, *[
+            encode(values[name]) if name in values else current[index]
+            for index, (name, encode) in enumerate(zip(fields, field_encoders))
+        ])
 
     attributes = {
         '__init__': __init__,
         '__slots__': ('data',),
-        '__getattr__': __getattr__,
-        '__setattr__': __setattr__,
+        'unpack_fields': unpack_fields,
+        'pack_fields': pack_fields,
 
         'fields': fields,
         'fields_spec': fields_spec,
         'name': buffer_name,
         'format': fields_format,
+        'struct': fields_struct,
         'size': size,
     }
 
+    field_decoders = list()
+    field_encoders = list()
+    for index, name in enumerate(fields):
+        field = name_field[name]
+        encode = field_encoder(field)
+
+        # native integers and fields without an encoder are unpacked as is
+        if field.encoder and not is_native_integer(field):
+            field_decoders.append((index, field.encoder.decode))
+
+        field_encoders.append(encode)
+        attributes[name] = field_property(field, name_slice[name], encode)
+
     return type(buffer_name, (), attributes)
+
+
+def is_native_integer(field):
+    """ True if the field is an integer that struct can pack natively. """
+    return isinstance(field.encoder, integer) and field.size_bytes in NATIVE_INTEGER
+
+
+def struct_format(field):
+    """ Returns the struct format used to pack `field`.
+
+    Integers of 1, 2, 4 or 8 bytes are packed natively, any other field is
+    packed as a string and converted by the field encoder.
+    """
+    if field.name.startswith('pad_'):
+        return '{}x'.format(field.size_bytes)
+
+    if is_native_integer(field):
+        return NATIVE_INTEGER[field.size_bytes]
+
+    return '{}s'.format(field.size_bytes)
+
+
+def field_encoder(field):
+    """ Returns a function that validates a value and converts it to the type
+    expected by the `struct_format` of the field.
+    """
+    encoder = field.encoder
+    size_bytes = field.size_bytes
+
+    if is_native_integer(field):
+        maximum = BYTE ** size_bytes - 1
+
+        def encode_integer(value):
+            encoder.validate(value)
+
+            # the encoder's range can be larger than the field, struct would
+            # raise struct.error instead of a ValueError
+            if value > maximum:
+                msg = 'value {value} for {attr} is too big'.format(
+                    value=value,
+                    attr=field.name,
+                )
+                raise ValueError(msg)
+
+            return value
+
+        return encode_integer
+
+    def encode(value):
+        if encoder:
+            encoder.validate(value)
+            value = encoder.encode(value, size_bytes)
+
+        length = len(value)
+        if length > size_bytes:
+            msg = 'value with length {length} for {attr} is too big'.format(
+                length=length,
+                attr=field.name,
+            )
+            raise ValueError(msg)
+        elif length < size_bytes:
+            pad_size = size_bytes - length
+            pad_value = b'\x00' * pad_size
+            value = pad_value + value
+
+        return value
+
+    return encode
+
+
+def field_property(field, slice_, encode):
+    """ Returns the property used to access `field` in the buffer. """
+
+    if is_native_integer(field):
+        field_struct = struct.Struct('>' + NATIVE_INTEGER[field.size_bytes])
+        offset = slice_.start
+
+        def get_integer(self):
+            return field_struct.unpack_from(self.data, offset)[0]
+
+        def set_integer(self, value):
+            field_struct.pack_into(self.data, offset, encode(value))
+
+        return property(get_integer, set_integer)
+
+    decode = field.encoder.decode if field.encoder else None
+    field_struct = struct.Struct('>{}s'.format(field.size_bytes))
+    offset = slice_.start
+
+    def getter(self):
+        # unpack_from instead of slicing, the value is a string even if the
+        # data is a bytearray or a memoryview
+        value = field_struct.unpack_from(self.data, offset)[0]
+
+        if decode:
+            value = decode(value)
+
+        return value
+
+    def setter(self, value):
+        self.data[slice_] = encode(value)
+
+    return property(getter, setter)
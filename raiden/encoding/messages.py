@@ -4,8 +4,8 @@ import struct
 from ethereum import slogging
 
 from raiden.encoding.encoders import integer, optional_bytes
-from raiden.encoding.format import buffer_for, make_field, namedbuffer, pad, BYTE
-from raiden.encoding.signing import recover_publickey
+from raiden.encoding.format import buffer_for, bytes_at, make_field, namedbuffer, pad, BYTE
+from raiden.encoding.signing import recover_publickey, SENDER_CACHE
 
 
 def to_bigendian(number):
@@ -43,6 +43,7 @@ REFUNDTRANSFER_CMDID = 8
 TRANSFERTIMEOUT_CMDID = 9
 CONFIRMTRANSFER_CMDID = 10
 REVEALSECRET_CMDID = 11
+BATCHEDACK_CMDID = 12
 
 ACK = to_bigendian(ACK_CMDID)
 PING = to_bigendian(PING_CMDID)
@@ -56,6 +57,7 @@ MEDIATEDTRANSFER = to_bigendian(MEDIATEDTRANSFER_CMDID)
 REFUNDTRANSFER = to_bigendian(REFUNDTRANSFER_CMDID)
 TRANSFERTIMEOUT = to_bigendian(TRANSFERTIMEOUT_CMDID)
 CONFIRMTRANSFER = to_bigendian(CONFIRMTRANSFER_CMDID)
+BATCHEDACK = to_bigendian(BATCHEDACK_CMDID)
 
 
 # pylint: disable=invalid-name
@@ -95,6 +97,17 @@ Ack = namedbuffer(
     ]
 )
 
+BatchedAck = namedbuffer(
+    'batched_ack',
+    [
+        cmdid(BATCHEDACK),  # [0:1]
+        pad(3),             # [1:4]
+        sender,             # [4:24]
+
+        # echo*
+    ]
+)
+
 Ping = namedbuffer(
     'ping',
     [
@@ -272,6 +285,7 @@ CMDID_MESSAGE = {
     REFUNDTRANSFER: RefundTransfer,
     TRANSFERTIMEOUT: TransferTimeout,
     CONFIRMTRANSFER: ConfirmTransfer,
+    BATCHEDACK: BatchedAck,
 }
 
 
@@ -279,6 +293,47 @@ def wrap_and_validate(data):
     ''' Try to decode data into a message and validate the signature, might
     return None if the data is invalid.
     '''
+    result = wrap_signed(data)
+
+    if result is None:
+        return
+
+    message, message_data, message_signature = result
+
+    try:
+        publickey = recover_publickey(message_data, message_signature)
+    except (ValueError, Exception):
+        log.error('invalid signature')
+        return
+
+    return message, publickey
+
+
+def wrap_and_recover_sender(data):
+    ''' Same as `wrap_and_validate` but returns the address of the sender, the
+    address is cached for retransmitted messages.
+    '''
+    result = wrap_signed(data)
+
+    if result is None:
+        return
+
+    message, message_data, message_signature = result
+
+    try:
+        address = SENDER_CACHE.recover_address(message_data, message_signature)
+    except (ValueError, Exception):
+        log.error('invalid signature')
+        return
+
+    return message, address
+
+
+def wrap_signed(data):
+    ''' Try to decode data into a message and split the signed data from the
+    signature without validating it, might return None if the data is
+    invalid.
+    '''
     try:
         first_byte = data[0]
     except KeyError:
@@ -298,17 +353,13 @@ def wrap_and_validate(data):
         return
 
     assert message_type.fields_spec[-1].name == 'signature', 'signature is not the last field'
-    # this slice must be from the end of the buffer
-    message_data = message.data[:-signature.size_bytes]
-    message_signature = message.data[-signature.size_bytes:]
+    # this slice must be from the end of the buffer, the memoryview avoids
+    # copying the signed data
+    signature_start = len(message.data) - signature.size_bytes
+    message_data = memoryview(message.data)[:signature_start]
+    message_signature = bytes_at(message.data, signature_start, signature.size_bytes)
 
-    try:
-        publickey = recover_publickey(message_data, message_signature)
-    except (ValueError, Exception):
-        log.error('invalid signature')
-        return
-
-    return message, publickey
+    return message, message_data, message_signature
 
 
 def wrap(data):
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
+import cachetools
 from secp256k1 import PublicKey, ALL_FLAGS
 
-from raiden.utils import sha3, GLOBAL_CTX
+from raiden.utils import keccak, keccak_parts, sha3, GLOBAL_CTX
 
+SENDER_CACHE_SIZE = 10000
 
-def recover_publickey(messagedata, signature):
+
+def recover_publickey(messagedata, signature, ctx=GLOBAL_CTX):
     if len(signature) != 65:
         raise ValueError('invalid signature')
 
     key = PublicKey(
-        ctx=GLOBAL_CTX,
+        ctx=ctx,
         flags=ALL_FLAGS,  # FLAG_SIGN is required to recover publickeys
     )
 
@@ -18,15 +21,12 @@ def recover_publickey(messagedata, signature):
         ord(signature[64]),
     )
 
-    message_hash = sha3(messagedata)
-    publickey_data = key.ecdsa_recover(message_hash, signature_data, raw=True)
+    # keccak instead of sha3 because messagedata may be a memoryview
+    message_hash = keccak(messagedata)
+    # reuse the key object to serialize the recovered public key
+    key.public_key = key.ecdsa_recover(message_hash, signature_data, raw=True)
 
-    publickey = PublicKey(
-        publickey_data,
-        ctx=GLOBAL_CTX
-    )
-
-    return publickey.serialize(compressed=False)
+    return key.serialize(compressed=False)
 
 
 def sign(messagedata, private_key):
@@ -43,3 +43,58 @@ def sign(messagedata, private_key):
 
 def address_from_key(key):
     return sha3(key[1:])[-20:]
+
+
+class SenderCache(object):
+    """ LRU cache of the addresses recovered from the message signatures.
+
+    Retransmitted messages have the same signed data and signature, the cache
+    is keyed by the hash of both so a retransmission does not pay for another
+    recovery.
+    """
+
+    def __init__(self, maxsize):
+        self.address_cache = cachetools.LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(messagedata, signature):
+        return keccak_parts(messagedata, signature)
+
+    def get_address(self, key):
+        """ Returns the cached address for `key` or None. """
+        address = self.address_cache.get(key)
+
+        if address is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return address
+
+    def add_address(self, key, address):
+        self.address_cache[key] = address
+
+    def recover_address(self, messagedata, signature):
+        """ Returns the address that signed `messagedata`, might raise
+        ValueError if the signature is invalid.
+        """
+        key = self.cache_key(messagedata, signature)
+        address = self.get_address(key)
+
+        if address is None:
+            address = address_from_key(recover_publickey(messagedata, signature))
+            self.add_address(key, address)
+
+        return address
+
+    def get_stats(self):
+        return {
+            'size': len(self.address_cache),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+SENDER_CACHE = SenderCache(SENDER_CACHE_SIZE)
@@ -3,14 +3,17 @@ from ethereum.slogging import getLogger
 from ethereum.utils import big_endian_to_int
 
 from raiden.encoding import messages, signing
-from raiden.encoding.format import buffer_for
+from raiden.encoding.format import buffer_for, bytes_at
+from raiden.encoding.messages import BatchedAck as BatchedAckNamedbuffer
 from raiden.encoding.messages import LocksrootRejected as LocksrootRejectedNamedbuffer
+from raiden.encoding.messages import echo as echo_field
 from raiden.encoding.messages import secret as secret_field
 from raiden.encoding.messages import signature as signature_field
-from raiden.utils import publickey_to_address, sha3, ishash, pex
+from raiden.utils import sha3, ishash, pex
 
 __all__ = (
     'Ack',
+    'BatchedAck',
     'Ping',
     'LocksrootRejected',
     'SecretRequest',
@@ -32,12 +35,34 @@ class MessageHashable(object):
 
 
 class Message(MessageHashable):
+    """ Base class for the messages.
+
+    The encoded message and its hash are computed once and cached, setting any
+    attribute clears the cache. Mutating an attribute value in place (e.g.
+    appending to a list) does not, a message must not be mutated in place
+    once it is encoded.
+    """
     # pylint: disable=no-member
 
+    _encoded = None
+    _hash = None
+
+    # attributes that are not part of the encoded message
+    _unencoded_attributes = frozenset()
+
+    def __setattr__(self, name, value):
+        super(Message, self).__setattr__(name, value)
+
+        if self._encoded is not None and name not in self._unencoded_attributes:
+            if not name.startswith('_'):
+                self._encoded = None
+                self._hash = None
+
     @property
     def hash(self):
-        packed = self.packed()
-        return sha3(packed.data)
+        if self._hash is None:
+            self._hash = sha3(self.encode())
+        return self._hash
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.hash == other.hash
@@ -49,21 +74,44 @@ class Message(MessageHashable):
         return not self.__eq__(other)
 
     def __repr__(self):
-        packed = self.packed()
-
         return '<{klass} [{content}]>'.format(
             klass=self.__class__.__name__,
-            content=pex(packed.data),
+            content=pex(self.encode()),
         )
 
     @classmethod
     def decode(cls, packed):
         packed = messages.wrap(packed)
-        return cls.unpack(packed)
+        message = cls.unpack(packed)
+        message._set_decoded_from(packed)  # pylint: disable=protected-access
+        return message
+
+    def _set_decoded_from(self, packed):
+        """ Use the received data as the encoded message, this is only done
+        for fixed size messages without trailing data, otherwise the data
+        would not match the packed message.
+        """
+        data = packed.data
+
+        if len(data) == packed.size:
+            if isinstance(data, bytearray):
+                data = bytes(data)
+
+            self._encoded = data
 
     def encode(self):
-        packed = self.packed()
-        return bytes(packed.data)
+        encoded = self._encoded
+
+        if encoded is None:
+            packed = self.packed()
+            encoded = self._encoded = bytes(packed.data)
+
+        elif isinstance(encoded, memoryview):
+            # the message was decoded from a memoryview, copy the data only if
+            # it is needed
+            encoded = self._encoded = encoded.tobytes()
+
+        return encoded
 
     def packed(self):
         klass = messages.CMDID_MESSAGE[self.cmdid]
@@ -79,6 +127,10 @@ class SignedMessage(Message):
     # signing is a bit problematic, we need to pack the data to sign, but the
     # current API assumes that signing is called before, this can be improved
     # by changing the order to packing then signing
+
+    # the sender is recovered from the signature
+    _unencoded_attributes = frozenset(['sender'])
+
     def __init__(self):
         super(SignedMessage, self).__init__()
         self.signature = b''
@@ -86,32 +138,62 @@ class SignedMessage(Message):
 
     def sign(self, private_key, node_address):
         """ Sign message using `private_key`. """
+        packed, message_data = self.data_to_sign()
+        signature = signing.sign(message_data, private_key)
+        self.set_signature(packed, signature, node_address)
+
+    def data_to_sign(self):
+        """ Return the packed message and the data covered by the signature,
+        used to sign the message somewhere else.
+        """
         packed = self.packed()
 
         field = packed.fields_spec[-1]
         assert field.name == 'signature', 'signature is not the last field'
 
         # this slice must be from the end of the buffer
-        message_data = packed.data[:-field.size_bytes]
-        signature = signing.sign(message_data, private_key)
+        return packed, packed.data[:-field.size_bytes]
 
-        packed.data[-field.size_bytes:] = signature
+    def set_signature(self, packed, signature, node_address):
+        """ Store the `signature` of the data returned by `data_to_sign`. """
+        packed.data[-len(signature):] = signature
 
         self.sender = node_address
         self.signature = signature
+        self._encoded = bytes(packed.data)
 
     @classmethod
     def decode(cls, data):
-        result = messages.wrap_and_validate(data)
+        result = messages.wrap_and_recover_sender(data)
 
         if result is None:
             return
 
-        packed, public_key = result
+        packed, sender = result
         message = cls.unpack(packed)  # pylint: disable=no-member
-        message.sender = publickey_to_address(public_key)
+        message.sender = sender
+        message._set_decoded_from(packed)  # pylint: disable=protected-access
         return message
 
+    @classmethod
+    def decode_unverified(cls, data):
+        """ Decode the message without recovering the sender.
+
+        Returns:
+            Tuple[SignedMessage, Tuple[memoryview, bytes]]: The message and
+            the signed data and signature used to recover the sender, or None
+            if the data is invalid.
+        """
+        result = messages.wrap_signed(data)
+
+        if result is None:
+            return
+
+        packed, message_data, message_signature = result
+        message = cls.unpack(packed)  # pylint: disable=no-member
+        message._set_decoded_from(packed)  # pylint: disable=protected-access
+        return message, (message_data, message_signature)
+
 
 class Ack(Message):
     """ All accepted messages should be confirmed by an `Ack` which echoes the
@@ -139,6 +221,59 @@ class Ack(Message):
         packed.sender = self.sender
 
 
+class BatchedAck(Message):
+    """ Confirms many messages at once, it is equivalent to an `Ack` for each
+    of the echoed hashes.
+    """
+    cmdid = messages.BATCHEDACK
+
+    # keeps the packed message below RaidenProtocol.max_message_size
+    max_echoes = 32
+
+    def __init__(self, sender, echoes):
+        super(BatchedAck, self).__init__()
+        self.sender = sender
+        self.echoes = list(echoes)
+
+    @staticmethod
+    def unpack(packed):
+        echoes = list()
+
+        start = BatchedAckNamedbuffer.size
+        while start < len(packed.data):
+            echoes.append(bytes_at(packed.data, start, echo_field.size_bytes))
+            start += echo_field.size_bytes
+
+        return BatchedAck(
+            packed.sender,
+            echoes,
+        )
+
+    def pack(self, packed):
+        packed.sender = self.sender
+
+    def packed(self):
+        if len(self.echoes) > self.max_echoes:
+            raise ValueError('cannot acknowledge more than {} messages at once'.format(
+                self.max_echoes,
+            ))
+
+        size = BatchedAckNamedbuffer.size + len(self.echoes) * echo_field.size_bytes
+        data = bytearray(size)
+        data[0] = self.cmdid
+
+        packed = BatchedAckNamedbuffer(data)
+        self.pack(packed)
+
+        start = BatchedAckNamedbuffer.size
+        for echo in self.echoes:
+            end = start + echo_field.size_bytes
+            data[start:end] = echo
+            start = end
+
+        return packed
+
+
 class Ping(SignedMessage):
     """ Ping, should be responded by an Ack message. """
     cmdid = messages.PING
@@ -178,16 +313,16 @@ class LocksrootRejected(SignedMessage):
         rejected = LocksrootRejected(packed.echo)
 
         # this slice must be from the end of the buffer
-        rejected.signature = packed.data[-signature_field.size_bytes:]
+        signature_start = len(packed.data) - signature_field.size_bytes
+        rejected.signature = bytes_at(packed.data, signature_start, signature_field.size_bytes)
 
         # LocksrootRejected.size includes the signature size
         start = LocksrootRejectedNamedbuffer.size - signature_field.size_bytes
 
-        while start < len(packed.data) - signature_field.size_bytes:
-            end = start + secret_field.size_bytes
-            secret = packed.data[start:end]
+        while start < signature_start:
+            secret = bytes_at(packed.data, start, secret_field.size_bytes)
             rejected.secrets.append(secret)
-            start = end
+            start += secret_field.size_bytes
 
         return rejected
 
@@ -375,26 +510,30 @@ class DirectTransfer(SignedMessage):
 
     @staticmethod
     def unpack(packed):
+        fields = packed.unpack_fields()
+
         transfer = DirectTransfer(
-            packed.identifier,
-            packed.nonce,
-            packed.asset,
-            packed.transferred_amount,
-            packed.recipient,
-            packed.locksroot,
+            fields['identifier'],
+            fields['nonce'],
+            fields['asset'],
+            fields['transferred_amount'],
+            fields['recipient'],
+            fields['locksroot'],
         )
-        transfer.signature = packed.signature
+        transfer.signature = fields['signature']
 
         return transfer
 
     def pack(self, packed):
-        packed.identifier = self.identifier
-        packed.nonce = self.nonce
-        packed.asset = self.asset
-        packed.transferred_amount = self.transferred_amount
-        packed.recipient = self.recipient
-        packed.locksroot = self.locksroot
-        packed.signature = self.signature
+        packed.pack_fields(
+            identifier=self.identifier,
+            nonce=self.nonce,
+            asset=self.asset,
+            transferred_amount=self.transferred_amount,
+            recipient=self.recipient,
+            locksroot=self.locksroot,
+            signature=self.signature,
+        )
 
 
 class Lock(MessageHashable):
@@ -602,44 +741,47 @@ class MediatedTransfer(LockedTransfer):
 
     @staticmethod
     def unpack(packed):
+        fields = packed.unpack_fields()
+
         lock = Lock(
-            packed.amount,
-            packed.expiration,
-            packed.hashlock,
+            fields['amount'],
+            fields['expiration'],
+            fields['hashlock'],
         )
 
         mediated_transfer = MediatedTransfer(
-            packed.identifier,
-            packed.nonce,
-            packed.asset,
-            packed.transferred_amount,
-            packed.recipient,
-            packed.locksroot,
+            fields['identifier'],
+            fields['nonce'],
+            fields['asset'],
+            fields['transferred_amount'],
+            fields['recipient'],
+            fields['locksroot'],
             lock,
-            packed.target,
-            packed.initiator,
-            packed.fee,
+            fields['target'],
+            fields['initiator'],
+            fields['fee'],
         )
-        mediated_transfer.signature = packed.signature
+        mediated_transfer.signature = fields['signature']
         return mediated_transfer
 
     def pack(self, packed):
-        packed.identifier = self.identifier
-        packed.nonce = self.nonce
-        packed.asset = self.asset
-        packed.transferred_amount = self.transferred_amount
-        packed.recipient = self.recipient
-        packed.locksroot = self.locksroot
-        packed.target = self.target
-        packed.initiator = self.initiator
-        packed.fee = self.fee
-
         lock = self.lock
-        packed.amount = lock.amount
-        packed.expiration = lock.expiration
-        packed.hashlock = lock.hashlock
 
-        packed.signature = self.signature
+        packed.pack_fields(
+            identifier=self.identifier,
+            nonce=self.nonce,
+            asset=self.asset,
+            transferred_amount=self.transferred_amount,
+            recipient=self.recipient,
+            locksroot=self.locksroot,
+            target=self.target,
+            initiator=self.initiator,
+            fee=self.fee,
+            amount=lock.amount,
+            expiration=lock.expiration,
+            hashlock=lock.hashlock,
+            signature=self.signature,
+        )
 
 
 class RefundTransfer(LockedTransfer):
@@ -739,6 +881,7 @@ class ConfirmTransfer(SignedMessage):
 
 CMDID_TO_CLASS = {
     messages.ACK: Ack,
+    messages.BATCHEDACK: BatchedAck,
     messages.PING: Ping,
     messages.LOCKSROOT_REJECTED: LocksrootRejected,
     messages.SECRETREQUEST: SecretRequest,
@@ -758,3 +901,26 @@ CMDID_TO_CLASS = {
 def decode(data):
     klass = CMDID_TO_CLASS[data[0]]
     return klass.decode(data)
+
+
+def decode_unverified(data):
+    """ Same as `decode` but the sender of a signed message is not recovered,
+    the message's `sender` must be set from the public key recovered from the
+    returned signed data and signature.
+
+    Returns:
+        Tuple[Message, Optional[Tuple[memoryview, bytes]]]: The message and,
+        for signed messages, the signed data and the signature. The message is
+        None if the data is invalid.
+    """
+    klass = CMDID_TO_CLASS[data[0]]
+
+    if issubclass(klass, SignedMessage):
+        result = klass.decode_unverified(data)
+
+        if result is None:
+            return None, None
+
+        return result
+
+    return klass.decode(data), None
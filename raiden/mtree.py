@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 
+from bisect import bisect_left
+
 from ethereum.utils import encode_hex
 
 from raiden.utils import keccak
@@ -68,6 +70,158 @@ class Merkletree(object):
         """
         return merkleproof_from_layers(self._layers, self._layers[0].index(element))
 
+    def make_proofs(self, elements):
+        """ Return the proofs for all the `elements`, the layers are computed
+        only once for all proofs.
+        """
+        leaf_index = {
+            leaf: idx
+            for idx, leaf in enumerate(self._layers[0])
+        }
+
+        proofs = list()
+        for element in elements:
+            if element not in leaf_index:
+                raise ValueError('{} is not in the merkletree'.format(encode_hex(element)))
+
+            proofs.append(merkleproof_from_layers(self._layers, leaf_index[element]))
+
+        return proofs
+
+
+class MutableMerkletree(object):
+    """ A merkletree that is updated in place as leaves are added or removed.
+
+    The leaves are kept sorted and the pairs hashed exactly as done by
+    `merkleroot`, so `tree.merkleroot == merkleroot(tree.leaves)` holds at all
+    times. The layers are kept between updates, so only the nodes that depend
+    on a leaf at or after the changed position are rehashed and the root is
+    available without any hashing.
+
+    The nodes computed by `merkleroot_with` are kept until the next update, a
+    following `add` of the same element reuses them instead of rehashing.
+    """
+
+    def __init__(self, elements=()):
+        self._layers = list(merkletreelayers(build_lst(elements)))
+
+        if not self._layers[0]:
+            self._layers = [[]]
+
+        self._staged_element = None
+        self._staged_changes = None
+
+    @property
+    def leaves(self):
+        return self._layers[0]
+
+    @property
+    def merkleroot(self):
+        if not self.leaves:
+            return ''
+        return self._layers[-1][0]
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def __contains__(self, element):
+        idx = bisect_left(self.leaves, element)
+        return idx < len(self.leaves) and self.leaves[idx] == element
+
+    def add(self, element):
+        """ Add `element` to the tree and return the new root, adding an
+        existing element is a no-op.
+        """
+        if element in self:
+            return self.merkleroot
+
+        if element == self._staged_element:
+            changes = self._staged_changes
+        else:
+            changes = self._changes_with(element)
+
+        self._apply(changes)
+        return self.merkleroot
+
+    def remove(self, element):
+        """ Remove `element` from the tree and return the new root.
+
+        Raises:
+            ValueError: If `element` is not in the tree.
+        """
+        leaves = self.leaves
+        idx = bisect_left(leaves, element)
+
+        if idx == len(leaves) or leaves[idx] != element:
+            raise ValueError('element is not in the merkletree')
+
+        self._apply(self._rehash(idx, leaves[idx + 1:]))
+        return self.merkleroot
+
+    def merkleroot_with(self, element):
+        """ Return the root the tree would have if `element` was added, the
+        tree itself is not changed.
+        """
+        if element in self:
+            return self.merkleroot
+
+        if element != self._staged_element:
+            self._staged_changes = self._changes_with(element)
+            self._staged_element = element
+
+        _, nodes = self._staged_changes[-1]
+        if nodes:
+            return nodes[0]
+        return self._layers[len(self._staged_changes) - 1][0]
+
+    def _changes_with(self, element):
+        if len(element) != 32:
+            raise NoHash32Error()
+
+        leaves = self.leaves
+        idx = bisect_left(leaves, element)
+        return self._rehash(idx, [element] + leaves[idx:])
+
+    def _rehash(self, start, nodes):
+        """ Compute the nodes of a tree that shares the first `start` leaves
+        with this tree and has `nodes` as the remaining leaves.
+
+        Returns:
+            List[Tuple[int, List[str]]]: For each layer, the position of the
+            first changed node and the nodes from there onwards.
+        """
+        layers = self._layers
+        height = 0
+        changes = list()
+
+        while True:
+            changes.append((start, nodes))
+
+            if start + len(nodes) <= 1:
+                return changes
+
+            # the nodes to the left of the changed position are shared
+            if start % 2:
+                start -= 1
+                nodes = [layers[height][start]] + nodes
+
+            nodes = [hash_pair(a, b) for a, b in iterate_pairwise(nodes)]
+            start //= 2
+            height += 1
+
+    def _apply(self, changes):
+        layers = self._layers
+
+        for height, (start, nodes) in enumerate(changes):
+            if height == len(layers):
+                layers.append(list())
+            layers[height][start:] = nodes
+
+        del layers[len(changes):]
+
+        self._staged_element = None
+        self._staged_changes = None
+
 
 def merkleroot(elements):
     """
@@ -113,3 +267,17 @@ def get_proof(lst, proof_for, root=None):
         ))
 
     return tree.make_proof(proof_for)
+
+
+def get_proofs(lst, proofs_for, root=None):
+    """ Same as `get_proof` but for many elements of the same tree. """
+    tree = Merkletree(lst)
+
+    root_hash = tree.merkleroot
+    if root and root != root_hash:
+        raise ValueError('root hashes did not match {} {}'.format(
+            encode_hex(root_hash),
+            encode_hex(root)
+        ))
+
+    return tree.make_proofs(proofs_for)
@@ -1,7 +1,25 @@
 # -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+
+import cachetools
 import networkx
 
-from raiden.utils import isaddress
+from raiden.utils import isaddress, pex
+
+ROUTE_CACHE_SIZE = 64
+
+
+def check_edge_list(edge_list):
+    """ Raise ValueError if `edge_list` is not a list of address pairs. """
+    for edge in edge_list:
+        if len(edge) != 2:
+            raise ValueError('All values in edge_list must be of length two (origin, destination)')
+
+        origin, destination = edge
+
+        if not isaddress(origin) or not isaddress(destination):
+            raise ValueError('All values in edge_list must be valid addresses')
 
 
 def make_graph(edge_list):
@@ -16,15 +34,7 @@ def make_graph(edge_list):
         Graph A networkx.Graph instance were the graph nodes are nodes in the
             network and the edges are nodes that have a channel between them.
     """
-
-    for edge in edge_list:
-        if len(edge) != 2:
-            raise ValueError('All values in edge_list must be of length two (origin, destination)')
-
-        origin, destination = edge
-
-        if not isaddress(origin) or not isaddress(destination):
-            raise ValueError('All values in edge_list must be valid addresses')
+    check_edge_list(edge_list)
 
     graph = networkx.Graph()  # undirected graph, for bidirectional channels
 
@@ -34,16 +44,476 @@ def make_graph(edge_list):
     return graph
 
 
+def make_compact_graph(edge_list):
+    """ Same as `make_graph` but returns a CompactGraph. """
+    check_edge_list(edge_list)
+
+    return CompactGraph(edge_list)
+
+
+class CompactGraph(object):
+    """ Undirected graph for large networks, implements the subset of the
+    networkx.Graph interface used by ChannelGraph.
+
+    The addresses are interned to integer ids and the adjacency is stored in
+    compressed sparse row arrays, the neighbors of the node `i` are the
+    sorted ids in `adjacency[offsets[i]:offsets[i + 1]]`. Added and removed
+    edges are kept in an overlay until it has `compact_ratio` of the edges,
+    then the arrays are rebuilt.
+    """
+
+    compact_ratio = 1. / 16
+    min_compact_edits = 1024
+
+    def __init__(self, edge_list=()):
+        self.node_id = dict()  #: maps an address to its id
+        self.id_node = list()  #: maps an id to its address
+
+        self.offsets = array('l', [0])
+        self.adjacency = array('l')
+
+        self.added = dict()  #: maps an id to the set of ids of its added edges
+        self.removed = set()  #: (low id, high id) of the removed edges
+        self.edits = 0
+
+        self._build([
+            (self._intern(first), self._intern(second))
+            for first, second in edge_list
+        ])
+
+    def _intern(self, node):
+        node_id = self.node_id.get(node)
+
+        if node_id is None:
+            node_id = len(self.id_node)
+            self.node_id[node] = node_id
+            self.id_node.append(node)
+
+        return node_id
+
+    def _build(self, id_edges):
+        """ Rebuild the arrays from the (id, id) pairs in `id_edges` and clear
+        the overlay.
+        """
+        id_edges = set(
+            edge_key(first_id, second_id)
+            for first_id, second_id in id_edges
+            if first_id != second_id
+        )
+        number_of_nodes = len(self.id_node)
+
+        degree = array('l', [0]) * number_of_nodes
+        for first_id, second_id in id_edges:
+            degree[first_id] += 1
+            degree[second_id] += 1
+
+        offsets = array('l', [0]) * (number_of_nodes + 1)
+        for node_id in xrange(number_of_nodes):
+            offsets[node_id + 1] = offsets[node_id] + degree[node_id]
+
+        adjacency = array('l', [0]) * offsets[number_of_nodes]
+        position = offsets[:number_of_nodes]
+        for first_id, second_id in id_edges:
+            adjacency[position[first_id]] = second_id
+            position[first_id] += 1
+            adjacency[position[second_id]] = first_id
+            position[second_id] += 1
+
+        for node_id in xrange(number_of_nodes):
+            start, end = offsets[node_id], offsets[node_id + 1]
+            adjacency[start:end] = array('l', sorted(adjacency[start:end]))
+
+        self.offsets = offsets
+        self.adjacency = adjacency
+        self.added = dict()
+        self.removed = set()
+        self.edits = 0
+
+    def _compact(self):
+        self._build([
+            (first_id, second_id)
+            for first_id in xrange(len(self.id_node))
+            for second_id in self.neighbor_ids(first_id)
+            if first_id < second_id
+        ])
+
+    def _edited(self):
+        self.edits += 1
+
+        max_edits = max(self.min_compact_edits, len(self.adjacency) * self.compact_ratio)
+        if self.edits > max_edits:
+            self._compact()
+
+    def neighbor_ids(self, node_id):
+        """ Return the list of the ids of the neighbors of `node_id`. """
+        neighbor_ids = []
+
+        if node_id + 1 < len(self.offsets):
+            start, end = self.offsets[node_id], self.offsets[node_id + 1]
+            neighbor_ids = self.adjacency[start:end].tolist()
+
+            if self.removed:
+                removed = self.removed
+                neighbor_ids = [
+                    neighbor_id
+                    for neighbor_id in neighbor_ids
+                    if edge_key(node_id, neighbor_id) not in removed
+                ]
+
+        added = self.added.get(node_id)
+        if added:
+            neighbor_ids.extend(added)
+
+        return neighbor_ids
+
+    def _has_edge_ids(self, first_id, second_id):
+        if edge_key(first_id, second_id) in self.removed:
+            return False
+
+        if second_id in self.added.get(first_id, ()):
+            return True
+
+        if first_id + 1 < len(self.offsets):
+            start, end = self.offsets[first_id], self.offsets[first_id + 1]
+            index = bisect_left(self.adjacency, second_id, start, end)
+            return index < end and self.adjacency[index] == second_id
+
+        return False
+
+    def __contains__(self, node):
+        return node in self.node_id
+
+    def __len__(self):
+        return len(self.id_node)
+
+    def __getitem__(self, node):
+        """ Return the list of the neighbors of `node`. """
+        id_node = self.id_node
+        return [
+            id_node[neighbor_id]
+            for neighbor_id in self.neighbor_ids(self.node_id[node])
+        ]
+
+    def neighbors(self, node):
+        return self[node]
+
+    def degree(self, node):
+        return len(self.neighbor_ids(self.node_id[node]))
+
+    def nodes(self):
+        return list(self.id_node)
+
+    def edges(self):
+        id_node = self.id_node
+        return [
+            (id_node[first_id], id_node[second_id])
+            for first_id in xrange(len(id_node))
+            for second_id in self.neighbor_ids(first_id)
+            if first_id < second_id
+        ]
+
+    def number_of_nodes(self):
+        return len(self.id_node)
+
+    def has_edge(self, first, second):
+        first_id = self.node_id.get(first)
+        second_id = self.node_id.get(second)
+
+        if first_id is None or second_id is None:
+            return False
+
+        return self._has_edge_ids(first_id, second_id)
+
+    def add_edge(self, first, second):
+        first_id = self._intern(first)
+        second_id = self._intern(second)
+
+        if self._has_edge_ids(first_id, second_id):
+            return
+
+        key = edge_key(first_id, second_id)
+        if key in self.removed:
+            self.removed.remove(key)
+        else:
+            self.added.setdefault(first_id, set()).add(second_id)
+            self.added.setdefault(second_id, set()).add(first_id)
+
+        self._edited()
+
+    def remove_edge(self, first, second):
+        if not self.has_edge(first, second):
+            raise networkx.NetworkXError(
+                'The edge {}-{} is not in the graph'.format(pex(first), pex(second))
+            )
+
+        first_id = self.node_id[first]
+        second_id = self.node_id[second]
+
+        first_added = self.added.get(first_id)
+        if first_added is not None and second_id in first_added:
+            first_added.remove(second_id)
+            self.added[second_id].remove(first_id)
+        else:
+            self.removed.add(edge_key(first_id, second_id))
+
+        self._edited()
+
+
+def edge_key(first_id, second_id):
+    if first_id < second_id:
+        return (first_id, second_id)
+    return (second_id, first_id)
+
+
+class ShortestPathsDAG(object):
+    """ The breadth-first search tree of a source node, keeps all the
+    predecessors of a node that are in one of its shortest paths, so it
+    represents the shortest paths from the source to all the other nodes.
+
+    The search works on node keys, for a networkx graph the key is the node
+    itself.
+    """
+
+    def __init__(self, graph, source):
+        self.graph = graph
+        self.source = self._key(source)
+        self.distance = {self.source: 0}  #: maps a node key to its number of hops from source
+        self.predecessors = {self.source: []}  #: maps a node key to its previous hops
+
+        distance = self.distance
+        predecessors = self.predecessors
+        neighbors = self._neighbors
+
+        level = [self.source]
+        hops = 0
+        while level:
+            hops += 1
+            next_level = []
+
+            for node in level:
+                for neighbor in neighbors(node):
+                    neighbor_distance = distance.get(neighbor)
+
+                    if neighbor_distance is None:
+                        distance[neighbor] = hops
+                        predecessors[neighbor] = [node]
+                        next_level.append(neighbor)
+
+                    elif neighbor_distance == hops:
+                        predecessors[neighbor].append(node)
+
+            level = next_level
+
+        self.target_paths = dict()  #: maps a target key to the list of its shortest paths
+
+    def _key(self, node):  # pylint: disable=no-self-use
+        return node
+
+    def _node(self, key):  # pylint: disable=no-self-use
+        return key
+
+    def _neighbors(self, key):
+        return self.graph[key]
+
+    def _degree(self, key):
+        return self.graph.degree(key)
+
+    def is_reachable(self, target):
+        return self._key(target) in self.distance
+
+    def shortest_paths(self, target):
+        """ Return a list with all the shortest paths from source to `target`. """
+        target = self._key(target)
+        paths = self.target_paths.get(target)
+
+        if paths is None:
+            paths = list(self._iter_paths(target))
+            self.target_paths[target] = paths
+
+        return paths
+
+    def _iter_paths(self, target):
+        if target not in self.predecessors:
+            return
+
+        # depth-first walk from the target to the source through the
+        # predecessors, the stack keeps the index of the next predecessor to
+        # follow
+        stack = [[target, 0]]
+        top = 0
+        while top >= 0:
+            node, index = stack[top]
+
+            if node == self.source:
+                yield [self._node(entry[0]) for entry in reversed(stack[:top + 1])]
+
+            node_predecessors = self.predecessors[node]
+            if index < len(node_predecessors):
+                stack[top][1] = index + 1
+                top += 1
+
+                if top == len(stack):
+                    stack.append([node_predecessors[index], 0])
+                else:
+                    stack[top] = [node_predecessors[index], 0]
+            else:
+                top -= 1
+
+    def paths_of_length(self, num_hops):
+        """ Return one shortest path for each node that is `num_hops` away. """
+        result = []
+        for node, distance in self.distance.iteritems():
+            if distance == num_hops:
+                path = [node]
+                while path[-1] != self.source:
+                    path.append(self.predecessors[path[-1]][0])
+                path.reverse()
+                result.append([self._node(key) for key in path])
+
+        return result
+
+    def edge_added(self, first, second):
+        """ Update the search tree for the new edge (first, second), the edge
+        must already be in the graph.
+
+        Returns:
+            bool: False if the search tree cannot be updated and needs to be
+            recomputed.
+        """
+        first = self._key(first)
+        second = self._key(second)
+        first_distance = self.distance.get(first)
+        second_distance = self.distance.get(second)
+
+        # the edge is in a part of the graph that is not reachable
+        if first_distance is None and second_distance is None:
+            return True
+
+        if first_distance is None or second_distance is None:
+            if first_distance is None:
+                first, second = second, first
+                first_distance = second_distance
+
+            # a new leaf node, otherwise a whole component became reachable
+            if self._degree(second) != 1:
+                return False
+
+            self.distance[second] = first_distance + 1
+            self.predecessors[second] = [first]
+            self.target_paths.pop(second, None)
+            return True
+
+        # the edge does not shorten or add a shortest path
+        if first_distance == second_distance:
+            return True
+
+        if first_distance > second_distance:
+            first, second = second, first
+            first_distance, second_distance = second_distance, first_distance
+
+        # a new shortest path for `second`, and for all the nodes that have
+        # `second` in its shortest paths
+        if second_distance == first_distance + 1:
+            self.predecessors[second].append(first)
+            self.target_paths.clear()
+            return True
+
+        return False
+
+    def edge_removed(self, first, second):
+        """ Update the search tree for the removed edge (first, second).
+
+        Returns:
+            bool: False if the search tree cannot be updated and needs to be
+            recomputed.
+        """
+        first = self._key(first)
+        second = self._key(second)
+        first_distance = self.distance.get(first)
+        second_distance = self.distance.get(second)
+
+        if first_distance is None or first_distance == second_distance:
+            return True
+
+        if first_distance > second_distance:
+            first, second = second, first
+
+        second_predecessors = self.predecessors[second]
+
+        # the edge must be in the search tree since both nodes are reachable
+        # and in adjacent levels
+        second_predecessors.remove(first)
+
+        # there is another shortest path so the distances did not change
+        if second_predecessors:
+            self.target_paths.clear()
+            return True
+
+        return False
+
+
+class CompactShortestPathsDAG(ShortestPathsDAG):
+    """ ShortestPathsDAG for a CompactGraph, the search works on the interned
+    ids instead of the addresses.
+    """
+
+    def _key(self, node):
+        return self.graph.node_id.get(node)
+
+    def _node(self, key):
+        return self.graph.id_node[key]
+
+    def _neighbors(self, key):
+        return self.graph.neighbor_ids(key)
+
+    def _degree(self, key):
+        return len(self.graph.neighbor_ids(key))
+
+
+# maps the name of a backend to the graph factory and the search tree class
+GRAPH_BACKENDS = {
+    'networkx': (make_graph, ShortestPathsDAG),
+    'compact': (make_compact_graph, CompactShortestPathsDAG),
+}
+
+
 class ChannelGraph(object):
-    """ Has Graph based on the channels and can find path between participants. """
+    """ Has Graph based on the channels and can find path between participants.
 
-    def __init__(self, edge_list):
+    The shortest paths are cached per source node and updated when an edge is
+    added or removed, the graph must only be changed through `add_path` and
+    `remove_path`.
+    """
+
+    def __init__(self, edge_list, backend='networkx'):
         """
         Args:
             edge_list (List[(address1, address2)]): all the netting contracts
                 that participate in the network.
+            backend (str): The graph implementation, `networkx` or `compact`
+                for a CompactGraph.
         """
-        self.graph = make_graph(edge_list)
+        graph_factory, self.dag_class = GRAPH_BACKENDS[backend]
+        self.graph = graph_factory(edge_list)
+
+        #: maps a source to its ShortestPathsDAG
+        self.source_dag = cachetools.LRUCache(ROUTE_CACHE_SIZE)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _get_dag(self, source):
+        dag = self.source_dag.get(source)
+
+        if dag is None:
+            self.misses += 1
+            dag = self.dag_class(self.graph, source)
+            self.source_dag[source] = dag
+        else:
+            self.hits += 1
+
+        return dag
 
     def get_shortest_paths(self, source, target):
         """Compute all shortest paths in the graph.
@@ -51,11 +521,24 @@ class ChannelGraph(object):
         Returns:
             generator of lists: A generator of all paths between source and
             target.
+
+        Raises:
+            networkx.NetworkXNoPath: If there is no path between source and
+            target.
         """
         if not isaddress(source) or not isaddress(target):
             raise ValueError('both source and target must be valid addresses')
 
-        return networkx.all_shortest_paths(self.graph, source, target)
+        if source not in self.graph:
+            raise networkx.NetworkXError('source node %s not in graph' % source)
+
+        paths = self._get_dag(source).shortest_paths(target)
+
+        if not paths:
+            raise networkx.NetworkXNoPath()
+
+        # copy the paths, the cached lists must not be changed by the callers
+        return (list(path) for path in paths)
 
     def get_paths_of_length(self, source, num_hops=1):
         """ Searchs for all nodes that are `num_hops` away.
@@ -64,27 +547,45 @@ class ChannelGraph(object):
             list of paths: A list of all shortest paths that have length
             `num_hops + 1`
         """
-        # return a dictionary keyed by targets
-        # with a list of nodes in a shortest path
-        # from the source to one of the targets.
-        all_paths = networkx.shortest_path(self.graph, source)
+        if source not in self.graph:
+            raise networkx.NetworkXError('source node %s not in graph' % source)
 
-        return [
-            path
-            for path in all_paths.values()
-            if len(path) == num_hops + 1
-        ]
+        return self._get_dag(source).paths_of_length(num_hops)
 
     def has_path(self, source, target):
         """ Return True if there is a path connecting source and target, False
         otherwise.
         """
-        return networkx.has_path(self.graph, source, target)
+        if source not in self.graph:
+            raise networkx.NetworkXError('source node %s not in graph' % source)
+
+        return self._get_dag(source).is_reachable(target)
 
     def add_path(self, from_, to_):
         """ Add a new edge into the network. """
+        if self.graph.has_edge(from_, to_):
+            return
+
         self.graph.add_edge(from_, to_)
 
+        for source, dag in self.source_dag.items():
+            if not dag.edge_added(from_, to_):
+                self.invalidations += 1
+                del self.source_dag[source]
+
     def remove_path(self, from_, to_):
         """ Remove an edge from the network. """
         self.graph.remove_edge(from_, to_)
+
+        for source, dag in self.source_dag.items():
+            if not dag.edge_removed(from_, to_):
+                self.invalidations += 1
+                del self.source_dag[source]
+
+    def get_stats(self):
+        return {
+            'cached_sources': len(self.source_dag),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
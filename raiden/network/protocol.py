@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+from __future__ import division
+
 import logging
+import random
 import time
 from collections import namedtuple
 from collections import defaultdict
@@ -10,10 +13,21 @@ from gevent.queue import Queue
 from gevent.event import AsyncResult, Event
 from ethereum import slogging
 
-from raiden.messages import decode, Ack, Ping, SignedMessage
+from raiden.encoding.signing import SENDER_CACHE
+from raiden.network.signer import PendingSignature
+from raiden.messages import (
+    decode,
+    decode_unverified,
+    Ack,
+    BatchedAck,
+    DirectTransfer,
+    MediatedTransfer,
+    Ping,
+    SignedMessage,
+)
 from raiden.transfermanager import UnknownAddress, UnknownAssetAddress
 from raiden.channel import InvalidLocksRoot, InvalidNonce
-from raiden.utils import isaddress, sha3, pex
+from raiden.utils import isaddress, keccak_parts, publickey_to_address, sha3, pex
 
 log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -22,6 +36,17 @@ log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 #   logging purposes)
 WaitAck = namedtuple('WaitAck', ('ack_result', 'receiver_address'))
 
+# A message queued before its signature was ready, the echohash is known only
+# once the message is signed
+# - pending_signature is the PendingSignature of the message
+# - ack_result is the AsyncResult returned to the caller of send_async
+PendingMessage = namedtuple('PendingMessage', ('pending_signature', 'ack_result'))
+
+# Messages that the receiver validates in order using the nonce, a message that
+# arrives out-of-order is rejected without an Ack and will be resent, so these
+# can be sent without waiting for the Ack of the previous message
+PIPELINED_MESSAGES = (DirectTransfer, MediatedTransfer)
+
 CACHE_TTL = 60
 TTL_CACHE = cachetools.TTLCache(maxsize=50, ttl=CACHE_TTL)
 
@@ -41,6 +66,10 @@ class NotifyingQueue(Event):
     def empty(self):
         return self._queue.empty()
 
+    def peek(self):
+        """ Returns the next item without removing it from the queue. """
+        return self._queue.peek(block=False)
+
     def get(self, block=True, timeout=None):
         """ Removes and returns an item from the queue. """
         value = self._queue.get(block, timeout)
@@ -53,6 +82,147 @@ class NotifyingQueue(Event):
         self.set()
 
 
+class ExpiringCache(object):
+    """ A dictionary that forgets its entries after a while.
+
+    The entries are kept in two generations, new entries are added to the
+    current generation, once it is `ttl` seconds old or has `maxsize` entries
+    it becomes the previous generation and the old previous generation is
+    dropped. An entry is kept for at least `ttl` seconds, unless more than
+    `maxsize` entries are added in the meantime, and at most `2 * ttl` seconds.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.current = dict()
+        self.previous = dict()
+        self.generation_start = time.time()
+
+        # number of entries dropped since the cache was created
+        self.evicted = 0
+
+    def _rotate(self):
+        now = time.time()
+        age = now - self.generation_start
+
+        if age < self.ttl and len(self.current) < self.maxsize:
+            return
+
+        self.evicted += len(self.previous)
+
+        if age < 2 * self.ttl:
+            self.previous = self.current
+        else:
+            # the current generation expired too
+            self.evicted += len(self.current)
+            self.previous = dict()
+
+        self.current = dict()
+        self.generation_start = now
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def __contains__(self, key):
+        self._rotate()
+        return key in self.current or key in self.previous
+
+    def __setitem__(self, key, value):
+        self._rotate()
+        self.previous.pop(key, None)
+        self.current[key] = value
+
+    def get(self, key, default=None):
+        self._rotate()
+
+        if key in self.current:
+            return self.current[key]
+
+        return self.previous.get(key, default)
+
+    def pop(self, key, default=None):
+        if key in self.current:
+            return self.current.pop(key)
+
+        return self.previous.pop(key, default)
+
+    def itervalues(self):
+        for value in self.current.itervalues():
+            yield value
+
+        for value in self.previous.itervalues():
+            yield value
+
+
+class SentMessage(object):
+    """ A message that was sent and is waiting for the Ack. """
+
+    def __init__(self, message, messagedata, echohash, waitack, retries_left):
+        self.message = message
+        self.messagedata = messagedata
+        self.echohash = echohash
+        self.waitack = waitack
+        self.retries_left = retries_left
+        self.attempts = 0
+        self.resend_at = None
+        self.backoff = 0  #: the backoff of the node's timer when last sent
+
+
+class RetransmissionTimer(object):
+    """ Computes the retransmission timeout for a node from the measured round
+    trip times, as described by RFC 6298.
+
+    The timeout is doubled every time a message to the node times out and is
+    kept for all its messages until a new round trip time is measured, so a
+    new message to an unresponsive node does not start from the initial
+    timeout.
+    """
+
+    def __init__(self, initial_timeout, min_timeout, max_timeout, jitter):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.jitter = jitter
+
+        self.smoothed_rtt = None
+        self.rtt_variation = None
+        self.timeout = initial_timeout
+        self.backoff = 0  #: number of times the timeout was doubled
+
+    def add_sample(self, rtt):
+        """ Update the estimation with the round trip time of a message that
+        was not retransmitted.
+        """
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variation = rtt / 2
+        else:
+            self.rtt_variation = 0.75 * self.rtt_variation + 0.25 * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = 0.875 * self.smoothed_rtt + 0.125 * rtt
+
+        timeout = self.smoothed_rtt + 4 * self.rtt_variation
+        self.timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+        self.backoff = 0
+
+    def timed_out(self, backoff):
+        """ Double the timeout after a message sent with `backoff` timed out.
+
+        The messages sent with the same timeout back off only once, so the
+        messages in flight at the same time don't double it more than once.
+        """
+        if backoff == self.backoff and self.timeout * 2 ** self.backoff < self.max_timeout:
+            self.backoff += 1
+
+    def next_timeout(self):
+        """ Return how long to wait for the Ack of a message sent now, the
+        timeout is randomized to avoid synchronized retries from different
+        nodes.
+        """
+        timeout = min(self.timeout * 2 ** self.backoff, self.max_timeout)
+        return timeout * random.uniform(1, 1 + self.jitter)
+
+
 class RaidenProtocol(object):
     """ Encode the message into a packet and send it.
 
@@ -61,46 +231,158 @@ class RaidenProtocol(object):
 
     Repeat sending messages until an acknowledgment is received or the maximum
     number of retries is hit.
+
+    Up to `window_size` messages of a queue can be waiting for an Ack at the
+    same time, as long as all of them are `PIPELINED_MESSAGES`, any other
+    message is only sent once all the previous messages are acknowledged and
+    is the only message in flight.
+
+    The time to wait for an Ack is estimated for each node from the round trip
+    time of the previous messages, `try_interval` is used until the first Ack
+    is received. The timeouts of a node back off together, across all the
+    messages sent to it.
+
+    The Acks for a node are delayed by `ack_delay` seconds and sent together
+    in a BatchedAck, with the default delay only the messages handled before
+    the event loop runs again are acknowledged together.
+
+    If a `recovery_pool` is given the senders of the signed messages are
+    recovered by other processes, the messages are still handled in the order
+    they were received.
+
+    A message that is still being signed keeps its place in the queue, the
+    messages queued after it are sent once it is signed and sent.
     """
 
     try_interval = 1.
+    min_try_interval = 0.05
+    max_try_interval = 10.
+    try_interval_jitter = 0.1
     max_retries = 5
     max_message_size = 1200
+    window_size = 4
+    ack_ttl = 600
+    ack_maxsize = 100000
+    ack_delay = 0
+
+    def __init__(
+            self,
+            transport,
+            discovery,
+            raiden,
+            max_retries=None,
+            ack_ttl=None,
+            ack_maxsize=None,
+            recovery_pool=None,
+            channel_store=None):
 
-    def __init__(self, transport, discovery, raiden):
         self.transport = transport
         self.discovery = discovery
         self.raiden = raiden
 
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+        if ack_ttl is not None:
+            self.ack_ttl = ack_ttl
+
+        if ack_maxsize is not None:
+            self.ack_maxsize = ack_maxsize
+
         # Messages are sent in-order for each partner
         self.address_queue = dict()
         self.address_greenlet = dict()
 
-        # TODO: remove old ACKs from the dict to free memory
-        # The Ack for a processed message, used to avoid re-processing a known
-        # message
-        self.echohash_acks = dict()
+        # The address of the sender of a processed message, used to avoid
+        # re-processing a known message and resend its Ack, a message received
+        # again after its Ack expired must be rejected by the handler (e.g.
+        # because of the transfer nonce)
+        self.echohash_acks = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+
+        # The echohashes of the messages being handled, a retransmission that
+        # arrives in the meantime is dropped without decoding it
+        self.echohash_inflight = set()
+
+        # The echohashes waiting to be acknowledged for each address and the
+        # greenlet that will send them
+        self.address_pending_acks = dict()
+        self.address_ack_greenlet = dict()
 
-        # Maps the echo hash `sha3(message + address)` to a WaitAck tuple
+        # Maps the echo hash `sha3(message + address)` to a WaitAck tuple for
+        # the messages that are waiting for an Ack
         self.echohash_asyncresult = dict()
 
+        # The WaitAck tuples of the acknowledged messages and of the pings,
+        # used to detect duplicated Acks and messages
+        self.echohash_recent_asyncresult = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+
+        # The time a message was sent, only for messages that were not
+        # retransmitted since the Ack cannot be tied to a specific transmission
+        self.echohash_senttime = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+
+        # Maps an address to its RetransmissionTimer
+        self.address_timer = dict()
+
         # Maps an address to timestamp representing last time any kind of messsage
         # was received for that address
         self.last_received_time = dict()
 
         self._ping_nonces = defaultdict(int)
 
+        # Optional RecoveryPool used to recover the senders of the received
+        # messages in other processes, the messages waiting for their sender
+        # are queued in the order they were received
+        self.recovery_pool = recovery_pool
+        self.recovery_queue = Queue()
+        self.recovery_greenlet = None
+
+        # Optional ChannelStore, the state changes are committed before a new
+        # message or an Ack is sent, so a message is never sent for a state
+        # that could be lost by a crash
+        self.channel_store = channel_store
+
     def stop_async(self):
         for greenlet in self.address_greenlet.itervalues():
             greenlet.kill()
 
+        if self.recovery_greenlet is not None:
+            self.recovery_greenlet.kill()
+            self.recovery_greenlet = None
+            self.recovery_queue = Queue()
+
+        gevent.killall(self.address_ack_greenlet.values())
+
         for waitack in self.echohash_asyncresult.itervalues():
             waitack.ack_result.set(False)
 
+        for waitack in self.echohash_recent_asyncresult.itervalues():
+            if not waitack.ack_result.ready():
+                waitack.ack_result.set(False)
+
         self.address_queue = dict()
         self.address_greenlet = dict()
-        self.echohash_acks = dict()
+        self.address_pending_acks = dict()
+        self.address_ack_greenlet = dict()
+        self.echohash_acks = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+        self.echohash_inflight = set()
         self.echohash_asyncresult = dict()
+        self.echohash_recent_asyncresult = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+        self.echohash_senttime = ExpiringCache(self.ack_ttl, self.ack_maxsize)
+
+    def get_stats(self):
+        """ Return the number of entries kept to track the Acks and the number
+        of entries that expired, and the hit rate of the sender cache.
+        """
+        return {
+            'sender_cache_hits': SENDER_CACHE.hits,
+            'sender_cache_misses': SENDER_CACHE.misses,
+            'acks': len(self.echohash_acks),
+            'acks_evicted': self.echohash_acks.evicted,
+            'inflight': len(self.echohash_inflight),
+            'waiting_ack': len(self.echohash_asyncresult),
+            'recent_asyncresult': len(self.echohash_recent_asyncresult),
+            'recent_asyncresult_evicted': self.echohash_recent_asyncresult.evicted,
+        }
 
     def stop_and_wait(self):
         self.stop_async()
@@ -111,60 +393,196 @@ class RaidenProtocol(object):
         host_port = self.discovery.get(receiver_address)
         return host_port
 
+    def get_timer(self, receiver_address):
+        timer = self.address_timer.get(receiver_address)
+
+        if timer is None:
+            timer = RetransmissionTimer(
+                self.try_interval,
+                self.min_try_interval,
+                self.max_try_interval,
+                self.try_interval_jitter,
+            )
+            self.address_timer[receiver_address] = timer
+
+        return timer
+
     def _send_queued_messages(self, receiver_address, queue_name):
         # Note: this task can be killed at any time
 
         queue = self.address_queue[(receiver_address, queue_name)]
 
-        while queue.wait():
-            # avoid reserializing the message and calculate it's hash
-            message, messagedata, echohash = queue.get()
+        # the messages waiting for an Ack, in the order they were queued
+        inflight = list()
 
-            waitack = self.echohash_asyncresult[echohash]
+        while True:
+            while self._can_send_next(queue, inflight):
+                # avoid reserializing the message and calculate it's hash
+                message, messagedata, echohash = queue.get()
 
-            if log.isEnabledFor(logging.INFO):
-                log.info(
-                    'SENDING %s -> %s echohash:%s %s',
-                    pex(self.raiden.address),
-                    pex(receiver_address),
-                    pex(echohash),
+                if messagedata is None:
+                    signed = self._signed_messagedata(receiver_address, message, echohash)
+
+                    if signed is None:
+                        continue
+
+                    messagedata, echohash = signed
+
+                sent = SentMessage(
                     message,
+                    messagedata,
+                    echohash,
+                    self.echohash_asyncresult[echohash],
+                    self.max_retries,
                 )
+                inflight.append(sent)
+                self._transmit(receiver_address, sent)
+
+            pending_signature = self._next_pending_signature(queue)
+
+            if not inflight:
+                if pending_signature is not None:
+                    pending_signature.wait()
+                    continue
+
+                queue.wait()
+
+                if queue.empty():  # stop was requested
+                    return
+
+                continue
+
+            waitables = [sent.waitack.ack_result for sent in inflight]
+            if pending_signature is not None:
+                waitables.append(pending_signature)
+            elif queue.empty() and len(inflight) < self.window_size:
+                waitables.append(queue)
+
+            timeout = min(sent.resend_at for sent in inflight) - time.time()
+            gevent.wait(waitables, timeout=max(timeout, 0), count=1)
+
+            now = time.time()
+            for sent in list(inflight):
+                # ack_result can be False
+                if sent.waitack.ack_result.ready():
+                    inflight.remove(sent)
+
+                elif sent.resend_at <= now:
+                    sent.retries_left -= 1
+                    self.get_timer(receiver_address).timed_out(sent.backoff)
+
+                    # TODO: The graph should be updated and the node should be marked
+                    #       as temporarily unreachable, so that get_best_routes don't
+                    #       try this route when looking for a path.
+                    # XXX: How should it be marked available again?
+
+                    if sent.retries_left < 1:
+                        if log.isEnabledFor(logging.ERROR):
+                            log.error(
+                                'DEACTIVATED MSG resents %s %s',
+                                pex(receiver_address),
+                                sent.message,
+                            )
+                        sent.waitack.ack_result.set(False)
+                        self.echohash_asyncresult.pop(sent.echohash, None)
+                        self.echohash_senttime.pop(sent.echohash, None)
+                        inflight.remove(sent)
+                    else:
+                        self._transmit(receiver_address, sent)
+
+    def _can_send_next(self, queue, inflight):
+        """ True if the next message in the `queue` can be sent while the
+        `inflight` messages are waiting for their Ack.
+        """
+        if queue.empty() or len(inflight) >= self.window_size:
+            return False
+
+        if self._next_pending_signature(queue) is not None:
+            return False
+
+        if not inflight:
+            return True
+
+        next_message = queue.peek()[0]
+        return isinstance(next_message, PIPELINED_MESSAGES) and all(
+            isinstance(sent.message, PIPELINED_MESSAGES)
+            for sent in inflight
+        )
 
-            host_port = self.get_host_port(receiver_address)
-            self.transport.send(self.raiden, host_port, messagedata)
+    @staticmethod
+    def _next_pending_signature(queue):
+        """ The PendingSignature of the next message in the `queue` if the
+        message is not signed yet, otherwise None.
+        """
+        if queue.empty():
+            return None
+
+        _, messagedata, pending = queue.peek()
+        if messagedata is None and not pending.pending_signature.ready():
+            return pending.pending_signature
+
+        return None
+
+    def _signed_messagedata(self, receiver_address, message, pending):
+        """ Register the Ack of a message that was queued before it was signed.
+
+        Returns:
+            Tuple[bytes, bytes]: The message data and echohash, or None if the
+            message could not be signed or was already queued.
+        """
+        try:
+            pending.pending_signature.get()
+        except ValueError:
+            if log.isEnabledFor(logging.ERROR):
+                log.error('could not sign the message %s', message)
+            pending.ack_result.set(False)
+            return None
 
-            retries_left = self.max_retries
+        messagedata = message.encode()
+        if len(messagedata) > self.max_message_size:
+            if log.isEnabledFor(logging.ERROR):
+                log.error('message size exceeds the maximum %s', message)
+            pending.ack_result.set(False)
+            return None
 
-            # ack_result can be False
-            while waitack.ack_result.wait(timeout=self.try_interval) is None:
-                retries_left -= 1
+        echohash = sha3(messagedata + receiver_address)
 
-                # TODO: The graph should be updated and the node should be marked
-                #       as temporarily unreachable, so that get_best_routes don't
-                #       try this route when looking for a path.
-                # XXX: How should it be marked available again?
+        waitack = self._get_waitack(echohash)
+        if waitack is not None:
+            # the same message was queued more than once
+            waitack.ack_result.rawlink(lambda result: pending.ack_result.set(result.value))
+            return None
 
-                if retries_left < 1:
-                    if log.isEnabledFor(logging.ERROR):
-                        log.error(
-                            'DEACTIVATED MSG resents %s %s',
-                            pex(receiver_address),
-                            message,
-                        )
-                    waitack.ack_result.set(False)
-                    break
+        self.echohash_asyncresult[echohash] = WaitAck(pending.ack_result, receiver_address)
+        return messagedata, echohash
 
-                if log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'SENDING %s -> %s echohash:%s %s',
-                        pex(self.raiden.address),
-                        pex(receiver_address),
-                        pex(echohash),
-                        message,
-                    )
+    def _transmit(self, receiver_address, sent):
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                'SENDING %s -> %s echohash:%s %s',
+                pex(self.raiden.address),
+                pex(receiver_address),
+                pex(sent.echohash),
+                sent.message,
+            )
+
+        if sent.attempts == 0:
+            self._commit_state()
+
+        host_port = self.get_host_port(receiver_address)
+        self.transport.send(self.raiden, host_port, sent.messagedata)
+
+        now = time.time()
+        sent.attempts += 1
 
-                self.transport.send(self.raiden, host_port, messagedata)
+        if sent.attempts == 1:
+            self.echohash_senttime[sent.echohash] = now
+        else:
+            self.echohash_senttime.pop(sent.echohash, None)
+
+        timer = self.get_timer(receiver_address)
+        sent.backoff = timer.backoff
+        sent.resend_at = now + timer.next_timeout()
 
     def _send(self, receiver_address, queue_name, message, messagedata, echohash):
         key = (receiver_address, queue_name)
@@ -189,25 +607,70 @@ class RaidenProtocol(object):
         # message data in echohash_asyncresult
         self.address_queue[key].put((message, messagedata, echohash))
 
-    def _send_ack(self, host_port, messagedata):
+    def _send_ack(self, receiver_address, echohash):
         # ACK should not go into the queue
+        pending = self.address_pending_acks.setdefault(receiver_address, list())
+
+        if echohash not in pending:
+            pending.append(echohash)
+
+        if len(pending) >= BatchedAck.max_echoes:
+            self._flush_acks(receiver_address)
+
+        elif receiver_address not in self.address_ack_greenlet:
+            self.address_ack_greenlet[receiver_address] = gevent.spawn_later(
+                self.ack_delay,
+                self._flush_acks,
+                receiver_address,
+            )
+
+    def _commit_state(self):
+        if self.channel_store is not None:
+            self.channel_store.commit()
+
+    def _flush_acks(self, receiver_address):
+        greenlet = self.address_ack_greenlet.get(receiver_address)
+        if greenlet is gevent.getcurrent():
+            del self.address_ack_greenlet[receiver_address]
+
+        echohashes = self.address_pending_acks.pop(receiver_address, None)
+        if not echohashes:
+            return
+
+        self._commit_state()
+
+        if len(echohashes) == 1:
+            ack = Ack(self.raiden.address, echohashes[0])
+        else:
+            ack = BatchedAck(self.raiden.address, echohashes)
+
         self.transport.send(
             self.raiden,
-            host_port,
-            messagedata,
+            self.get_host_port(receiver_address),
+            ack.encode(),
         )
 
     def send_async(self, receiver_address, message):
+        """ Queue `message` to be sent to `receiver_address`.
+
+        The message can be a PendingSignature, the message is queued in order
+        and sent once it is signed.
+        """
         if not isaddress(receiver_address):
             raise ValueError('Invalid address {}'.format(pex(receiver_address)))
 
-        if isinstance(message, Ack):
-            raise ValueError('Do not use send for Ack messages or Errors')
+        if isinstance(message, PendingSignature):
+            if not message.ready():
+                return self._send_pending(receiver_address, message)
 
-        if len(message.encode()) > self.max_message_size:
-            raise ValueError('message size exceeds the maximum {}'.format(self.max_message_size))
+            message = message.get()
+
+        if isinstance(message, (Ack, BatchedAck)):
+            raise ValueError('Do not use send for Ack messages or Errors')
 
         messagedata = message.encode()
+        if len(messagedata) > self.max_message_size:
+            raise ValueError('message size exceeds the maximum {}'.format(self.max_message_size))
 
         # Adding the receiver address into the echohash to avoid collisions
         # among different receivers.
@@ -218,7 +681,8 @@ class RaidenProtocol(object):
         echohash = sha3(messagedata + receiver_address)
 
         # Don't add the same message twice into the queue
-        if echohash not in self.echohash_asyncresult:
+        waitack = self._get_waitack(echohash)
+        if waitack is None:
             ack_result = AsyncResult()
             self.echohash_asyncresult[echohash] = WaitAck(ack_result, receiver_address)
 
@@ -227,17 +691,39 @@ class RaidenProtocol(object):
 
             self._send(receiver_address, queue_name, message, messagedata, echohash)
         else:
-            waitack = self.echohash_asyncresult[echohash]
             ack_result = waitack.ack_result
 
         return ack_result
 
+    def _send_pending(self, receiver_address, pending_signature):
+        ack_result = AsyncResult()
+        message = pending_signature.message
+
+        # state changes are local to each channel/asset
+        queue_name = getattr(message, 'asset', '')
+
+        pending = PendingMessage(pending_signature, ack_result)
+        self._send(receiver_address, queue_name, message, None, pending)
+
+        return ack_result
+
+    def _get_waitack(self, echohash):
+        waitack = self.echohash_asyncresult.get(echohash)
+
+        if waitack is None:
+            waitack = self.echohash_recent_asyncresult.get(echohash)
+
+        return waitack
+
     def send_and_wait(self, receiver_address, message, timeout=None):
         """Sends a message and wait for the response ack."""
         ack_result = self.send_async(receiver_address, message)
         return ack_result.wait(timeout=timeout)
 
     def send_ack(self, receiver_address, message):
+        """ Acknowledge the message echoed by the Ack `message`, the Ack may be
+        sent together with other Acks for `receiver_address`.
+        """
         if not isaddress(receiver_address):
             raise ValueError('Invalid address {}'.format(pex(receiver_address)))
 
@@ -252,11 +738,8 @@ class RaidenProtocol(object):
                 message,
             )
 
-        messagedata = message.encode()
-        host_port = self.get_host_port(receiver_address)
-        self.echohash_acks[message.echo] = (host_port, messagedata)
-
-        self._send_ack(*self.echohash_acks[message.echo])
+        self.echohash_acks[message.echo] = receiver_address
+        self._send_ack(receiver_address, message.echo)
 
     def send_ping(self, receiver_address):
         if not isaddress(receiver_address):
@@ -278,54 +761,115 @@ class RaidenProtocol(object):
         message_data = message.encode()
         echohash = sha3(message_data + receiver_address)
         async_result = AsyncResult()
-        if echohash not in self.echohash_asyncresult:
-            self.echohash_asyncresult[echohash] = WaitAck(async_result, receiver_address)
+
+        # pings are not retried and may never be acknowledged, so they are not
+        # kept in echohash_asyncresult
+        if echohash not in self.echohash_recent_asyncresult:
+            self.echohash_recent_asyncresult[echohash] = WaitAck(async_result, receiver_address)
         # Just like ACK, a PING message is sent directly. No need for queuing
         self.transport.send(
             self.raiden,
             self.discovery.get(receiver_address),
             message_data
         )
+        self.echohash_senttime[echohash] = time.time()
         return async_result
 
     def receive(self, data):
+        """ Handle the message `data`, a string or a memoryview. A memoryview
+        is decoded without copying the data.
+        """
         # ignore large packets
         if len(data) > self.max_message_size:
             log.error('receive packet larger than maximum size', length=len(data))
             return
 
-        echohash = sha3(data + self.raiden.address)
+        echohash = keccak_parts(data, self.raiden.address)
 
         # check if we handled this message already, if so repeat Ack
-        if echohash in self.echohash_acks:
-            return self._send_ack(*self.echohash_acks[echohash])
+        ack_address = self.echohash_acks.get(echohash)
+        if ack_address is not None:
+            return self._send_ack(ack_address, echohash)
+
+        # the message is still being handled, the Ack sent once it's done
+        # acknowledges the retransmission too
+        if echohash in self.echohash_inflight:
+            return
 
         # We ignore the sending endpoint as this can not be known w/ UDP
-        message = decode(data)
-        # note down the time we got a message from the address
-        self.last_received_time[message.sender] = time.time()
+        if self.recovery_pool is None:
+            message = decode(data)
+        else:
+            message, signed = decode_unverified(data)
+
+            if signed is not None:
+                sender_key = SENDER_CACHE.cache_key(*signed)
+                message.sender = SENDER_CACHE.get_address(sender_key)
+
+                # a retransmission has its sender cached, it goes through the
+                # queue without a recovery
+                if message.sender is None:
+                    async_result = self.recovery_pool.recover(*signed)
+                else:
+                    async_result = None
+
+                # the messages are handled in the order they were received,
+                # even if the sender of a later message is recovered first
+                self.echohash_inflight.add(echohash)
+                self.recovery_queue.put((async_result, sender_key, data, message, echohash))
+
+                if self.recovery_greenlet is None:
+                    self.recovery_greenlet = gevent.spawn(self._dispatch_recovered)
+
+                return
+
+        self.echohash_inflight.add(echohash)
+        try:
+            self._receive_message(data, message, echohash)
+        finally:
+            self.echohash_inflight.discard(echohash)
+
+    def _dispatch_recovered(self):
+        while True:
+            async_result, sender_key, data, message, echohash = self.recovery_queue.get()
+
+            if async_result is not None:
+                publickey = async_result.get()
+
+                if publickey is None:
+                    self.echohash_inflight.discard(echohash)
+
+                    if log.isEnabledFor(logging.ERROR):
+                        log.error(
+                            'invalid signature node:%s echohash:%s',
+                            pex(self.raiden.address),
+                            pex(echohash),
+                        )
+                    continue
+
+                message.sender = publickey_to_address(publickey)
+                SENDER_CACHE.add_address(sender_key, message.sender)
+
+            try:
+                self._receive_message(data, message, echohash)
+            except Exception:  # pylint: disable=broad-except
+                # this greenlet handles all the recovered messages, an error
+                # handling a message must not stop the following ones
+                log.exception('unexpected exception handling a message')
+            finally:
+                self.echohash_inflight.discard(echohash)
+
+    def _receive_message(self, data, message, echohash):
+        if message is not None:
+            # note down the time we got a message from the address
+            self.last_received_time[message.sender] = time.time()
 
         if isinstance(message, Ack):
-            waitack = self.echohash_asyncresult[message.echo]
-
-            if waitack.ack_result.ready():
-                if log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'DUPLICATED ACK RECEIVED node:%s receiver:%s echohash:%s',
-                        pex(self.raiden.address),
-                        pex(waitack.receiver_address),
-                        pex(message.echo),
-                    )
-            else:
-                if log.isEnabledFor(logging.INFO):
-                    log.info(
-                        'ACK RECEIVED node:%s receiver:%s echohash:%s',
-                        pex(self.raiden.address),
-                        pex(waitack.receiver_address),
-                        pex(message.echo)
-                    )
-
-                waitack.ack_result.set(True)
+            self._receive_ack(message.echo)
+
+        elif isinstance(message, BatchedAck):
+            for echo in message.echoes:
+                self._receive_ack(echo)
 
         elif message is not None:
             # all messages require an Ack, to send it back an address is required
@@ -365,5 +909,44 @@ class RaidenProtocol(object):
             if log.isEnabledFor(logging.ERROR):
                 log.error(
                     'could not decode message %s',
-                    pex(data),
+                    pex(memoryview(data).tobytes()),
                 )
+
+    def _receive_ack(self, echohash):
+        waitack = self._get_waitack(echohash)
+
+        if waitack is None:
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    'UNKNOWN ACK RECEIVED node:%s echohash:%s',
+                    pex(self.raiden.address),
+                    pex(echohash),
+                )
+            return
+
+        senttime = self.echohash_senttime.pop(echohash, None)
+        if senttime is not None:
+            timer = self.get_timer(waitack.receiver_address)
+            timer.add_sample(time.time() - senttime)
+
+        if waitack.ack_result.ready():
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    'DUPLICATED ACK RECEIVED node:%s receiver:%s echohash:%s',
+                    pex(self.raiden.address),
+                    pex(waitack.receiver_address),
+                    pex(echohash),
+                )
+        else:
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    'ACK RECEIVED node:%s receiver:%s echohash:%s',
+                    pex(self.raiden.address),
+                    pex(waitack.receiver_address),
+                    pex(echohash)
+                )
+
+            waitack.ack_result.set(True)
+
+            if self.echohash_asyncresult.pop(echohash, None) is not None:
+                self.echohash_recent_asyncresult[echohash] = waitack
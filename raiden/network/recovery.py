@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+""" Recovery of the public keys from message signatures in worker processes,
+so that a node can use more than one core to validate the received messages.
+
+The worker processes are also used to sign the outbound messages, see
+`raiden.network.signer`.
+"""
+import itertools
+import multiprocessing
+import os
+import struct
+
+import gevent
+import secp256k1
+from ethereum import slogging
+from gevent.event import AsyncResult
+from gevent.os import make_nonblocking, nb_read, nb_write
+
+from raiden.encoding.signing import recover_publickey
+
+log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
+
+SIGNATURE_SIZE = 65
+READ_SIZE = 2 ** 16
+
+# request id and length of the signed data, followed by the signed data and
+# the signature
+REQUEST_HEADER = struct.Struct('>IH')
+
+# request id and length of the public key, followed by the public key, the
+# length is zero if the signature is invalid
+RESPONSE_HEADER = struct.Struct('>IB')
+
+
+def request_body_size(header):
+    _, length = header
+    return length + SIGNATURE_SIZE
+
+
+def response_body_size(header):
+    _, length = header
+    return length
+
+
+def parse_frames(data, header_struct, body_size):
+    """ Split `data` into frames made of a header and a body.
+
+    Returns:
+        Tuple[List[Tuple[tuple, bytes]], bytes]: The headers and bodies of the
+        complete frames and the remaining bytes of an incomplete frame.
+    """
+    frames = list()
+    position = 0
+
+    while position + header_struct.size <= len(data):
+        header = header_struct.unpack_from(data, position)
+        start = position + header_struct.size
+        end = start + body_size(header)
+
+        if end > len(data):
+            break
+
+        frames.append((header, data[start:end]))
+        position = end
+
+    return frames, data[position:]
+
+
+def write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def worker_loop(requests_fd, responses_fd, body_size, handle):
+    """ Main loop of a worker process, `handle` is called with the header and
+    body of each request and returns the response body. Each batch of
+    requests is answered with a single write.
+    """
+    pending = b''
+
+    while True:
+        data = os.read(requests_fd, READ_SIZE)
+
+        if not data:  # the node closed the pipe
+            return
+
+        frames, pending = parse_frames(pending + data, REQUEST_HEADER, body_size)
+
+        responses = list()
+        for header, body in frames:
+            request_id, _ = header
+            response = handle(header, body)
+
+            responses.append(RESPONSE_HEADER.pack(request_id, len(response)))
+            responses.append(response)
+
+        write_all(responses_fd, b''.join(responses))
+
+
+def recovery_worker(requests_fd, responses_fd, parent_fds):
+    for fd in parent_fds:
+        os.close(fd)
+
+    ctx = secp256k1.lib.secp256k1_context_create(secp256k1.ALL_FLAGS)
+
+    def handle(header, body):
+        _, length = header
+
+        try:
+            return recover_publickey(body[:length], body[length:], ctx=ctx)
+        except Exception:  # pylint: disable=broad-except
+            return b''
+
+    worker_loop(requests_fd, responses_fd, request_body_size, handle)
+
+
+class WorkerProcess(object):
+    """ The node side of a worker process running `target`, the results of
+    the requests are set in AsyncResults, an empty response is set as None.
+
+    Once the process exits the pending requests are set as None and `alive` is
+    False, the process is not restarted.
+    """
+
+    def __init__(self, target, *args):
+        requests_read, requests_write = os.pipe()
+        responses_read, responses_write = os.pipe()
+
+        parent_fds = (requests_write, responses_read)
+        self.process = multiprocessing.Process(
+            target=target,
+            args=(requests_read, responses_write, parent_fds) + args,
+        )
+        self.process.daemon = True
+        self.process.start()
+
+        os.close(requests_read)
+        os.close(responses_write)
+
+        make_nonblocking(requests_write)
+        make_nonblocking(responses_read)
+
+        self.requests_fd = requests_write
+        self.responses_fd = responses_read
+
+        # Maps the request id to the AsyncResult of the response
+        self.requestid_asyncresult = dict()
+
+        self.alive = True
+        self.outbox = list()
+        self.writer = None
+        self.reader = gevent.spawn(self._read_responses)
+
+    def request(self, request_id, length, parts, async_result):
+        """ Send a request made of `parts`, the first part is `length` bytes
+        long.
+        """
+        if not self.alive:
+            async_result.set(None)
+            return
+
+        self.requestid_asyncresult[request_id] = async_result
+
+        self.outbox.append(REQUEST_HEADER.pack(request_id, length))
+        self.outbox.extend(parts)
+
+        if self.writer is None:
+            self.writer = gevent.spawn(self._write_requests)
+
+    def _write_requests(self):
+        try:
+            # the requests done before this greenlet runs are written together
+            while self.outbox:
+                data = b''.join(self.outbox)
+                self.outbox = list()
+
+                while data:
+                    written = nb_write(self.requests_fd, data)
+                    data = data[written:]
+        except (IOError, OSError):
+            self._exited()
+        finally:
+            self.writer = None
+
+    def _exited(self):
+        if not self.alive:
+            return
+
+        log.error('worker process exited')
+
+        self.alive = False
+        self.outbox = list()
+
+        for async_result in self.requestid_asyncresult.itervalues():
+            async_result.set(None)
+        self.requestid_asyncresult = dict()
+
+    def _read_responses(self):
+        pending = b''
+
+        while True:
+            data = nb_read(self.responses_fd, READ_SIZE)
+
+            if not data:
+                self._exited()
+                return
+
+            frames, pending = parse_frames(pending + data, RESPONSE_HEADER, response_body_size)
+
+            for (request_id, _), response in frames:
+                async_result = self.requestid_asyncresult.pop(request_id)
+                async_result.set(response or None)
+
+    def stop(self):
+        gevent.killall([
+            greenlet
+            for greenlet in (self.writer, self.reader)
+            if greenlet is not None
+        ])
+
+        os.close(self.requests_fd)
+        os.close(self.responses_fd)
+        self.process.terminate()
+
+        self.alive = False
+        for async_result in self.requestid_asyncresult.itervalues():
+            async_result.set(None)
+
+
+class WorkerPool(object):
+    """ Sends the requests to `processes` worker processes running `target`,
+    the requests are distributed among the processes that are still alive.
+    """
+
+    def __init__(self, processes, target, *args):
+        if processes < 1:
+            raise ValueError('at least one process is required')
+
+        self.workers = [WorkerProcess(target, *args) for _ in range(processes)]
+        self.next_worker = itertools.cycle(self.workers)
+        self.next_request_id = itertools.count()
+
+    def request(self, length, parts, async_result):
+        """ Send the request to a worker process.
+
+        Returns:
+            bool: False if all the worker processes exited, the request must
+            be handled by the caller.
+        """
+        for _ in range(len(self.workers)):
+            worker = next(self.next_worker)
+
+            if worker.alive:
+                request_id = next(self.next_request_id) % 2 ** 32
+                worker.request(request_id, length, parts, async_result)
+                return True
+
+        return False
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+class RecoveryPool(WorkerPool):
+    """ Recovers the public keys of signed messages using `processes` worker
+    processes, each with its own secp256k1 context.
+
+    The requests done before the event loop runs again are sent to the workers
+    in batches. The public keys are recovered in the node's process if all the
+    workers exited.
+    """
+
+    def __init__(self, processes):
+        super(RecoveryPool, self).__init__(processes, recovery_worker)
+
+    def recover(self, message_data, signature):
+        """ Returns an AsyncResult with the public key that signed
+        `message_data`, or None if the signature is invalid.
+        """
+        async_result = AsyncResult()
+
+        if len(signature) != SIGNATURE_SIZE:
+            async_result.set(None)
+            return async_result
+
+        if isinstance(message_data, memoryview):
+            message_data = message_data.tobytes()
+
+        requested = self.request(
+            len(message_data),
+            (message_data, signature),
+            async_result,
+        )
+
+        if not requested:
+            try:
+                publickey = recover_publickey(message_data, signature)
+            except Exception:  # pylint: disable=broad-except
+                publickey = None
+
+            async_result.set(publickey)
+
+        return async_result
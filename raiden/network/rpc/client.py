@@ -1,14 +1,31 @@
 # -*- coding: utf-8 -*-
+import inspect
+import itertools
+import json
+from collections import defaultdict
+
 import gevent
+import requests
 import rlp
 from ethereum import slogging
 from ethereum import _solidity
 from ethereum.transactions import Transaction
 from ethereum.utils import denoms, int_to_big_endian, encode_hex, normalize_address
-from pyethapp.jsonrpc import address_encoder, address_decoder, data_decoder, default_gasprice
-from pyethapp.rpc_client import topic_encoder, JSONRPCClient
+from gevent.event import AsyncResult
+from pyethapp.jsonrpc import (
+    address_decoder,
+    address_encoder,
+    data_decoder,
+    data_encoder,
+    default_gasprice,
+    default_startgas,
+    quantity_encoder,
+)
+from pyethapp.rpc_client import topic_encoder, JSONRPCClient, JSONRPCClientReplyError
+from tinyrpc.transports.http import HttpPostClientTransport
 
 from raiden import messages
+from raiden.blockchain.blocksource import PollingBlockSource
 from raiden.utils import (
     get_contract_path,
     isaddress,
@@ -36,6 +53,7 @@ GAS_LIMIT_HEX = '0x' + int_to_big_endian(GAS_LIMIT).encode('hex')
 GAS_PRICE = denoms.shannon * 20
 
 DEFAULT_POLL_TIMEOUT = 60
+DEFAULT_POOL_SIZE = 10
 
 solidity = _solidity.get_solidity()  # pylint: disable=invalid-name
 
@@ -95,10 +113,167 @@ def new_filter(jsonrpc_client, contract_address, topics):
     return jsonrpc_client.call('eth_newFilter', json_data)
 
 
+def install_filter(jsonrpc_client, log_poller, contract_address, topics):
+    """ Install a filter for the events of `contract_address` with the given
+    topics, the filter is polled by `log_poller` if one is given, otherwise a
+    filter is installed in the node.
+    """
+    if log_poller is not None:
+        return log_poller.new_filter(contract_address, topics)
+
+    filter_id_raw = new_filter(jsonrpc_client, contract_address, topics)
+
+    return Filter(
+        jsonrpc_client,
+        filter_id_raw,
+    )
+
+
+def pooled_transport(host, port, pool_size=DEFAULT_POOL_SIZE):
+    """ HTTP transport for the JSON-RPC client that keeps the connections to
+    the node alive, up to `pool_size` connections are reused.
+
+    The connections are not reused with the tinyrpc versions that don't
+    accept a `post_method`.
+    """
+    endpoint = 'http://{}:{}'.format(host, port)
+    headers = {'content-type': 'application/json'}
+
+    transport_args = inspect.getargspec(HttpPostClientTransport.__init__).args
+    if 'post_method' not in transport_args:
+        return HttpPostClientTransport(endpoint, headers=headers)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+
+    return HttpPostClientTransport(
+        endpoint,
+        post_method=session.post,
+        headers=headers,
+    )
+
+
+class RPCBatch(object):
+    """ Sends many JSON-RPC requests to the node in a single HTTP request
+    using a JSON-RPC 2.0 batch.
+
+    The requests are added with `call` and `contract_call`, both return an
+    AsyncResult that is set once the batch is sent with `send`.
+    """
+
+    def __init__(self, jsonrpc_client):
+        self.client = jsonrpc_client
+        self.requests = list()
+
+    def call(self, method, *args):
+        """ Add a request, it is the batched version of
+        `JSONRPCClient.call`.
+        """
+        return self._add(method, args, None)
+
+    def contract_call(self, method_proxy, *args, **kargs):
+        """ Add a call to a constant contract function, it is the batched
+        version of `method_proxy.call(*args, **kargs)`.
+        """
+        translator = method_proxy.translator
+        function_name = method_proxy.function_name
+
+        json_data = {
+            'from': address_encoder(method_proxy.sender),
+            'to': data_encoder(method_proxy.contract_address),
+            'value': quantity_encoder(kargs.get('value', 0)),
+            'gasPrice': quantity_encoder(kargs.get('gasprice', default_gasprice)),
+            'gas': quantity_encoder(kargs.get('startgas', default_startgas)),
+            'data': data_encoder(translator.encode(function_name, args)),
+        }
+
+        def decode(result):
+            result = data_decoder(result)
+
+            if result:
+                result = translator.decode(function_name, result)
+                result = result[0] if len(result) == 1 else result
+
+            return result
+
+        return self._add('eth_call', (json_data, 'latest'), decode)
+
+    def _add(self, method, args, decode):
+        request = self.client.protocol.create_request(method, args)
+        async_result = AsyncResult()
+        self.requests.append((request, async_result, decode))
+        return async_result
+
+    def send(self):
+        """ Send all the requests added since the last call and set their
+        results, a request that failed has its exception set.
+        """
+        requests_, self.requests = self.requests, list()
+
+        if not requests_:
+            return
+
+        batch = self.client.protocol.create_batch_request([
+            request for request, _, _ in requests_
+        ])
+
+        try:
+            reply = json.loads(self.client.transport.send_message(batch.serialize()))
+
+            # a node that doesn't support batches replies with a single error
+            if not isinstance(reply, list):
+                raise JSONRPCClientReplyError(reply.get('error', 'Invalid batch reply'))
+
+        except Exception as e:  # pylint: disable=broad-except
+            for _, async_result, _ in requests_:
+                async_result.set_exception(e)
+            return
+
+        id_response = {
+            response.get('id'): response
+            for response in reply
+        }
+
+        for request, async_result, decode in requests_:
+            response = id_response.get(request.unique_id)
+
+            if response is None:
+                async_result.set_exception(JSONRPCClientReplyError('Missing reply'))
+
+            elif 'error' in response:
+                error = response['error']
+                async_result.set_exception(JSONRPCClientReplyError(error.get('message', error)))
+
+            else:
+                try:
+                    result = response.get('result')
+
+                    if decode is not None:
+                        result = decode(result)
+
+                except Exception as e:  # pylint: disable=broad-except
+                    async_result.set_exception(e)
+
+                else:
+                    async_result.set(result)
+
+
 def decode_topic(topic):
     return int(topic[2:], 16)
 
 
+def decode_log(log_event):
+    return {
+        'topics': [
+            decode_topic(topic)
+            for topic in log_event['topics']
+        ],
+        'data': data_decoder(log_event['data']),
+        'address': address_decoder(log_event['address']),
+    }
+
+
 class BlockChainService(object):
     """ Exposes the blockchain's state through JSON-RPC. """
     # pylint: disable=too-many-instance-attributes,unused-argument
@@ -126,6 +301,7 @@ class BlockChainService(object):
             host=host,
             port=port,
             print_communication=kwargs.get('print_communication', False),
+            transport=pooled_transport(host, port, kwargs.get('pool_size', DEFAULT_POOL_SIZE)),
         )
         patch_send_transaction(jsonrpc_client)
 
@@ -133,6 +309,7 @@ class BlockChainService(object):
         self.private_key = privatekey_bin
         self.node_address = privatekey_to_address(privatekey_bin)
         self.poll_timeout = poll_timeout
+        self.log_poller = LogPoller(jsonrpc_client, self.block_number())
         self.default_registry = self.registry(registry_address)
 
     def set_verbosity(self, level):
@@ -142,6 +319,12 @@ class BlockChainService(object):
     def block_number(self):
         return self.client.blocknumber()
 
+    def block_source(self):
+        """ Return the source of the new blocks, the node is polled with an
+        interval that adapts to the expected block time.
+        """
+        return PollingBlockSource(self)
+
     def next_block(self):
         target_block_number = self.block_number() + 1
         current_block = target_block_number
@@ -181,6 +364,7 @@ class BlockChainService(object):
                 self.client,
                 netting_channel_address,
                 poll_timeout=self.poll_timeout,
+                log_poller=self.log_poller,
             )
             self.address_contract[netting_channel_address] = channel
 
@@ -193,6 +377,7 @@ class BlockChainService(object):
                 self.client,
                 manager_address,
                 poll_timeout=self.poll_timeout,
+                log_poller=self.log_poller,
             )
 
             asset_address = manager.asset_address()
@@ -213,6 +398,7 @@ class BlockChainService(object):
                 self.client,
                 address_decoder(manager_address),
                 poll_timeout=self.poll_timeout,
+                log_poller=self.log_poller,
             )
 
             self.asset_manager[asset_address] = manager
@@ -226,12 +412,18 @@ class BlockChainService(object):
                 self.client,
                 registry_address,
                 poll_timeout=self.poll_timeout,
+                log_poller=self.log_poller,
             )
 
         return self.address_registry[registry_address]
 
+    def poll_filters(self, block_number):
+        """ Fetch the events of all the filters up to `block_number`. """
+        self.log_poller.poll(block_number)
+
     def uninstall_filter(self, filter_id_raw):
-        self.client.call('eth_uninstallFilter', filter_id_raw)
+        if not self.log_poller.uninstall(filter_id_raw):
+            self.client.call('eth_uninstallFilter', filter_id_raw)
 
     def deploy_contract(self, contract_name, contract_file, constructor_parameters=None):
         contract_path = get_contract_path(contract_file)
@@ -281,22 +473,10 @@ class Filter(object):
         if filter_changes is None:
             return []
 
-        result = list()
-        for log_event in filter_changes:
-            address = address_decoder(log_event['address'])
-            data = data_decoder(log_event['data'])
-            topics = [
-                decode_topic(topic)
-                for topic in log_event['topics']
-            ]
-
-            result.append({
-                'topics': topics,
-                'data': data,
-                'address': address,
-            })
-
-        return result
+        return [
+            decode_log(log_event)
+            for log_event in filter_changes
+        ]
 
     def uninstall(self):
         self.client.call(
@@ -305,6 +485,121 @@ class Filter(object):
         )
 
 
+class LogFilter(object):
+    """ A filter polled by a LogPoller, it has the same interface as a
+    `Filter`.
+    """
+
+    def __init__(self, log_poller, filter_id_raw, contract_address, topics, from_block):
+        # pylint: disable=too-many-arguments
+        self.log_poller = log_poller
+        self.filter_id_raw = filter_id_raw
+        self.contract_address = contract_address
+        self.topics = topics
+        self.from_block = from_block
+        self.next_block = from_block  #: the first block not fetched yet
+        self.events = list()
+
+    def changes(self):
+        events = self.events
+        self.events = list()
+        return events
+
+    def uninstall(self):
+        self.log_poller.uninstall(self.filter_id_raw)
+
+
+class LogPoller(object):
+    """ Polls the events of all the installed LogFilters with a single
+    `eth_getLogs` query per block, instead of one `eth_getFilterChanges` call
+    per filter.
+
+    Like a filter installed in the node, a LogFilter only receives the events
+    of the blocks after it was installed. A filter installed while a poll is
+    fetching the events is backfilled from the block it was installed at by
+    the next poll.
+    """
+
+    def __init__(self, jsonrpc_client, block_number):
+        self.client = jsonrpc_client
+        self.last_block_number = block_number
+        self.filterid_filter = dict()
+        self.next_filter_id = itertools.count()
+
+    def new_filter(self, contract_address, topics):
+        filter_ = LogFilter(
+            self,
+            next(self.next_filter_id),
+            normalize_address(contract_address),
+            list(topics),
+            self.last_block_number + 1,
+        )
+        self.filterid_filter[filter_.filter_id_raw] = filter_
+        return filter_
+
+    def uninstall(self, filter_id_raw):
+        """ Uninstall the filter, returns False if the filter is not polled
+        by this LogPoller.
+        """
+        return self.filterid_filter.pop(filter_id_raw, None) is not None
+
+    def poll(self, block_number):
+        """ Fetch the events of the blocks up to `block_number` and add them to
+        the matching filters.
+        """
+        if block_number <= self.last_block_number:
+            return
+
+        # the filters installed during the previous poll start from an older
+        # block than the others, each group is fetched with its own query
+        block_filters = defaultdict(list)
+        for filter_ in self.filterid_filter.values():
+            block_filters[filter_.next_block].append(filter_)
+
+        for from_block, filters in sorted(block_filters.iteritems()):
+            self._fetch(from_block, block_number, filters)
+
+            for filter_ in filters:
+                filter_.next_block = block_number + 1
+
+        self.last_block_number = block_number
+
+    def _fetch(self, from_block, to_block, filters):
+        """ Add the events of the blocks `from_block` to `to_block` to the
+        matching `filters`.
+        """
+        address_filters = defaultdict(list)
+        for filter_ in filters:
+            address_filters[filter_.contract_address].append(filter_)
+
+        topics = set(
+            topic
+            for filter_ in filters
+            for topic in filter_.topics
+        )
+
+        json_data = {
+            'fromBlock': '0x{:x}'.format(from_block),
+            'toBlock': '0x{:x}'.format(to_block),
+            'address': [address_encoder(address) for address in address_filters],
+            # any of the topics in the first position
+            'topics': [[topic_encoder(topic) for topic in sorted(topics)]],
+        }
+
+        # geth could return None
+        log_events = self.client.call('eth_getLogs', json_data) or []
+
+        for log_event in log_events:
+            event = decode_log(log_event)
+            event_block = int(log_event['blockNumber'], 16)
+
+            for filter_ in address_filters[event['address']]:
+                matches_topic = event['topics'][:1] == filter_.topics[:1]
+
+                if matches_topic and event_block >= filter_.from_block:
+                    filter_.events.append(event)
+
+
 class Discovery(object):
     """On chain smart contract raiden node discovery: allows registering
     endpoints (host, port) for your ethereum-/raiden-address and looking up
@@ -435,7 +730,7 @@ class Asset(object):
 
 class Registry(object):
     def __init__(self, jsonrpc_client, registry_address, startgas=GAS_LIMIT,
-                 gasprice=GAS_PRICE, poll_timeout=DEFAULT_POLL_TIMEOUT):
+                 gasprice=GAS_PRICE, poll_timeout=DEFAULT_POLL_TIMEOUT, log_poller=None):
         # pylint: disable=too-many-arguments
 
         result = jsonrpc_client.call(
@@ -460,6 +755,7 @@ class Registry(object):
         self.startgas = startgas
         self.gasprice = gasprice
         self.poll_timeout = poll_timeout
+        self.log_poller = log_poller
 
     def manager_address_by_asset(self, asset_address):
         """ Return the channel manager address for the given asset. """
@@ -506,12 +802,7 @@ class Registry(object):
         topics = [ASSETADDED_EVENTID]
 
         registry_address_bin = self.proxy.address
-        filter_id_raw = new_filter(self.client, registry_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, registry_address_bin, topics)
 
 
 class ChannelManager(object):
@@ -521,7 +812,8 @@ class ChannelManager(object):
             manager_address,
             startgas=GAS_LIMIT,
             gasprice=GAS_PRICE,
-            poll_timeout=DEFAULT_POLL_TIMEOUT):
+            poll_timeout=DEFAULT_POLL_TIMEOUT,
+            log_poller=None):
         # pylint: disable=too-many-arguments
 
         result = jsonrpc_client.call(
@@ -546,6 +838,7 @@ class ChannelManager(object):
         self.startgas = startgas
         self.gasprice = gasprice
         self.poll_timeout = poll_timeout
+        self.log_poller = log_poller
 
     def asset_address(self):
         """ Return the asset of this manager. """
@@ -633,12 +926,7 @@ class ChannelManager(object):
         topics = [CHANNELNEW_EVENTID]
 
         channel_manager_address_bin = self.proxy.address
-        filter_id_raw = new_filter(self.client, channel_manager_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, channel_manager_address_bin, topics)
 
 
 class NettingChannel(object):
@@ -648,20 +936,10 @@ class NettingChannel(object):
             channel_address,
             startgas=GAS_LIMIT,
             gasprice=GAS_PRICE,
-            poll_timeout=DEFAULT_POLL_TIMEOUT):
+            poll_timeout=DEFAULT_POLL_TIMEOUT,
+            log_poller=None):
         # pylint: disable=too-many-arguments
 
-        result = jsonrpc_client.call(
-            'eth_getCode',
-            address_encoder(channel_address),
-            'latest',
-        )
-
-        if result == '0x':
-            raise ValueError('Netting channel address {} does not contain code'.format(
-                address_encoder(channel_address),
-            ))
-
         proxy = jsonrpc_client.new_abi_contract(
             NETTING_CHANNEL_ABI,
             address_encoder(channel_address),
@@ -673,18 +951,41 @@ class NettingChannel(object):
         self.startgas = startgas
         self.gasprice = gasprice
         self.poll_timeout = poll_timeout
+        self.log_poller = log_poller
+        self.node_address = privatekey_to_address(self.client.privkey)
+
+        # the code and the participants are checked with a single request
+        batch = RPCBatch(jsonrpc_client)
+        code = batch.call('eth_getCode', address_encoder(channel_address), 'latest')
+        data, settle_timeout = self._detail_calls(batch)
+        batch.send()
+
+        if code.get() == '0x':
+            raise ValueError('Netting channel address {} does not contain code'.format(
+                address_encoder(channel_address),
+            ))
 
         # check we are a participant of the given channel
-        self.node_address = privatekey_to_address(self.client.privkey)
-        self.detail(self.node_address)
+        self._detail(self.node_address, data.get(), settle_timeout.get())
 
     def asset_address(self):
         return address_decoder(self.proxy.assetAddress.call())
 
     def detail(self, our_address):
-        data = self.proxy.addressAndBalance.call(startgas=self.startgas)
-        settle_timeout = self.proxy.settleTimeout.call(startgas=self.startgas)
+        batch = RPCBatch(self.client)
+        data, settle_timeout = self._detail_calls(batch)
+        batch.send()
 
+        return self._detail(our_address, data.get(), settle_timeout.get())
+
+    def _detail_calls(self, batch):
+        """ Add the calls used by `detail` to `batch`. """
+        data = batch.contract_call(self.proxy.addressAndBalance, startgas=self.startgas)
+        settle_timeout = batch.contract_call(self.proxy.settleTimeout, startgas=self.startgas)
+        return data, settle_timeout
+
+    @staticmethod
+    def _detail(our_address, data, settle_timeout):
         if data == '':
             raise RuntimeError('addressAndBalance call failed.')
 
@@ -720,10 +1021,15 @@ class NettingChannel(object):
         return settle_timeout
 
     def isopen(self):
-        if self.proxy.closed.call() != 0:
+        batch = RPCBatch(self.client)
+        closed = batch.contract_call(self.proxy.closed)
+        opened = batch.contract_call(self.proxy.opened)
+        batch.send()
+
+        if closed.get() != 0:
             return False
 
-        return self.proxy.opened.call() != 0
+        return opened.get() != 0
 
     def partner(self, our_address):
         data = self.proxy.addressAndBalance.call()
@@ -902,12 +1208,7 @@ class NettingChannel(object):
         netting_channel_address_bin = self.proxy.address
         topics = [CHANNELNEWBALANCE_EVENTID]
 
-        filter_id_raw = new_filter(self.client, netting_channel_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, netting_channel_address_bin, topics)
 
     def channelsecretrevealed_filter(self):
         """ Install a new filter for ChannelSecret events.
@@ -918,12 +1219,7 @@ class NettingChannel(object):
         netting_channel_address_bin = self.proxy.address
         topics = [CHANNELSECRETREVEALED_EVENTID]
 
-        filter_id_raw = new_filter(self.client, netting_channel_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, netting_channel_address_bin, topics)
 
     def channelclosed_filter(self):
         """ Install a new filter for ChannelClose events.
@@ -934,12 +1230,7 @@ class NettingChannel(object):
         topics = [CHANNELCLOSED_EVENTID]
 
         channel_manager_address_bin = self.proxy.address
-        filter_id_raw = new_filter(self.client, channel_manager_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, channel_manager_address_bin, topics)
 
     def channelsettled_filter(self):
         """ Install a new filter for ChannelSettled events.
@@ -950,9 +1241,4 @@ class NettingChannel(object):
         topics = [CHANNELSETTLED_EVENTID]
 
         channel_manager_address_bin = self.proxy.address
-        filter_id_raw = new_filter(self.client, channel_manager_address_bin, topics)
-
-        return Filter(
-            self.client,
-            filter_id_raw,
-        )
+        return install_filter(self.client, self.log_poller, channel_manager_address_bin, topics)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+""" Signing of the outbound messages in worker processes, so that the event
+loop is not blocked by the secp256k1 calls and the node can use more than one
+core to sign its messages.
+"""
+import os
+
+from gevent.event import AsyncResult
+from secp256k1 import PrivateKey
+
+from raiden.encoding.signing import sign
+from raiden.network.recovery import WorkerPool, worker_loop
+
+
+def request_body_size(header):
+    _, length = header
+    return length
+
+
+def signing_worker(requests_fd, responses_fd, parent_fds, private_key_bin):
+    for fd in parent_fds:
+        os.close(fd)
+
+    private_key = PrivateKey(private_key_bin, raw=True)
+
+    def handle(_, body):
+        try:
+            return sign(body, private_key)
+        except Exception:  # pylint: disable=broad-except
+            return b''
+
+    worker_loop(requests_fd, responses_fd, request_body_size, handle)
+
+
+class PendingSignature(AsyncResult):
+    """ An AsyncResult set to `message` once it is signed. """
+
+    def __init__(self, message):
+        super(PendingSignature, self).__init__()
+        self.message = message
+
+
+class SigningPool(WorkerPool):
+    """ Signs messages with the node's key using `processes` worker processes.
+
+    The requests done before the event loop runs again are sent to the workers
+    in batches. The messages are signed in the node's process if all the
+    workers exited.
+    """
+
+    def __init__(self, processes, private_key_bin):
+        super(SigningPool, self).__init__(processes, signing_worker, private_key_bin)
+
+        self.private_key_bin = private_key_bin
+        self.private_key = None
+
+    def sign(self, message_data):
+        """ Returns an AsyncResult with the signature of `message_data`, or
+        None if it could not be signed.
+        """
+        async_result = AsyncResult()
+
+        if not self.request(len(message_data), (message_data,), async_result):
+            if self.private_key is None:
+                self.private_key = PrivateKey(self.private_key_bin, raw=True)
+
+            try:
+                signature = sign(message_data, self.private_key)
+            except Exception:  # pylint: disable=broad-except
+                signature = None
+
+            async_result.set(signature)
+
+        return async_result
+
+    def sign_message(self, message, node_address):
+        """ Sign `message` in a worker process.
+
+        Returns:
+            PendingSignature: Set to the message once it is signed, or to a
+            ValueError if it could not be signed.
+        """
+        pending = PendingSignature(message)
+        packed, message_data = message.data_to_sign()
+
+        def signed(signature_result):
+            signature = signature_result.value
+
+            if signature is None:
+                pending.set_exception(ValueError('{} could not be signed'.format(message)))
+            else:
+                message.set_signature(packed, signature, node_address)
+                pending.set(message)
+
+        self.sign(bytes(message_data)).rawlink(signed)
+
+        return pending
@@ -3,6 +3,8 @@
 This module contains the classes responsible to implement the network
 communication.
 """
+import socket
+import struct
 import time
 
 import gevent
@@ -14,6 +16,88 @@ from raiden.utils import pex, sha3
 
 log = slogging.get_logger('raiden.network.transport')  # pylint: disable=invalid-name
 
+# First byte of a datagram that contains more than one message, must not clash
+# with the cmdid of any message
+ENVELOPE_ID = '\xff'
+ENVELOPE_LENGTH = struct.Struct('>H')
+
+
+class InvalidEnvelope(Exception):
+    pass
+
+
+def group_messages(messages, max_size):
+    """ Split the encoded `messages` into as few groups as possible, keeping
+    their order, such that each group fits in a datagram of `max_size` bytes.
+    A message that is larger than `max_size` is in a group of its own.
+    """
+    groups = list()
+    group = list()
+    group_size = len(ENVELOPE_ID)
+
+    for message in messages:
+        message_size = ENVELOPE_LENGTH.size + len(message)
+
+        if group and group_size + message_size > max_size:
+            groups.append(group)
+            group = list()
+            group_size = len(ENVELOPE_ID)
+
+        group.append(message)
+        group_size += message_size
+
+    if group:
+        groups.append(group)
+
+    return groups
+
+
+def pack_datagram(messages):
+    """ Return the datagram for the encoded `messages`.
+
+    A datagram with a single message is the message itself, otherwise the
+    datagram is the ENVELOPE_ID followed by each message prefixed with its
+    length.
+    """
+    if len(messages) == 1:
+        return messages[0]
+
+    data = [ENVELOPE_ID]
+    for message in messages:
+        data.append(ENVELOPE_LENGTH.pack(len(message)))
+        data.append(message)
+
+    return ''.join(data)
+
+
+def unpack_datagram(data):
+    """ Return the list of messages contained in the datagram `data`, the
+    messages of an envelope are memoryviews of `data`.
+
+    Raises:
+        InvalidEnvelope: If the envelope is truncated.
+    """
+    if data[:1] != ENVELOPE_ID:
+        return [data]
+
+    view = memoryview(data)
+    messages = list()
+    position = len(ENVELOPE_ID)
+    while position < len(data):
+        start = position + ENVELOPE_LENGTH.size
+        if start > len(data):
+            raise InvalidEnvelope('truncated message length')
+
+        length, = ENVELOPE_LENGTH.unpack_from(data, position)
+        end = start + length
+        if length == 0 or end > len(data):
+            raise InvalidEnvelope('truncated message')
+
+        messages.append(view[start:end])
+        position = end
+
+    return messages
+
 
 class DummyPolicy(object):
     """Dummy implementation for the throttling policy that always
@@ -60,7 +144,16 @@ class TokenBucket(object):
 
 
 class UDPTransport(object):
-    """ Node communication using the UDP protocol. """
+    """ Node communication using the UDP protocol.
+
+    The messages sent to the same node within `flush_interval` seconds are
+    packed into a single datagram of at most `max_datagram_size` bytes, with
+    the default interval only the messages sent before the event loop runs
+    again are packed together.
+    """
+
+    flush_interval = 0
+    max_datagram_size = 1200
 
     def __init__(
             self,
@@ -76,31 +169,81 @@ class UDPTransport(object):
         self.port = self.server.server_port
         self.throttle_policy = throttle_policy
 
-    def receive(self, data, host_port):  # pylint: disable=unused-argument
-        self.protocol.receive(data)
+        # the messages waiting to be sent and the greenlet that will send them
+        self.hostport_pending = dict()
+        self.hostport_flusher = dict()
 
-        # enable debugging using the DummyNetwork callbacks
-        DummyTransport.track_recv(self.protocol.raiden, host_port, data)
+    def receive(self, data, host_port):  # pylint: disable=unused-argument
+        try:
+            messages = unpack_datagram(data)
+        except InvalidEnvelope as e:
+            log.debug('invalid datagram', host_port=host_port, error=str(e))
+            return
+
+        for message in messages:
+            # an error handling a message must not drop the other messages in
+            # the datagram
+            try:
+                self.protocol.receive(message)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('unexpected exception handling a message')
+
+            # enable debugging using the DummyNetwork callbacks
+            DummyTransport.track_recv(self.protocol.raiden, host_port, message)
 
     def send(self, sender, host_port, bytes_):
         """ Send `bytes_` to `host_port`.
 
+        The bytes are sent asynchronously, together with the other messages
+        sent to the same `host_port` in the meantime.
+
         Args:
             sender (address): The address of the running node.
             host_port (Tuple[(str, int)]): Tuple with the host name and port number.
             bytes_ (bytes): The bytes that are going to be sent through the wire.
         """
-        gevent.sleep(self.throttle_policy.consume(1))
-        self.server.sendto(bytes_, host_port)
+        pending = self.hostport_pending.setdefault(host_port, list())
+        pending.append(bytes_)
+
+        if host_port not in self.hostport_flusher:
+            self.hostport_flusher[host_port] = gevent.spawn_later(
+                self.flush_interval,
+                self._flush,
+                sender,
+                host_port,
+            )
 
-        # enable debugging using the DummyNetwork callbacks
-        DummyTransport.network.track_send(sender, host_port, bytes_)
+    def _flush(self, sender, host_port):
+        try:
+            while self.hostport_pending.get(host_port):
+                messages = self.hostport_pending.pop(host_port)
+
+                for group in group_messages(messages, self.max_datagram_size):
+                    gevent.sleep(self.throttle_policy.consume(1))
+
+                    # the messages of a datagram that could not be sent are
+                    # retransmitted by the protocol
+                    try:
+                        self.server.sendto(pack_datagram(group), host_port)
+                    except socket.error as e:
+                        log.error('sending datagram failed', host_port=host_port, error=str(e))
+                        continue
+
+                    # enable debugging using the DummyNetwork callbacks
+                    for message in group:
+                        DummyTransport.network.track_send(sender, host_port, message)
+        finally:
+            # a new flusher is spawned by `send` only if there is no entry
+            self.hostport_flusher.pop(host_port, None)
 
     def register(self, proto, host, port):  # pylint: disable=unused-argument
         assert isinstance(proto, RaidenProtocol)
         self.protocol = proto
 
     def stop(self):
+        gevent.killall(self.hostport_flusher.values())
+        self.hostport_flusher = dict()
+        self.hostport_pending = dict()
         self.server.stop()
 
 
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import logging
 import itertools
+import time
 from collections import namedtuple
+from functools import partial
 
 import gevent
+from gevent.pool import Pool
 from ethereum import slogging
 from ethereum.abi import ContractTranslator
 from ethereum.utils import encode_hex
@@ -21,9 +24,12 @@ from raiden.blockchain.abi import CHANNEL_MANAGER_ABI, REGISTRY_ABI
 from raiden.network.channelgraph import ChannelGraph
 from raiden.tasks import AlarmTask, StartExchangeTask, HealthcheckTask
 from raiden.encoding import messages
-from raiden.messages import SignedMessage
+from raiden.messages import RevealSecret, Secret, SignedMessage
 from raiden.network.protocol import RaidenProtocol
-from raiden.utils import privatekey_to_address, isaddress, pex, GLOBAL_CTX
+from raiden.network.recovery import RecoveryPool
+from raiden.network.signer import PendingSignature, SigningPool
+from raiden.storage import ChannelStore
+from raiden.utils import privatekey_to_address, isaddress, pex, sha3, GLOBAL_CTX
 
 log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -66,6 +72,199 @@ class InsufficientFunds(RaidenError):
     pass
 
 
+class HashlockIndex(object):
+    """ Maps a hashlock to the tasks and the channels waiting for its secret,
+    for all the assets.
+
+    The same hashlock can be used by more than one asset (for exchanges), so
+    the tasks and the channels are kept per asset address. A channel is
+    removed once its lock is withdrawn or unlocked, or once the lock expires,
+    a task is removed once its result is known. Looking up an unknown hashlock
+    does not add an entry.
+
+    A single alarm timer is scheduled for the channels of a hashlock that
+    expire at the same block, the timer is cancelled once all of them are
+    removed.
+
+    The signed messages that reveal the secret of a hashlock are kept while
+    there are channels waiting for it, so the secret is signed once per node
+    instead of once per channel and asset.
+    """
+
+    def __init__(self, alarm):
+        self.alarm = alarm
+
+        self.hashlock_tasks = dict()  #: maps a hashlock to a dict of asset address to task
+        self.hashlock_channels = dict()  #: maps a hashlock to a dict of asset address to channels
+        self.hashlock_messages = dict()  #: maps a hashlock to a dict of key to signed message
+
+        #: maps a hashlock to a dict of expiration to the timer and the
+        #: (asset address, channel) pairs that expire with it
+        self.hashlock_expirations = dict()
+
+    def register_task(self, asset_address, task, hashlock):
+        self.hashlock_tasks.setdefault(hashlock, dict())[asset_address] = task
+
+    def unregister_task(self, asset_address, hashlock):
+        asset_task = self.hashlock_tasks.get(hashlock)
+
+        if asset_task is not None:
+            asset_task.pop(asset_address, None)
+
+            if not asset_task:
+                del self.hashlock_tasks[hashlock]
+
+    def get_tasks(self, hashlock):
+        """ Return the tasks registered for `hashlock` for all the assets. """
+        asset_task = self.hashlock_tasks.get(hashlock)
+
+        if asset_task is None:
+            return list()
+
+        return asset_task.values()
+
+    def register_channel(self, asset_address, channel, hashlock, expiration=None):
+        """ Register `channel` as waiting for the secret of `hashlock`, if the
+        `expiration` of the lock is given the channel is removed once the lock
+        expires.
+        """
+        asset_channels = self.hashlock_channels.setdefault(hashlock, dict())
+        channels = asset_channels.setdefault(asset_address, list())
+
+        if channel not in channels:
+            channels.append(channel)
+
+        if expiration is not None:
+            self._register_expiration(asset_address, channel, hashlock, expiration)
+
+    def _register_expiration(self, asset_address, channel, hashlock, expiration):
+        expiration_timers = self.hashlock_expirations.setdefault(hashlock, dict())
+        timer_entries = expiration_timers.get(expiration)
+
+        if timer_entries is None:
+            timer_entries = [None, [(asset_address, channel)]]
+            expiration_timers[expiration] = timer_entries
+
+            # the timer is called right away if the lock already expired
+            timer_entries[0] = self.alarm.schedule(
+                expiration + 1,
+                partial(self._lock_expired, hashlock, expiration),
+            )
+
+        elif (asset_address, channel) not in timer_entries[1]:
+            timer_entries[1].append((asset_address, channel))
+
+    def _lock_expired(self, hashlock, expiration, block_number):
+        # pylint: disable=unused-argument
+        expiration_timers = self.hashlock_expirations.get(hashlock)
+
+        if expiration_timers is None or expiration not in expiration_timers:
+            return
+
+        _, entries = expiration_timers.pop(expiration)
+        if not expiration_timers:
+            del self.hashlock_expirations[hashlock]
+
+        for asset_address, channel in entries:
+            self.unregister_channel(asset_address, channel, hashlock)
+
+    def _unregister_expiration(self, asset_address, channel, hashlock):
+        expiration_timers = self.hashlock_expirations.get(hashlock)
+
+        if expiration_timers is None:
+            return
+
+        for expiration, (timer, entries) in expiration_timers.items():
+            if (asset_address, channel) in entries:
+                entries.remove((asset_address, channel))
+
+                if not entries:
+                    timer.cancel()
+                    del expiration_timers[expiration]
+
+        if not expiration_timers:
+            del self.hashlock_expirations[hashlock]
+
+    def unregister_channel(self, asset_address, channel, hashlock):
+        asset_channels = self.hashlock_channels.get(hashlock)
+
+        if asset_channels is None:
+            return
+
+        channels = asset_channels.get(asset_address)
+        if channels is not None and channel in channels:
+            channels.remove(channel)
+            self._unregister_expiration(asset_address, channel, hashlock)
+
+            if not channels:
+                self._remove_asset(hashlock, asset_channels, asset_address)
+
+    def unregister_channels(self, asset_address, hashlock):
+        """ Remove all the channels of `asset_address` waiting for `hashlock`. """
+        asset_channels = self.hashlock_channels.get(hashlock)
+
+        if asset_channels is not None and asset_address in asset_channels:
+            for channel in asset_channels[asset_address]:
+                self._unregister_expiration(asset_address, channel, hashlock)
+
+            self._remove_asset(hashlock, asset_channels, asset_address)
+
+    def _remove_asset(self, hashlock, asset_channels, asset_address):
+        del asset_channels[asset_address]
+
+        if not asset_channels:
+            del self.hashlock_channels[hashlock]
+            self.hashlock_messages.pop(hashlock, None)
+
+    def get_channels(self, hashlock, asset_address):
+        """ Return the channels of `asset_address` waiting for `hashlock`, the
+        list must not be changed by the caller.
+        """
+        asset_channels = self.hashlock_channels.get(hashlock)
+
+        if asset_channels is None:
+            return list()
+
+        return asset_channels.get(asset_address, list())
+
+    def get_message(self, hashlock, key, create):
+        """ Return the message for `key`, the message is created by calling
+        `create` the first time it is needed.
+
+        The message is cached only if there are channels waiting for
+        `hashlock`, and dropped once there are none. A message that could not
+        be signed is created again.
+        """
+        messages_by_key = self.hashlock_messages.get(hashlock)
+
+        if messages_by_key is None:
+            message = create()
+
+            if hashlock in self.hashlock_channels:
+                self.hashlock_messages[hashlock] = {key: message}
+
+            return message
+
+        message = messages_by_key.get(key)
+
+        if message is None or (message.ready() and not message.successful()):
+            message = create()
+            messages_by_key[key] = message
+
+        return message
+
+    def get_assets(self, hashlock):
+        """ Return the addresses of the assets with channels waiting for
+        `hashlock`.
+        """
+        asset_channels = self.hashlock_channels.get(hashlock)
+
+        if asset_channels is None:
+            return list()
+
+        return asset_channels.keys()
+
+
 class RaidenService(object):  # pylint: disable=too-many-instance-attributes
     """ A Raiden node. """
 
@@ -92,20 +291,43 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         self.pubkey = pubkey
         self.private_key = private_key
         self.address = privatekey_to_address(private_key_bin)
-        self.protocol = RaidenProtocol(transport, discovery, self)
+
+        self.recovery_pool = None
+        if config['signature_recovery_processes'] > 0:
+            self.recovery_pool = RecoveryPool(config['signature_recovery_processes'])
+
+        self.signing_pool = None
+        if config['signing_processes'] > 0:
+            self.signing_pool = SigningPool(config['signing_processes'], private_key_bin)
+
+        self.channel_store = None
+        if config['channel_store_path']:
+            self.channel_store = ChannelStore(config['channel_store_path'])
+
+        self.protocol = RaidenProtocol(
+            transport,
+            discovery,
+            self,
+            max_retries=config['protocol_max_retries'],
+            ack_ttl=config['protocol_ack_ttl'],
+            ack_maxsize=config['protocol_ack_maxsize'],
+            recovery_pool=self.recovery_pool,
+            channel_store=self.channel_store,
+        )
         transport.protocol = self.protocol
 
         message_handler = RaidenMessageHandler(self)
         event_handler = RaidenEventHandler(self)
 
         alarm = AlarmTask(chain)
-        # ignore the blocknumber
-        alarm.register_callback(lambda _: event_handler.poll_all_event_listeners())
+        alarm.register_callback(event_handler.poll_all_event_listeners)
         alarm.start()
 
         self._blocknumber = alarm.last_block_number
         alarm.register_callback(self.set_block_number)
 
+        self.hashlock_index = HashlockIndex(alarm)
+
         if config['max_unresponsive_time'] > 0:
             self.healthcheck = HealthcheckTask(
                 self,
@@ -160,6 +382,111 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
 
         message.sign(self.private_key, self.address)
 
+    def sign_async(self, message):
+        """ Sign `message` in the signing pool, the message is signed inplace
+        if there is no pool.
+
+        The result can be given to `send_async`, the message keeps its place
+        in the queue while it's being signed. Transfers must be signed with
+        `register_transfer_async`, the channel state is stored with the signed
+        transfer.
+
+        Returns:
+            PendingSignature: Set to the message once it is signed.
+        """
+        if not isinstance(message, SignedMessage):
+            raise ValueError('{} is not signable.'.format(repr(message)))
+
+        if self.signing_pool is not None:
+            return self.signing_pool.sign_message(message, self.address)
+
+        self.sign(message)
+
+        pending = PendingSignature(message)
+        pending.set(message)
+        return pending
+
+    def register_transfer_async(self, channel, transfer):
+        """ Sign `transfer` with `sign_async` and register it with `channel`
+        once it is signed, the transfer is registered and logged before the
+        protocol sends it.
+
+        The transfer is registered right away if there is no signing pool.
+        Otherwise the next transfer of the channel must be created after
+        `wait_transfer_registered`, so it has the nonce and locksroot of the
+        registered state.
+
+        Returns:
+            PendingSignature: Set to the transfer once it is registered, or to
+            a ValueError if it could not be signed or registered.
+        """
+        signed = self.sign_async(transfer)
+
+        if signed.ready():
+            channel.register_transfer(signed.get())
+            return signed
+
+        registered = PendingSignature(transfer)
+        channel.unregistered_transfer = registered
+
+        def register():
+            try:
+                channel.register_transfer(signed.get())
+            except Exception as e:  # pylint: disable=broad-except
+                if log.isEnabledFor(logging.ERROR):
+                    log.error('could not register the transfer %s: %s', transfer, e)
+
+                registered.set_exception(
+                    ValueError('{} could not be registered'.format(transfer))
+                )
+            else:
+                registered.set(transfer)
+
+        # the channel callbacks may block, so the transfer is not registered
+        # in the hub
+        gevent.spawn(register)
+
+        return registered
+
+    @staticmethod
+    def wait_transfer_registered(channel):
+        """ Wait until the transfer of `channel` that is being signed, if any,
+        is registered.
+        """
+        while True:
+            pending = channel.unregistered_transfer
+
+            if pending is None or pending.ready():
+                return
+
+            pending.wait()
+
+    def get_revealsecret_message(self, secret, hashlock=None):
+        """ Return the PendingSignature of a RevealSecret for `secret`, the
+        same message is reused while there are channels waiting for the
+        secret.
+        """
+        if hashlock is None:
+            hashlock = sha3(secret)
+
+        def create():
+            return self.sign_async(RevealSecret(secret))
+
+        return self.hashlock_index.get_message(hashlock, (RevealSecret,), create)
+
+    def get_secret_message(self, identifier, secret, asset_address, hashlock=None):
+        """ Return the PendingSignature of a Secret for `secret`, the same
+        message is reused while there are channels waiting for the secret.
+        """
+        if hashlock is None:
+            hashlock = sha3(secret)
+
+        def create():
+            return self.sign_async(Secret(identifier, secret, asset_address))
+
+        key = (Secret, identifier, asset_address)
+        return self.hashlock_index.get_message(hashlock, key, create)
+
     def send(self, *args):
         raise NotImplementedError('use send_and_wait or send_async')
 
@@ -210,7 +537,11 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         and ignoring the assets. Useful for refund transfer, split transfer,
         and exchanges.
         """
-        for asset_manager in self.managers_by_asset_address.values():
+        hashlock = sha3(secret)
+
+        for asset_address in self.hashlock_index.get_assets(hashlock):
+            asset_manager = self.managers_by_asset_address[asset_address]
+
             try:
                 asset_manager.register_secret(secret)
             except:  # pylint: disable=bare-except
@@ -229,15 +560,12 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         Return:
             Nothing if a corresponding task is found,raise Exception otherwise
         """
-        found = False
-        for asset_manager in self.managers_by_asset_address.values():
-            task = asset_manager.transfermanager.transfertasks.get(hashlock)
+        tasks = self.hashlock_index.get_tasks(hashlock)
 
-            if task is not None:
-                task.on_response(message)
-                found = True
+        for task in tasks:
+            task.on_response(message)
 
-        if not found:
+        if not tasks:
             # Log a warning and don't process further
             if log.isEnabledFor(logging.WARN):
                 log.warn(
@@ -251,6 +579,9 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
     def register_registry(self, registry):
         """ Register the registry and intialize all the related assets and
         channels.
+
+        The channel managers and the channels are registered concurrently,
+        with at most `startup_concurrency` registrations at the same time.
         """
         translator = ContractTranslator(REGISTRY_ABI)
 
@@ -266,12 +597,40 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
 
         self.registries.append(registry)
 
-        for manager_address in all_manager_addresses:
-            channel_manager = self.chain.manager(manager_address)
-            self.register_channel_manager(channel_manager)
+        start = time.time()
+        pool = Pool(self.config['startup_concurrency'])
+
+        channel_managers = pool.map(self.chain.manager, all_manager_addresses)
+        manager_channels = pool.map(self._register_channel_manager, channel_managers)
+
+        self._register_channels(pool, [
+            (asset_manager, netting_contract_address)
+            for asset_manager, all_netting_contracts in manager_channels
+            for netting_contract_address in all_netting_contracts
+        ])
+
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                'registry registered',
+                registry=pex(registry.address),
+                managers=len(channel_managers),
+                elapsed=time.time() - start,
+            )
 
     def register_channel_manager(self, channel_manager):
         """ Discover and register the channels for the given asset. """
+        asset_manager, all_netting_contracts = self._register_channel_manager(channel_manager)
+
+        pool = Pool(self.config['startup_concurrency'])
+        self._register_channels(pool, [
+            (asset_manager, netting_contract_address)
+            for netting_contract_address in all_netting_contracts
+        ])
+
+    def _register_channel_manager(self, channel_manager):
+        """ Create the AssetManager for `channel_manager`, returns it with the
+        addresses of this node's netting contracts that must be registered.
+        """
         translator = ContractTranslator(CHANNEL_MANAGER_ABI)
 
         # To avoid missing changes, first create the filter, call the
@@ -289,7 +648,7 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         asset_address_bin = channel_manager.asset_address()
         channel_manager_address_bin = channel_manager.address
         edges = channel_manager.channels_addresses()
-        channel_graph = ChannelGraph(edges)
+        channel_graph = ChannelGraph(edges, self.config['channel_graph_backend'])
 
         asset_manager = AssetManager(
             self,
@@ -300,12 +659,46 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         self.managers_by_asset_address[asset_address_bin] = asset_manager
         self.managers_by_address[channel_manager_address_bin] = asset_manager
 
-        for netting_contract_address in all_netting_contracts:
+        return asset_manager, all_netting_contracts
+
+    def _register_channels(self, pool, asset_channels):
+        """ Register the netting contracts using the greenlets of `pool`.
+
+        Args:
+            pool (gevent.pool.Pool): The pool that bounds the number of
+                concurrent registrations.
+            asset_channels (List[Tuple[AssetManager, bin]]): The asset
+                manager and the address of each netting contract.
+        """
+        total = len(asset_channels)
+        start = time.time()
+        registered = itertools.count(1)
+
+        def register(asset_channel):
+            asset_manager, netting_contract_address = asset_channel
+
             asset_manager.register_channel_by_address(
                 netting_contract_address,
                 self.config['reveal_timeout'],
             )
 
+            count = next(registered)
+            if count % 100 == 0 and log.isEnabledFor(logging.INFO):
+                log.info(
+                    'registering channels',
+                    progress='{}/{}'.format(count, total),
+                    elapsed=time.time() - start,
+                )
+
+        pool.map(register, asset_channels)
+
+        if total and log.isEnabledFor(logging.INFO):
+            log.info(
+                'channels registered',
+                channels=total,
+                elapsed=time.time() - start,
+            )
+
     def stop(self):
         for asset_manager in self.managers_by_asset_address.itervalues():
             for task in asset_manager.transfermanager.transfertasks.itervalues():
@@ -326,6 +719,15 @@ class RaidenService(object):  # pylint: disable=too-many-instance-attributes
         self.event_handler.uninstall_listeners()
         gevent.wait(wait_for)
 
+        if self.recovery_pool is not None:
+            self.recovery_pool.stop()
+
+        if self.signing_pool is not None:
+            self.signing_pool.stop()
+
+        if self.channel_store is not None:
+            self.channel_store.close()
+
 
 class RaidenAPI(object):
     """ CLI interface. """
@@ -588,7 +990,7 @@ class RaidenMessageHandler(object):
         cmdid = message.cmdid
 
         # using explicity dispatch to make the code grepable
-        if cmdid == messages.ACK:
+        if cmdid in (messages.ACK, messages.BATCHEDACK):
             pass
 
         elif cmdid == messages.PING:
@@ -711,7 +1113,11 @@ class RaidenEventHandler(object):
                 except:  # pylint: disable=bare-except
                     log.exception('unexpected exception on log listener')
 
-    def poll_all_event_listeners(self):
+    def poll_all_event_listeners(self, block_number):
+        # the chain fetches the events of all the filters at once, polling
+        # the filters doesn't require another request
+        self.raiden.chain.poll_filters(block_number)
+
         for event_listener in self.event_listeners:
             self.poll_event_listener(*event_listener)
 
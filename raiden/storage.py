@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+""" Storage of the off-chain state of the channels.
+
+The state that only exists off-chain (nonces, transferred amounts, locks and
+the signed transfers) must survive a restart, otherwise the node cannot prove
+its balance when a channel is closed. Every change to a channel is appended to
+a write-ahead log and the log is periodically compacted into a snapshot, on
+startup the snapshot and the log are read back and the channels restored
+without rescanning the chain.
+"""
+import os
+import struct
+import zlib
+
+import gevent
+import rlp
+from ethereum import slogging
+from ethereum.utils import big_endian_to_int, int_to_big_endian
+
+from raiden.channel import BalanceProof, PendingLock, UnlockPartialProof
+from raiden.messages import Lock, LockedTransfer, decode, decode_unverified
+from raiden.utils import sha3, pex
+
+log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
+
+# length and crc32 of the record, followed by the rlp encoded record
+RECORD_HEADER = struct.Struct('>II')
+
+SNAPSHOT_NAME = 'snapshot'
+LOG_PREFIX = 'wal.'
+
+
+def encode_record(record):
+    data = rlp.encode(record)
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def read_records(path):
+    """ Read the records of the file at `path`, the records after a damaged
+    or incomplete record are ignored since they were not committed.
+
+    Returns:
+        Tuple[List[list], int]: The decoded records and the size of the valid
+        data.
+    """
+    with open(path, 'rb') as handler:
+        data = handler.read()
+
+    records = list()
+    position = 0
+
+    while position + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        end = start + length
+        payload = data[start:end]
+
+        if end > len(data) or zlib.crc32(payload) & 0xffffffff != checksum:
+            break
+
+        records.append(rlp.decode(payload))
+        position = end
+
+    return records, position
+
+
+def encode_end_state(end_state):
+    balance_proof = end_state.balance_proof
+    transfer = balance_proof.transfer
+
+    return [
+        end_state.address,
+        int_to_big_endian(end_state.nonce),
+        int_to_big_endian(end_state.transferred_amount),
+        bytes(transfer.encode()) if transfer is not None else b'',
+        [
+            bytes(pendinglock.lock.as_bytes)
+            for pendinglock in balance_proof.hashlock_pendinglocks.itervalues()
+        ],
+        [
+            [bytes(partialproof.lock.as_bytes), partialproof.secret]
+            for partialproof in balance_proof.hashlock_unclaimedlocks.itervalues()
+        ],
+        [
+            [bytes(partialproof.lock.as_bytes), partialproof.secret]
+            for partialproof in balance_proof.hashlock_unlockedlocks.itervalues()
+        ],
+    ]
+
+
+def restore_end_state(end_state, encoded):
+    """ Restore the off-chain state of `end_state`, the contract balance is
+    read from the chain and is kept as is.
+    """
+    address, nonce, transferred_amount, transfer, pending, unclaimed, unlocked = encoded
+
+    if address != end_state.address:
+        raise ValueError('the stored state is for a different participant')
+
+    balance_proof = BalanceProof()
+
+    if transfer:
+        balance_proof.transfer = decode(transfer)
+
+    for lock_encoded in pending:
+        lock = Lock.from_bytes(lock_encoded)
+        lockhashed = sha3(lock_encoded)
+        balance_proof.hashlock_pendinglocks[lock.hashlock] = PendingLock(lock, lockhashed)
+        balance_proof.unclaimed_tree.add(lockhashed)
+        balance_proof.locked_amount += lock.amount
+
+    for lock_encoded, secret in unclaimed:
+        lock = Lock.from_bytes(lock_encoded)
+        lockhashed = sha3(lock_encoded)
+        balance_proof.hashlock_unclaimedlocks[lock.hashlock] = UnlockPartialProof(
+            lock,
+            lockhashed,
+            secret,
+        )
+        balance_proof.unclaimed_tree.add(lockhashed)
+        balance_proof.locked_amount += lock.amount
+
+    for lock_encoded, secret in unlocked:
+        lock = Lock.from_bytes(lock_encoded)
+        lockhashed = sha3(lock_encoded)
+        balance_proof.hashlock_unlockedlocks[lock.hashlock] = UnlockPartialProof(
+            lock,
+            lockhashed,
+            secret,
+        )
+
+    end_state.nonce = big_endian_to_int(nonce)
+    end_state.transferred_amount = big_endian_to_int(transferred_amount)
+    end_state.balance_proof = balance_proof
+
+
+class StoredEndState(object):
+    """ The stored state of a channel end, the log records are applied to it
+    in place so that a record only has to carry the change.
+    """
+
+    def __init__(self, encoded):
+        address, nonce, transferred_amount, transfer, pending, unclaimed, unlocked = encoded
+
+        self.address = address
+        self.nonce = big_endian_to_int(nonce)
+        self.transferred_amount = big_endian_to_int(transferred_amount)
+        self.transfer = transfer
+
+        # the encoded locks by hashlock, with the secret for the unclaimed and
+        # unlocked locks
+        self.pending = {
+            Lock.from_bytes(lock_encoded).hashlock: lock_encoded
+            for lock_encoded in pending
+        }
+        self.unclaimed = {
+            sha3(secret): [lock_encoded, secret]
+            for lock_encoded, secret in unclaimed
+        }
+        self.unlocked = {
+            sha3(secret): [lock_encoded, secret]
+            for lock_encoded, secret in unlocked
+        }
+
+    def encode(self):
+        """ Return the state in the format of `encode_end_state`. """
+        return [
+            self.address,
+            int_to_big_endian(self.nonce),
+            int_to_big_endian(self.transferred_amount),
+            self.transfer,
+            self.pending.values(),
+            self.unclaimed.values(),
+            self.unlocked.values(),
+        ]
+
+    def register_received_transfer(self, transfer, transfer_encoded):
+        """ Same as BalanceProof.register_locked_transfer and
+        register_direct_transfer for the recipient of `transfer`.
+        """
+        if isinstance(transfer, LockedTransfer):
+            self.pending[transfer.lock.hashlock] = bytes(transfer.lock.as_bytes)
+
+        self.transfer = transfer_encoded
+        self.unlocked = dict()
+
+    def register_secret(self, secret):
+        """ Same as BalanceProof.register_secret. """
+        hashlock = sha3(secret)
+        lock_encoded = self.pending.pop(hashlock, None)
+
+        if lock_encoded is not None:
+            self.unclaimed[hashlock] = [lock_encoded, secret]
+
+    def release_lock(self, secret):
+        """ Same as BalanceProof.release_lock_by_secret, returns the amount of
+        the released lock.
+        """
+        hashlock = sha3(secret)
+        lock_encoded = self.pending.pop(hashlock, None)
+
+        if lock_encoded is None:
+            lock_encoded, _ = self.unclaimed.pop(hashlock)
+
+        self.unlocked[hashlock] = [lock_encoded, secret]
+
+        return Lock.from_bytes(lock_encoded).amount
+
+
+def uncovered_transfers(state, transfers):
+    """ Return the encoded `transfers` that are not older than the latest
+    transfer of the balance proofs in `state`, the older transfers are covered
+    by the latest transfer in the same direction.
+    """
+    recipient_nonce = dict()
+    for end_state in state:
+        transfer = end_state.transfer
+
+        if transfer:
+            message, _ = decode_unverified(transfer)
+            recipient_nonce[message.recipient] = message.nonce
+
+    uncovered = list()
+    for transfer_encoded in transfers:
+        message, _ = decode_unverified(transfer_encoded)
+        nonce = recipient_nonce.get(message.recipient)
+
+        if nonce is None or message.nonce >= nonce:
+            uncovered.append(transfer_encoded)
+
+    return uncovered
+
+
+class ChannelStore(object):
+    """ Persists the off-chain state of the channels in the directory `path`.
+
+    The changes are buffered and written to the log by a single greenlet, so
+    all the changes done before the event loop runs again are committed with
+    one write and one fsync. `commit` can be called to make the changes
+    durable right away, e.g. before a message that depends on them is sent.
+
+    A channel's full state is logged once, the following changes are logged
+    as the transfer, secret or released lock that caused them and applied to
+    the stored state, so a record does not grow with the number of locks.
+
+    Once the log has `max_log_records` records a snapshot with the latest
+    state of every channel is written and a new log is started, the transfers
+    covered by the latest balance proofs are not kept in the snapshot.
+    """
+
+    max_log_records = 10000
+
+    def __init__(self, path, max_log_records=None):
+        if max_log_records is not None:
+            self.max_log_records = max_log_records
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.path = path
+
+        # the latest StoredEndStates of the channel ends and all the encoded
+        # transfers of every channel, by the netting channel address
+        self.address_state = dict()
+        self.address_transfers = dict()
+
+        self.log_id = 0
+        self.log_records = 0
+        self.pending = list()
+        self.committer = None
+
+        self._load()
+
+        self.log_file = open(self._log_path(self.log_id), 'ab')
+
+        if self.log_records:
+            # compact the log so the next start reads it only once
+            self.snapshot()
+
+    def _log_path(self, log_id):
+        return os.path.join(self.path, '{}{}'.format(LOG_PREFIX, log_id))
+
+    def _load(self):
+        snapshot_path = os.path.join(self.path, SNAPSHOT_NAME)
+
+        if os.path.exists(snapshot_path):
+            records, _ = read_records(snapshot_path)
+
+            for record in records:
+                self._apply(record)
+
+        log_path = self._log_path(self.log_id)
+
+        if os.path.exists(log_path):
+            records, size = read_records(log_path)
+
+            for record in records:
+                self._apply(record)
+
+            self.log_records = len(records)
+
+            # drop the partially written record, if any
+            with open(log_path, 'r+b') as handler:
+                handler.truncate(size)
+
+        for name in os.listdir(self.path):
+            stale_log = name.startswith(LOG_PREFIX) and name != LOG_PREFIX + str(self.log_id)
+
+            if stale_log:
+                os.remove(os.path.join(self.path, name))
+
+    def _apply(self, record):
+        kind = record[0]
+
+        if kind == 'log':
+            self.log_id = big_endian_to_int(record[1])
+
+        elif kind == 'channel':
+            _, address, state, transfers = record
+            self.address_state[address] = [StoredEndState(encoded) for encoded in state]
+            self.address_transfers[address] = transfers
+
+        elif kind == 'state':
+            _, address, our_state, partner_state = record
+            self.address_state[address] = [
+                StoredEndState(our_state),
+                StoredEndState(partner_state),
+            ]
+
+        elif kind == 'transfer':
+            _, address, transfer_encoded = record
+            self.address_transfers.setdefault(address, list()).append(transfer_encoded)
+
+            # the first transfer of a channel is followed by its full state
+            state = self.address_state.get(address)
+            if state is not None:
+                transfer, _ = decode_unverified(transfer_encoded)
+                sender_state, recipient_state = state
+
+                if sender_state.address == transfer.recipient:
+                    sender_state, recipient_state = recipient_state, sender_state
+
+                recipient_state.register_received_transfer(transfer, transfer_encoded)
+                sender_state.transferred_amount = transfer.transferred_amount
+                sender_state.nonce = transfer.nonce + 1
+
+        elif kind == 'secret':
+            _, address, secret = record
+
+            for end_state in self.address_state[address]:
+                end_state.register_secret(secret)
+
+        elif kind == 'release':
+            _, address, participant, secret = record
+            end_state, other_state = self.address_state[address]
+
+            if end_state.address != participant:
+                end_state, other_state = other_state, end_state
+
+            other_state.transferred_amount += end_state.release_lock(secret)
+
+        else:
+            raise ValueError('unknown record {}'.format(kind))
+
+    def _append(self, record):
+        self._apply(record)
+        self.pending.append(encode_record(record))
+
+        if self.committer is None:
+            self.committer = gevent.spawn(self.commit)
+
+    def log_state(self, channel):
+        """ Log the current state of both ends of `channel`. """
+        self._append([
+            'state',
+            channel.external_state.netting_channel.address,
+            encode_end_state(channel.our_state),
+            encode_end_state(channel.partner_state),
+        ])
+
+    def log_transfer(self, channel, transfer):
+        """ Log `transfer` after registering it with `channel`. """
+        address = channel.external_state.netting_channel.address
+        known = address in self.address_state
+
+        self._append([
+            'transfer',
+            address,
+            bytes(transfer.encode()),
+        ])
+
+        if not known:
+            self.log_state(channel)
+
+    def log_secret(self, channel, secret):
+        """ Log `secret` after registering it with `channel`. """
+        address = channel.external_state.netting_channel.address
+
+        if address in self.address_state:
+            self._append(['secret', address, secret])
+        else:
+            self.log_state(channel)
+
+    def log_release(self, channel, end_state, secret):
+        """ Log the release of the lock of `end_state` for `secret`. """
+        address = channel.external_state.netting_channel.address
+
+        if address in self.address_state:
+            self._append(['release', address, end_state.address, secret])
+        else:
+            self.log_state(channel)
+
+    def restore(self, channel):
+        """ Restore the off-chain state of `channel`.
+
+        Returns:
+            bool: True if a state was stored for the channel.
+        """
+        address = channel.external_state.netting_channel.address
+        state = self.address_state.get(address)
+
+        if state is None:
+            return False
+
+        our_state, partner_state = state
+        restore_end_state(channel.our_state, our_state.encode())
+        restore_end_state(channel.partner_state, partner_state.encode())
+
+        for transfer_encoded in self.address_transfers.get(address, ()):
+            transfer = decode(transfer_encoded)
+
+            if transfer.recipient == channel.partner_state.address:
+                channel.sent_transfers.append(transfer)
+            else:
+                channel.received_transfers.append(transfer)
+
+        # the channel must be notified of the secrets for the locks that are
+        # not unlocked yet, including the locks with a known secret that are
+        # waiting to be withdrawn or released
+        for end_state in (channel.our_state, channel.partner_state):
+            balance_proof = end_state.balance_proof
+
+            for hashlock, pendinglock in balance_proof.hashlock_pendinglocks.iteritems():
+                channel.external_state.register_channel_for_hashlock(
+                    channel,
+                    hashlock,
+                    pendinglock.lock.expiration,
+                )
+
+            for hashlock, partialproof in balance_proof.hashlock_unclaimedlocks.iteritems():
+                channel.external_state.register_channel_for_hashlock(
+                    channel,
+                    hashlock,
+                    partialproof.lock.expiration,
+                )
+
+        log.info(
+            'channel state restored',
+            channel=pex(address),
+            transfers=len(channel.sent_transfers) + len(channel.received_transfers),
+        )
+
+        return True
+
+    def commit(self):
+        """ Write and fsync the pending changes. """
+        if self.committer is not None and self.committer is not gevent.getcurrent():
+            self.committer.kill()
+        self.committer = None
+
+        if not self.pending:
+            return
+
+        data = b''.join(self.pending)
+        self.log_records += len(self.pending)
+        self.pending = list()
+
+        self.log_file.write(data)
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+
+        if self.log_records >= self.max_log_records:
+            self.snapshot()
+
+    def snapshot(self):
+        """ Write the latest state of all channels and start a new log. """
+        self.commit()
+
+        log_id = self.log_id + 1
+        snapshot_path = os.path.join(self.path, SNAPSHOT_NAME)
+        temporary_path = snapshot_path + '.tmp'
+
+        records = [encode_record(['log', int_to_big_endian(log_id)])]
+        for address, state in self.address_state.iteritems():
+            transfers = uncovered_transfers(state, self.address_transfers.get(address, list()))
+            self.address_transfers[address] = transfers
+
+            records.append(encode_record([
+                'channel',
+                address,
+                [end_state.encode() for end_state in state],
+                transfers,
+            ]))
+
+        with open(temporary_path, 'wb') as handler:
+            handler.write(b''.join(records))
+            handler.flush()
+            os.fsync(handler.fileno())
+
+        # the snapshot references the new log, so the records of the previous
+        # log are never applied twice, even if the node crashes before the
+        # previous log is removed
+        os.rename(temporary_path, snapshot_path)
+
+        directory = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        previous_path = self._log_path(self.log_id)
+        self.log_file.close()
+
+        self.log_id = log_id
+        self.log_records = 0
+        self.log_file = open(self._log_path(log_id), 'ab')
+
+        os.remove(previous_path)
+
+    def close(self):
+        self.commit()
+        self.log_file.close()
@@ -14,6 +14,7 @@ from random import randint
 from ethereum import slogging
 from ethereum.utils import sha3
 
+from raiden.blockchain.blocksource import BlockTimers, ESTIMATED_BLOCK_TIME
 from raiden.messages import (
     MediatedTransfer,
     RefundTransfer,
@@ -34,8 +35,8 @@ log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 REMOVE_CALLBACK = object()
 DEFAULT_EVENTS_POLL_TIMEOUT = 0.5
 DEFAULT_HEALTHCHECK_POLL_TIMEOUT = 1
-ESTIMATED_BLOCK_TIME = 7
 TIMEOUT = object()
+BLOCK_REACHED = object()
 
 
 class Task(gevent.Greenlet):
@@ -140,7 +141,15 @@ class HealthcheckTask(Task):
 
 
 class AlarmTask(Task):
-    """ Task to notify when a block is mined. """
+    """ Task to notify when a block is mined.
+
+    The new blocks are waited for with the chain's block source, that either
+    polls the chain or is notified by it.
+
+    Besides the callbacks called for every block, a callback can be scheduled
+    for a given block number, the scheduled callbacks are called after the
+    callbacks of the block.
+    """
 
     def __init__(self, chain):
         super(AlarmTask, self).__init__()
@@ -148,11 +157,13 @@ class AlarmTask(Task):
         self.callbacks = list()
         self.stop_event = AsyncResult()
         self.chain = chain
+        self.block_source = chain.block_source()
         self.last_block_number = self.chain.block_number()
 
-        # TODO: Start with a larger wait_time and decrease it as the
-        # probability of a new block increases.
-        self.wait_time = 0.5
+        self.timers = BlockTimers()
+        # the last block for which the callbacks were called, the scheduled
+        # callbacks of a new block are not called before the others
+        self.timers_block_number = self.last_block_number
 
     def register_callback(self, callback):
         """ Register a new callback.
@@ -167,14 +178,54 @@ class AlarmTask(Task):
 
         self.callbacks.append(callback)
 
+    def schedule(self, block_number, callback):
+        """ Call `callback(current_block)` once the block `block_number` is
+        mined, the callback is called right away if it already was.
+
+        Note:
+            Same as the callbacks, this callback should not block.
+
+        Returns:
+            BlockTimer: The handle used to cancel the callback.
+        """
+        timer = self.timers.schedule(block_number, callback)
+
+        if block_number <= self.timers_block_number:
+            self._expire_timers(self.timers_block_number)
+
+        return timer
+
+    def wait_for_block(self, block_number):
+        """ Block the current greenlet until the block `block_number` is mined.
+
+        Returns:
+            int: The current block number.
+        """
+        result = AsyncResult()
+        self.schedule(block_number, result.set)
+        return result.get()
+
+    def _expire_timers(self, current_block):
+        self.timers_block_number = current_block
+
+        for callback in self.timers.expire(current_block):
+            try:
+                callback(current_block)
+            except:  # pylint: disable=bare-except
+                log.exception('unexpected exception on block timer')
+
     def _run(self):  # pylint: disable=method-hidden
-        stop = None
         result = None
-        last_loop = time.time()
         log.debug('starting block number', block_number=self.last_block_number)
 
-        while stop is None:
-            current_block = self.chain.block_number()
+        while True:
+            current_block = self.block_source.wait_for_block(
+                self.last_block_number,
+                self.stop_event,
+            )
+
+            if current_block is None:
+                return
 
             if current_block > self.last_block_number + 1:
                 difference = current_block - self.last_block_number - 1
@@ -183,38 +234,23 @@ class AlarmTask(Task):
                     difference,
                 )
 
-            if current_block != self.last_block_number:
-                self.last_block_number = current_block
-                log.debug('new block', number=current_block, timestamp=last_loop)
-
-                remove = list()
-                for callback in self.callbacks:
-                    try:
-                        result = callback(current_block)
-                    except:  # pylint: disable=bare-except
-                        log.exception('unexpected exception on alarm')
-                    else:
-                        if result is REMOVE_CALLBACK:
-                            remove.append(callback)
-
-                for callback in remove:
-                    self.callbacks.remove(callback)
-
-            # we want this task to iterate in the tick of `wait_time`, so take
-            # into account how long we spent executing one tick.
-            work_time = time.time() - last_loop
-            if work_time > self.wait_time:
-                log.warning(
-                    'alarm loop is taking longer than the wait time',
-                    work_time=work_time,
-                    wait_time=self.wait_time,
-                )
-                sleep_time = 0.001
-            else:
-                sleep_time = self.wait_time - work_time
+            self.last_block_number = current_block
+            log.debug('new block', number=current_block, timestamp=time.time())
 
-            stop = self.stop_event.wait(sleep_time)
-            last_loop = time.time()
+            remove = list()
+            for callback in self.callbacks:
+                try:
+                    result = callback(current_block)
+                except:  # pylint: disable=bare-except
+                    log.exception('unexpected exception on alarm')
+                else:
+                    if result is REMOVE_CALLBACK:
+                        remove.append(callback)
+
+            for callback in remove:
+                self.callbacks.remove(callback)
+
+            self._expire_timers(current_block)
 
     def stop_and_wait(self):
         self.stop_event.set(True)
@@ -245,7 +281,9 @@ class BaseMediatedTransferTask(Task):
                 yield TIMEOUT
                 return
 
-            yield response
+            # a block wakeup is not a response
+            if response is not BLOCK_REACHED:
+                yield response
 
             current_time = time.time()
 
@@ -256,21 +294,49 @@ class BaseMediatedTransferTask(Task):
                 pex(transfer),
             )
 
+    def _wait_response_or_block(self, raiden, block_number):
+        """ Wait for a response message or for the block `block_number`.
+
+        Returns:
+            The response message, or BLOCK_REACHED if the block was mined
+            first.
+        """
+        timer = raiden.alarm.schedule(block_number, self._block_reached)
+
+        try:
+            return self.response_queue.get()
+        finally:
+            timer.cancel()
+            self._discard_block_reached()
+
+    def _block_reached(self, block_number):  # pylint: disable=unused-argument
+        self.response_queue.put(BLOCK_REACHED)
+
+    def _discard_block_reached(self):
+        """ Remove the wakeup of a block that was reached while a response
+        was waiting in the queue, so it's not read by the next wait.
+        """
+        responses = list()
+
+        while not self.response_queue.empty():
+            response = self.response_queue.get_nowait()
+
+            if response is not BLOCK_REACHED:
+                responses.append(response)
+
+        for response in responses:
+            self.response_queue.put(response)
+
     def _send_and_wait_block(self, raiden, recipient, transfer, expiration_block):
         """ Utility to handle multiple messages and timeout on a blocknumber. """
         raiden.send_async(recipient, transfer)
 
         current_block = raiden.get_block_number()
         while current_block < expiration_block:
-            try:
-                response = self.response_queue.get(
-                    timeout=DEFAULT_EVENTS_POLL_TIMEOUT
-                )
-            except Empty:
-                pass
-            else:
-                if response:
-                    yield response
+            response = self._wait_response_or_block(raiden, expiration_block)
+
+            if response is not BLOCK_REACHED and response:
+                yield response
 
             current_block = raiden.get_block_number()
 
@@ -322,38 +388,38 @@ class BaseMediatedTransferTask(Task):
                 )
                 return
 
-            try:
-                response = self.response_queue.get(
-                    timeout=DEFAULT_EVENTS_POLL_TIMEOUT
-                )
-            except Empty:
-                pass
-            else:
-                if isinstance(response, Secret):
-                    if response.identifier == identifier and response.asset == asset:
-                        assetmanager.handle_secretmessage(response)
-                    else:
-                        assetmanager.handle_secret(identifier, response.secret)
-
-                        if log.isEnabledFor(logging.ERROR):
-                            log.error(
-                                'Invalid Secret message received, expected message'
-                                ' for asset=%s identifier=%s received=%s',
-                                asset,
-                                identifier,
-                                response,
-                            )
-                elif isinstance(response, RevealSecret):
+            # the lock is withdrawn when the partner's Secret message is
+            # handled, and the Secret message is also sent to this task
+            response = self._wait_response_or_block(raiden, block_to_close + 1)
+
+            if response is BLOCK_REACHED:
+                continue
+
+            if isinstance(response, Secret):
+                if response.identifier == identifier and response.asset == asset:
+                    assetmanager.handle_secretmessage(response)
+                else:
                     assetmanager.handle_secret(identifier, response.secret)
 
-                elif log.isEnabledFor(logging.ERROR):
-                    log.error(
-                        'Invalid message ignoring. %s %s',
-                        repr(response),
-                        repr(self),
-                    )
+                    if log.isEnabledFor(logging.ERROR):
+                        log.error(
+                            'Invalid Secret message received, expected message'
+                            ' for asset=%s identifier=%s received=%s',
+                            asset,
+                            identifier,
+                            response,
+                        )
+            elif isinstance(response, RevealSecret):
+                assetmanager.handle_secret(identifier, response.secret)
+
+            elif log.isEnabledFor(logging.ERROR):
+                log.error(
+                    'Invalid message ignoring. %s %s',
+                    repr(response),
+                    repr(self),
+                )
 
-    def _wait_expiration(self, raiden, transfer, sleep=DEFAULT_EVENTS_POLL_TIMEOUT):
+    def _wait_expiration(self, raiden, transfer):
         """ Utility to wait until the expiration block.
 
         For a chain A-B-C, if an attacker controls A and C a mediated transfer
@@ -366,13 +432,8 @@ class BaseMediatedTransferTask(Task):
 
         expiration = transfer.lock.expiration + 1
 
-        while True:
-            current_block = raiden.get_block_number()
-
-            if current_block > expiration:
-                return
-
-            gevent.sleep(sleep)
+        # wait for the first block after `expiration`
+        raiden.alarm.wait_for_block(expiration + 1)
 
 
 # Note: send_and_wait_valid methods are used to check the message type and
@@ -443,6 +504,7 @@ class StartMediatedTransferTask(BaseMediatedTransferTask):
             lock_timeout = forward_channel.settle_timeout - forward_channel.reveal_timeout
             lock_expiration = raiden.get_block_number() + lock_timeout
 
+            raiden.wait_transfer_registered(forward_channel)
             mediated_transfer = forward_channel.create_mediatedtransfer(
                 node_address,
                 target,
@@ -452,10 +514,9 @@ class StartMediatedTransferTask(BaseMediatedTransferTask):
                 lock_expiration,
                 hashlock,
             )
-            raiden.sign(mediated_transfer)
-            forward_channel.register_transfer(mediated_transfer)
+            pending_transfer = raiden.register_transfer_async(forward_channel, mediated_transfer)
 
-            for response in self.send_and_iter_valid(raiden, path, mediated_transfer):
+            for response in self.send_and_iter_valid(raiden, path, pending_transfer):
                 valid_secretrequest = (
                     isinstance(response, SecretRequest) and
                     response.amount == amount and
@@ -464,11 +525,12 @@ class StartMediatedTransferTask(BaseMediatedTransferTask):
                 )
 
                 if valid_secretrequest:
+                    assetmanager.register_route_result(path[1], success=True)
+
                     # This node must reveal the Secret starting with the
                     # end-of-chain, the `next_hop` can not be trusted to reveal the
                     # secret to the other nodes.
-                    revealsecret_message = RevealSecret(secret)
-                    raiden.sign(revealsecret_message)
+                    revealsecret_message = raiden.get_revealsecret_message(secret, hashlock)
 
                     # we cannot wait for ever since the `target` might
                     # intentionally _not_ send the Ack, blocking us from
@@ -499,10 +561,12 @@ class StartMediatedTransferTask(BaseMediatedTransferTask):
                 # someone down the line timed out / couldn't proceed, try next
                 # path, stop listening for messages for the current hashlock
                 else:
+                    assetmanager.register_route_result(path[1], success=False)
+
                     # the initiator can unregister right away because it knowns
                     # no one else can reveal the secret
                     transfermanager.on_hashlock_result(hashlock, False)
-                    del assetmanager.hashlock_channel[hashlock]
+                    assetmanager.unregister_channels_for_hashlock(hashlock)
                     break
 
         if log.isEnabledFor(logging.DEBUG):
@@ -520,17 +584,17 @@ class StartMediatedTransferTask(BaseMediatedTransferTask):
         #   - open the required channels with these nodes
         self.done_result.set(False)
 
-    def send_and_iter_valid(self, raiden, path, mediated_transfer):  # noqa pylint: disable=no-self-use
-        """ Send the `mediated_transfer` and wait for either a message from
-        `target` or the `next_hop`.
+    def send_and_iter_valid(self, raiden, path, pending_transfer):  # noqa pylint: disable=no-self-use
+        """ Send the mediated transfer of `pending_transfer` and wait for
+        either a message from `target` or the `next_hop`.
         """
         next_hop = path[1]
         target = path[-1]
 
         response_iterator = self._send_and_wait_time(
             raiden,
-            mediated_transfer.recipient,
-            mediated_transfer,
+            pending_transfer.message.recipient,
+            pending_transfer,
             raiden.config['msg_timeout'],
         )
 
@@ -679,6 +743,7 @@ class MediateTransferTask(BaseMediatedTransferTask):
                 # less-than is used instead of less-than-equal)
                 2
             )
+            raiden.wait_transfer_registered(forward_channel)
             mediated_transfer = forward_channel.create_mediatedtransfer(
                 originating_transfer.initiator,
                 originating_transfer.target,
@@ -688,7 +753,6 @@ class MediateTransferTask(BaseMediatedTransferTask):
                 new_lock_expiration,
                 hashlock,
             )
-            raiden.sign(mediated_transfer)
 
             if log.isEnabledFor(logging.DEBUG):
                 log.debug(
@@ -701,15 +765,16 @@ class MediateTransferTask(BaseMediatedTransferTask):
                 forward_channel,
                 hashlock,
             )
-            forward_channel.register_transfer(mediated_transfer)
+            pending_transfer = raiden.register_transfer_async(forward_channel, mediated_transfer)
 
-            for response in self.send_and_iter_valid(raiden, path, mediated_transfer):
+            for response in self.send_and_iter_valid(raiden, path, pending_transfer):
                 valid_refund = (
                     isinstance(response, RefundTransfer) and
                     response.lock.amount == originating_transfer.lock.amount
                 )
 
                 if isinstance(response, RevealSecret):
+                    assetmanager.register_route_result(path[1], success=True)
                     assetmanager.handle_secret(
                         originating_transfer.identifier,
                         response.secret,
@@ -723,6 +788,7 @@ class MediateTransferTask(BaseMediatedTransferTask):
                     )
 
                 elif isinstance(response, Secret):
+                    assetmanager.register_route_result(path[1], success=True)
                     assetmanager.handle_secretmessage(response)
 
                     # Secret might be from a different node, wait for the
@@ -738,10 +804,12 @@ class MediateTransferTask(BaseMediatedTransferTask):
                     return
 
                 elif valid_refund:
+                    assetmanager.register_route_result(path[1], success=False)
                     forward_channel.register_transfer(response)
                     break
 
                 else:
+                    assetmanager.register_route_result(path[1], success=False)
                     timeout_message = originating_channel.create_timeouttransfer_for(
                         originating_transfer,
                     )
@@ -770,13 +838,15 @@ class MediateTransferTask(BaseMediatedTransferTask):
                 pex(hashlock),
             )
 
+        raiden.wait_transfer_registered(originating_channel)
         refund_transfer = originating_channel.create_refundtransfer_for(
             originating_transfer,
         )
-        raiden.sign(refund_transfer)
 
-        originating_channel.register_transfer(refund_transfer)
-        raiden.send_async(from_address, refund_transfer)
+        raiden.send_async(
+            from_address,
+            raiden.register_transfer_async(originating_channel, refund_transfer),
+        )
 
         self._wait_expiration(
             raiden,
@@ -784,11 +854,11 @@ class MediateTransferTask(BaseMediatedTransferTask):
         )
         transfermanager.on_hashlock_result(hashlock, False)
 
-    def send_and_iter_valid(self, raiden, path, mediated_transfer):
+    def send_and_iter_valid(self, raiden, path, pending_transfer):
         response_iterator = self._send_and_wait_time(
             raiden,
-            mediated_transfer.recipient,
-            mediated_transfer,
+            pending_transfer.message.recipient,
+            pending_transfer,
             raiden.config['msg_timeout'],
         )
 
@@ -857,7 +927,6 @@ class EndMediatedTransferTask(BaseMediatedTransferTask):
             originating_transfer.lock.hashlock,
             originating_transfer.lock.amount,
         )
-        raiden.sign(secret_request)
 
         # If the transfer timed out in the initiator a new hashlock will be
         # created and this task will not receive a secret, this is fine because
@@ -900,7 +969,7 @@ class EndMediatedTransferTask(BaseMediatedTransferTask):
         response_iterator = self._send_and_wait_block(
             raiden,
             originating_transfer.initiator,
-            secret_request,
+            raiden.sign_async(secret_request),
             originating_transfer.lock.expiration,
         )
 
@@ -992,6 +1061,7 @@ class StartExchangeTask(BaseMediatedTransferTask):
                 raiden.config['reveal_timeout']
             )
 
+            raiden.wait_transfer_registered(from_channel)
             from_mediated_transfer = from_channel.create_mediatedtransfer(
                 raiden.address,
                 target,
@@ -1001,14 +1071,13 @@ class StartExchangeTask(BaseMediatedTransferTask):
                 lock_expiration,
                 hashlock,
             )
-            raiden.sign(from_mediated_transfer)
-            from_channel.register_transfer(from_mediated_transfer)
+            pending_transfer = raiden.register_transfer_async(from_channel, from_mediated_transfer)
 
             # wait for the SecretRequest and MediatedTransfer
             to_mediated_transfer = self.send_and_wait_valid_state(
                 raiden,
                 path,
-                from_mediated_transfer,
+                pending_transfer,
                 to_asset,
                 to_amount,
             )
@@ -1017,7 +1086,7 @@ class StartExchangeTask(BaseMediatedTransferTask):
                 # the initiator can unregister right away since it knows the
                 # secret wont be revealed
                 from_transfermanager.on_hashlock_result(hashlock, False)
-                del from_assetmanager.hashlock_channel[hashlock]
+                from_assetmanager.unregister_channels_for_hashlock(hashlock)
 
             elif isinstance(to_mediated_transfer, MediatedTransfer):
                 to_hop = to_mediated_transfer.sender
@@ -1052,11 +1121,12 @@ class StartExchangeTask(BaseMediatedTransferTask):
             self,
             raiden,
             path,
-            from_asset_transfer,
+            pending_transfer,
             to_asset,
             to_amount):
-        """ Start the exchange by sending the first mediated transfer to the
-        taker and wait for mediated transfer for the exchanged asset.
+        """ Start the exchange by sending the first mediated transfer, the
+        message of `pending_transfer`, to the taker and wait for mediated
+        transfer for the exchanged asset.
 
         This method will validate the messages received, discard the invalid
         ones, and wait until a valid state is reached. The valid state is
@@ -1071,6 +1141,7 @@ class StartExchangeTask(BaseMediatedTransferTask):
         """
         # pylint: disable=too-many-arguments
 
+        from_asset_transfer = pending_transfer.message
         next_hop = path[1]
         taker_address = path[-1]  # taker_address and next_hop might be equal
 
@@ -1082,7 +1153,7 @@ class StartExchangeTask(BaseMediatedTransferTask):
         response_iterator = self._send_and_wait_time(
             raiden,
             from_asset_transfer.recipient,
-            from_asset_transfer,
+            pending_transfer,
             raiden.config['msg_timeout'],
         )
 
@@ -1151,8 +1222,7 @@ class StartExchangeTask(BaseMediatedTransferTask):
         """
         # pylint: disable=no-self-use
 
-        reveal_secret = RevealSecret(secret)
-        raiden.sign(reveal_secret)
+        reveal_secret = raiden.get_revealsecret_message(secret)
 
         # first reveal the secret to the last_node in the chain, proceed after
         # ack
@@ -1234,12 +1304,12 @@ class ExchangeTask(BaseMediatedTransferTask):
             from_mediated_transfer.lock.hashlock,
             from_mediated_transfer.lock.amount,
         )
-        raiden.sign(secret_request)
-        raiden.send_async(from_mediated_transfer.initiator, secret_request)
+        raiden.send_async(from_mediated_transfer.initiator, raiden.sign_async(secret_request))
 
         for path, to_channel in to_routes:
             to_next_hop = path[1]
 
+            raiden.wait_transfer_registered(to_channel)
             to_mediated_transfer = to_channel.create_mediatedtransfer(
                 raiden.address,  # this node is the new initiator
                 from_mediated_transfer.initiator,  # the initiator is the target for the to_asset
@@ -1248,7 +1318,6 @@ class ExchangeTask(BaseMediatedTransferTask):
                 lock_expiration,
                 hashlock,  # use the original hashlock
             )
-            raiden.sign(to_mediated_transfer)
 
             if log.isEnabledFor(logging.DEBUG):
                 log.debug(
@@ -1263,9 +1332,9 @@ class ExchangeTask(BaseMediatedTransferTask):
                 to_channel,
                 hashlock,
             )
-            to_channel.register_transfer(to_mediated_transfer)
+            pending_transfer = raiden.register_transfer_async(to_channel, to_mediated_transfer)
 
-            response = self.send_and_wait_valid(raiden, to_mediated_transfer)
+            response = self.send_and_wait_valid(raiden, pending_transfer)
 
             if log.isEnabledFor(logging.DEBUG):
                 log.debug(
@@ -1304,11 +1373,13 @@ class ExchangeTask(BaseMediatedTransferTask):
                     from_mediated_transfer,
                 )
 
-    def send_and_wait_valid(self, raiden, mediated_transfer):
+    def send_and_wait_valid(self, raiden, pending_transfer):
+        mediated_transfer = pending_transfer.message
+
         response_iterator = self._send_and_wait_time(
             raiden,
             mediated_transfer.recipient,
-            mediated_transfer,
+            pending_transfer,
             raiden.config['msg_timeout'],
         )
 
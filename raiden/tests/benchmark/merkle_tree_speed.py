@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import time
 
-from raiden.mtree import merkleroot
+from raiden.mtree import MutableMerkletree, merkleroot
 from raiden.utils import keccak
 
 
@@ -20,5 +20,23 @@ def do_test_speed(rounds=100, num_hashes=1000):
     print '%d additions per second' % (num_hashes * rounds / elapsed)
 
 
+def do_test_incremental_speed(rounds=100, num_hashes=1000):
+    values = [
+        keccak(str(i))
+        for i in range(num_hashes + rounds)
+    ]
+
+    tree = MutableMerkletree(values[:num_hashes])
+
+    start_time = time.time()
+    for value in values[num_hashes:]:
+        tree.add(value)
+
+    elapsed = time.time() - start_time
+
+    print '%d incremental additions per second' % (rounds / elapsed)
+
+
 if __name__ == '__main__':
     do_test_speed()
+    do_test_incremental_speed()
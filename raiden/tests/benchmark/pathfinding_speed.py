@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+
+from raiden.network.channelgraph import ChannelGraph
+
+
+def make_edge_list(num_nodes, channels_per_node):
+    addresses = [
+        '{:020d}'.format(i)
+        for i in range(num_nodes)
+    ]
+
+    return [
+        (address, random.choice(addresses))
+        for address in addresses
+        for __ in range(channels_per_node)
+    ]
+
+
+def do_test_speed(backend, num_nodes=10000, channels_per_node=5, rounds=100):
+    random.seed(0)
+    edge_list = make_edge_list(num_nodes, channels_per_node)
+
+    start_time = time.time()
+    channelgraph = ChannelGraph(edge_list, backend)
+    print '%s: graph built in %.2fs' % (backend, time.time() - start_time)
+
+    nodes = channelgraph.graph.nodes()
+    pairs = [
+        (random.choice(nodes), random.choice(nodes))
+        for __ in range(rounds)
+    ]
+
+    num_paths = 0
+    start_time = time.time()
+    for source, target in pairs:
+        # a new source on every round, so that the routes are not cached
+        channelgraph.source_dag.clear()
+
+        if channelgraph.has_path(source, target):
+            num_paths += len(list(channelgraph.get_shortest_paths(source, target)))
+
+    elapsed = time.time() - start_time
+
+    print '%s: %.1f searches per second, %.1f paths/s in a %d x %d network' % (
+        backend,
+        rounds / elapsed,
+        num_paths / elapsed,
+        num_nodes,
+        channels_per_node,
+    )
+
+
+if __name__ == '__main__':
+    for num_nodes in (10000, 100000):
+        do_test_speed('networkx', num_nodes, rounds=10)
+        do_test_speed('compact', num_nodes, rounds=10)
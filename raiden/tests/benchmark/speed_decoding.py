@@ -26,7 +26,8 @@ def run_timeit(message_name, message, iterations=ITERATIONS):
     data = message.encode()
 
     def test_encode():
-        message.encode()
+        # encode() is cached, packed() measures the codec
+        message.packed()
 
     def test_decode():
         decode(data)
@@ -34,7 +35,13 @@ def run_timeit(message_name, message, iterations=ITERATIONS):
     encode_time = timeit.timeit(test_encode, number=iterations)
     decode_time = timeit.timeit(test_decode, number=iterations)
 
-    print('{}: encode {} decode {}'.format(message_name, encode_time, decode_time))
+    print('{}: encode {} ({:.0f}/s) decode {} ({:.0f}/s)'.format(
+        message_name,
+        encode_time,
+        iterations / encode_time,
+        decode_time,
+        iterations / decode_time,
+    ))
 
 
 def test_ack(iterations=ITERATIONS):
@@ -54,9 +61,11 @@ def test_ping(iterations=ITERATIONS):
 def test_secret_request(iterations=ITERATIONS):
     identifier = 1
     hashlock = HASH
+    amount = 1
     msg = SecretRequest(
         identifier,
-        hashlock
+        hashlock,
+        amount,
     )
     msg.sign(PRIVKEY, ADDRESS)
     run_timeit('SecretRequest', msg, iterations=iterations)
@@ -65,9 +74,11 @@ def test_secret_request(iterations=ITERATIONS):
 def test_secret(iterations=ITERATIONS):
     identifier = 1
     secret = HASH
+    asset = ADDRESS
     msg = Secret(
         identifier,
-        secret
+        secret,
+        asset,
     )
     msg.sign(PRIVKEY, ADDRESS)
     run_timeit('Secret', msg, iterations=iterations)
@@ -164,6 +175,47 @@ def test_confirm_transfer(iterations=ITERATIONS):
     run_timeit('ConfirmTransfer', msg, iterations=iterations)
 
 
+def test_namedbuffer(iterations=ITERATIONS):
+    """ Compares accessing the fields one by one with the single struct call
+    of unpack_fields/pack_fields.
+    """
+    amount = 1
+    expiration = 1
+    hashlock = sha3(ADDRESS)
+    lock = Lock(amount, expiration, hashlock)
+
+    msg = MediatedTransfer(1, 1, ADDRESS, 1, ADDRESS, HASH, lock, ADDRESS, ADDRESS)
+    msg.sign(PRIVKEY, ADDRESS)
+    packed = msg.packed()
+    fields = packed.fields
+
+    def test_getattr():
+        for name in fields:
+            getattr(packed, name)
+
+    def test_unpack_fields():
+        packed.unpack_fields()
+
+    values = packed.unpack_fields()
+    del values['cmdid']
+
+    def test_setattr():
+        for name, value in values.items():
+            setattr(packed, name, value)
+
+    def test_pack_fields():
+        packed.pack_fields(**values)
+
+    for name, function in (
+            ('getattr', test_getattr),
+            ('unpack_fields', test_unpack_fields),
+            ('setattr', test_setattr),
+            ('pack_fields', test_pack_fields)):
+
+        elapsed = timeit.timeit(function, number=iterations)
+        print('namedbuffer {}: {} ({:.0f}/s)'.format(name, elapsed, iterations / elapsed))
+
+
 def test_all(iterations=ITERATIONS):
     test_mediated_transfer(iterations=iterations)
     test_ack(iterations=iterations)
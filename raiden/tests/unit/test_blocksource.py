@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import time
+
+import gevent
+from gevent.event import AsyncResult
+
+from raiden.blockchain.blocksource import BlockTimers, PollingBlockSource, PushBlockSource
+
+
+class Chain(object):  # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.number = 1
+        self.polls = 0
+
+    def block_number(self):
+        self.polls += 1
+        return self.number
+
+
+def test_polling_block_source():
+    chain = Chain()
+    source = PollingBlockSource(chain, block_time=7, min_poll_interval=0.01)
+
+    # the time of the last block is unknown
+    assert source.poll_interval() == 0.01
+    assert source.wait_for_block(0, AsyncResult()) == 1
+
+    # right after a block the next one is not expected for a while
+    assert 3 < source.poll_interval() <= 3.5
+
+    source.last_block_time = time.time() - 7
+    assert source.poll_interval() == 0.01
+
+    stop_event = AsyncResult()
+    waiter = gevent.spawn(source.wait_for_block, 1, stop_event)
+    gevent.sleep(0.05)
+    chain.number = 2
+    assert waiter.get(timeout=1) == 2
+
+    stop_event.set(True)
+    assert source.wait_for_block(2, stop_event) is None
+
+
+def test_push_block_source():
+    chain = Chain()
+    source = PushBlockSource(chain)
+    stop_event = AsyncResult()
+
+    waiter = gevent.spawn(source.wait_for_block, 1, stop_event)
+    gevent.sleep(0.05)
+    polls = chain.polls
+
+    # the chain is not polled until it notifies a new block
+    gevent.sleep(0.05)
+    assert chain.polls == polls
+
+    chain.number = 2
+    source.new_block(2)
+    assert waiter.get(timeout=1) == 2
+
+    waiter = gevent.spawn(source.wait_for_block, 2, stop_event)
+    gevent.sleep(0)
+    stop_event.set(True)
+    assert waiter.get(timeout=1) is None
+
+
+def test_block_timers():
+    timers = BlockTimers()
+    called = list()
+
+    timers.schedule(3, lambda block: called.append(('three', block)))
+    timers.schedule(2, lambda block: called.append(('two', block)))
+    cancelled = timers.schedule(2, lambda block: called.append(('cancelled', block)))
+    timers.schedule(5, lambda block: called.append(('five', block)))
+
+    cancelled.cancel()
+    assert len(timers) == 3
+
+    assert timers.expire(1) == []
+
+    for callback in timers.expire(3):
+        callback(3)
+
+    assert called == [('two', 3), ('three', 3)]
+    assert len(timers) == 1
+
+    # the cancelled timers are dropped once they are half of the heap
+    for block_number in range(10, 20):
+        timers.schedule(block_number, called.append).cancel()
+    assert len(timers) == 1
+    assert len(timers.heap) < 10
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import random
+
+import networkx
+import pytest
+
+from raiden.network.channelgraph import ChannelGraph, CompactGraph
+
+
+def make_address(number):
+    return chr(number) * 20
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_route_cache(backend):
+    address0, address1, address2, address3 = [make_address(i) for i in range(1, 5)]
+
+    channelgraph = ChannelGraph(
+        [
+            (address0, address1),
+            (address1, address2),
+        ],
+        backend,
+    )
+
+    assert list(channelgraph.get_shortest_paths(address0, address2)) == [
+        [address0, address1, address2],
+    ]
+    assert list(channelgraph.get_shortest_paths(address0, address2)) == [
+        [address0, address1, address2],
+    ]
+    assert channelgraph.get_stats()['misses'] == 1
+    assert channelgraph.get_stats()['hits'] == 1
+
+    # a new shortest path to address2 is added to the cached routes
+    channelgraph.add_path(address0, address3)
+    channelgraph.add_path(address3, address2)
+    assert sorted(channelgraph.get_shortest_paths(address0, address2)) == [
+        [address0, address1, address2],
+        [address0, address3, address2],
+    ]
+    assert channelgraph.get_stats()['invalidations'] == 0
+
+    # removing one of the paths keeps the other
+    channelgraph.remove_path(address1, address2)
+    assert list(channelgraph.get_shortest_paths(address0, address2)) == [
+        [address0, address3, address2],
+    ]
+    assert channelgraph.get_stats()['invalidations'] == 0
+
+    # removing the last shortest path invalidates the cached routes
+    channelgraph.remove_path(address3, address2)
+    assert channelgraph.get_stats()['invalidations'] == 1
+    assert not channelgraph.has_path(address0, address2)
+
+    with pytest.raises(networkx.NetworkXError):
+        channelgraph.remove_path(address3, address2)
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_route_cache_random_changes(backend):
+    random.seed(42)
+    addresses = [make_address(i) for i in range(1, 21)]
+    edge_list = [
+        tuple(random.sample(addresses, 2))
+        for _ in range(25)
+    ]
+
+    graph = networkx.Graph(edge_list)
+    channelgraph = ChannelGraph(edge_list, backend)
+
+    for _ in range(200):
+        if random.random() < 0.5:
+            first, second = random.sample(addresses, 2)
+            graph.add_edge(first, second)
+            channelgraph.add_path(first, second)
+        else:
+            first, second = random.choice(graph.edges())
+            graph.remove_edge(first, second)
+            channelgraph.remove_path(first, second)
+
+        source = random.choice(graph.nodes())
+        for target in graph.nodes():
+            has_path = networkx.has_path(graph, source, target)
+            assert channelgraph.has_path(source, target) == has_path
+
+            if has_path and source != target:
+                expected = sorted(networkx.all_shortest_paths(graph, source, target))
+                assert sorted(channelgraph.get_shortest_paths(source, target)) == expected
+
+
+def test_compact_graph(monkeypatch):
+    monkeypatch.setattr(CompactGraph, 'min_compact_edits', 2)
+
+    random.seed(42)
+    addresses = [make_address(i) for i in range(1, 21)]
+    edge_list = [
+        tuple(random.sample(addresses, 2))
+        for _ in range(25)
+    ]
+
+    graph = networkx.Graph(edge_list)
+    compact = CompactGraph(edge_list)
+
+    for _ in range(100):
+        if random.random() < 0.5:
+            first, second = random.sample(addresses, 2)
+            graph.add_edge(first, second)
+            compact.add_edge(first, second)
+        else:
+            first, second = random.choice(graph.edges())
+            graph.remove_edge(first, second)
+            compact.remove_edge(first, second)
+
+        assert sorted(compact.nodes()) == sorted(graph.nodes())
+        assert sorted(map(sorted, compact.edges())) == sorted(map(sorted, graph.edges()))
+
+        for node in graph.nodes():
+            assert sorted(compact[node]) == sorted(graph[node])
+            assert compact.degree(node) == graph.degree(node)
@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
+import gevent
 import pytest
-from raiden.messages import Ping, Ack, decode, Lock, MediatedTransfer
-from raiden.utils import make_privkey_address, sha3
+from raiden.messages import (
+    Ping,
+    Ack,
+    BatchedAck,
+    decode,
+    decode_unverified,
+    Lock,
+    MediatedTransfer,
+)
+from raiden.encoding.signing import SenderCache
+from raiden.network.recovery import RecoveryPool
+from raiden.network.signer import SigningPool
+from raiden.utils import make_privkey_address, publickey_to_address, sha3
 
 PRIVKEY, ADDRESS = make_privkey_address()
 
@@ -45,6 +57,22 @@ def test_ack():
     assert sha3(decoded_ack.encode()) == msghash
 
 
+def test_batched_ack():
+    echoes = [sha3(str(i)) for i in range(BatchedAck.max_echoes)]
+    ack = BatchedAck(ADDRESS, echoes)
+    data = ack.encode()
+    assert len(data) == 24 + 32 * len(echoes)
+
+    decoded_ack = decode(data)
+    assert isinstance(decoded_ack, BatchedAck)
+    assert decoded_ack.sender == ack.sender
+    assert decoded_ack.echoes == echoes
+    assert decoded_ack.encode() == data
+
+    with pytest.raises(ValueError):
+        BatchedAck(ADDRESS, echoes + [sha3(PRIVKEY)]).encode()
+
+
 def test_mediated_transfer():
     nonce = balance = 1
     asset = recipient = target = initiator = ADDRESS
@@ -160,3 +188,140 @@ def test_mediated_transfer_fee_out_of_bounds(fee):
 def test_mediated_transfer_fee_min_max(fee):
     mediated_transfer = make_mediated_transfer_with_fee(fee)
     assert roundtrip_serialize_mediated_transfer(mediated_transfer)
+
+
+def test_encoding_cache():
+    ping = Ping(nonce=0)
+    ping.sign(PRIVKEY, ADDRESS)
+
+    data = ping.encode()
+    assert ping.encode() is data
+    assert ping.hash == sha3(data)
+
+    # setting an attribute invalidates the cached values
+    ping.nonce = 1
+    assert ping.encode() != data
+    assert decode(ping.encode()).nonce == 1
+    assert ping.hash == sha3(ping.encode())
+
+    ping.sign(PRIVKEY, ADDRESS)
+    assert decode(ping.encode()).sender == ADDRESS
+
+
+def test_decode_memoryview():
+    lock = Lock(amount=1, expiration=1, hashlock=sha3('secret'))
+    transfer = MediatedTransfer(1, 1, ADDRESS, 1, ADDRESS, lock.hashlock, lock, ADDRESS, ADDRESS)
+    transfer.sign(PRIVKEY, ADDRESS)
+    data = transfer.encode()
+
+    # the message is a slice of a larger buffer, e.g. a datagram with many
+    # messages
+    view = memoryview(b'\x00' + data + b'\x00')[1:-1]
+    decoded = decode(view)
+
+    assert decoded == transfer
+    assert decoded.sender == ADDRESS
+    assert isinstance(decoded.asset, bytes)
+    assert isinstance(decoded.signature, bytes)
+    assert decoded.encode() == data
+    assert isinstance(decoded.encode(), bytes)
+
+
+def test_sender_cache():
+    ping = Ping(nonce=0)
+    ping.sign(PRIVKEY, ADDRESS)
+    packed = ping.packed()
+    message_data = packed.data[:-65]
+    signature = ping.signature
+
+    cache = SenderCache(maxsize=1)
+    assert cache.recover_address(message_data, signature) == ADDRESS
+    assert cache.recover_address(message_data, signature) == ADDRESS
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # the least recently used entry is evicted
+    other = Ping(nonce=1)
+    other.sign(PRIVKEY, ADDRESS)
+    assert cache.recover_address(other.packed().data[:-65], other.signature) == ADDRESS
+    assert cache.recover_address(message_data, signature) == ADDRESS
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # a retransmitted message is decoded with the cached address
+    decoded = decode(ping.encode())
+    assert decode(ping.encode()) == decoded
+    assert decoded.sender == ADDRESS
+
+    # the addresses recovered by the RecoveryPool are added by key
+    key = cache.cache_key(other.packed().data[:-65], other.signature)
+    assert cache.get_address(key) is None
+    cache.add_address(key, ADDRESS)
+    assert cache.get_address(key) == ADDRESS
+
+
+def test_recovery_pool():
+    pings = list()
+    for nonce in range(10):
+        ping = Ping(nonce=nonce)
+        ping.sign(PRIVKEY, ADDRESS)
+        pings.append(ping)
+
+    pool = RecoveryPool(2)
+    try:
+        decoded = [decode_unverified(ping.encode()) for ping in pings]
+        results = [pool.recover(*signed) for _, signed in decoded]
+
+        for (message, _), result in zip(decoded, results):
+            message.sender = publickey_to_address(result.get(timeout=10))
+
+        assert [message for message, _ in decoded] == pings
+        assert all(message.sender == ADDRESS for message, _ in decoded)
+
+        # a tampered message recovers a different sender
+        data = bytearray(pings[0].encode())
+        data[4] ^= 1
+        message, signed = decode_unverified(bytes(data))
+        publickey = pool.recover(*signed).get(timeout=10)
+        assert publickey is None or publickey_to_address(publickey) != ADDRESS
+    finally:
+        pool.stop()
+
+    ack_message, signed = decode_unverified(Ack(ADDRESS, sha3('echo')).encode())
+    assert isinstance(ack_message, Ack)
+    assert signed is None
+
+
+def test_recovery_pool_worker_exit():
+    ping = Ping(nonce=0)
+    ping.sign(PRIVKEY, ADDRESS)
+    _, signed = decode_unverified(ping.encode())
+
+    pool = RecoveryPool(1)
+    try:
+        worker = pool.workers[0]
+        worker.process.terminate()
+
+        while worker.alive:
+            gevent.sleep(0.01)
+
+        # the public key is recovered in the node's process once the workers exited
+        publickey = pool.recover(*signed).get(timeout=10)
+        assert publickey_to_address(publickey) == ADDRESS
+    finally:
+        pool.stop()
+
+
+def test_signing_pool():
+    pool = SigningPool(2, PRIVKEY.private_key)
+    try:
+        pings = [Ping(nonce=nonce) for nonce in range(10)]
+        results = [pool.sign_message(ping, ADDRESS) for ping in pings]
+
+        for ping, result in zip(pings, results):
+            assert result.get(timeout=10) is ping
+
+            expected = Ping(nonce=ping.nonce)
+            expected.sign(PRIVKEY, ADDRESS)
+            assert ping.signature == expected.signature
+            assert decode(ping.encode()).sender == ADDRESS
+    finally:
+        pool.stop()
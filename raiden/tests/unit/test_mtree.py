@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 import pytest
 
-from raiden.mtree import merkleroot, check_proof, get_proof, NoHash32Error
+from raiden.mtree import (
+    MutableMerkletree,
+    NoHash32Error,
+    check_proof,
+    get_proof,
+    get_proofs,
+    merkleroot,
+)
 from raiden.utils import keccak
 
 
@@ -140,3 +147,56 @@ def test_many(tree_up_to=10):
             assert check_proof(second_proof, merkle_root, value) is True
 
         assert merkleroot(merkle_tree) == merkleroot(reversed(merkle_tree))
+
+
+def test_get_proofs(tree_up_to=10):
+    for number_of_leaves in range(1, tree_up_to):
+        merkle_tree = [
+            keccak(str(value))
+            for value in range(number_of_leaves)
+        ]
+        merkle_root = merkleroot(merkle_tree)
+
+        merkle_proofs = get_proofs(merkle_tree, merkle_tree, merkle_root)
+
+        for value, merkle_proof in zip(merkle_tree, merkle_proofs):
+            assert merkle_proof == get_proof(merkle_tree, value)
+            assert check_proof(merkle_proof, merkle_root, value) is True
+
+    with pytest.raises(ValueError):
+        get_proofs(merkle_tree, [keccak('unknown')])
+
+
+def test_mutable_merkletree(tree_up_to=10):
+    tree = MutableMerkletree()
+    assert tree.merkleroot == ''
+
+    with pytest.raises(NoHash32Error):
+        tree.add('not32bytes')
+
+    elements = [
+        keccak(str(value))
+        for value in range(tree_up_to)
+    ]
+
+    for position, value in enumerate(elements):
+        expected_root = merkleroot(elements[:position + 1])
+
+        assert tree.merkleroot_with(value) == expected_root
+        assert tree.merkleroot == merkleroot(elements[:position])
+
+        assert tree.add(value) == expected_root
+        assert tree.add(value) == expected_root, 'duplicates should be ignored'
+        assert tree.merkleroot == expected_root
+        assert value in tree
+
+    assert MutableMerkletree(elements).merkleroot == tree.merkleroot
+
+    for position, value in enumerate(elements):
+        assert tree.remove(value) == merkleroot(elements[position + 1:])
+        assert value not in tree
+
+        with pytest.raises(ValueError):
+            tree.remove(value)
+
+    assert tree.merkleroot == ''
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
-from raiden.encoding.format import Field, namedbuffer
+import pytest
+
+from raiden.encoding.format import Field, namedbuffer, pad
 from raiden.encoding.encoders import integer
 
 # pylint: disable=invalid-name
 byte = Field('byte', 1, 'B', None)
 hugeint = Field('huge', 100, '100s', integer(0, 2 ** (8 * 100)))
+smallint = Field('small', 8, '8s', integer(0, 2 ** 64 - 1))
 SingleByte = namedbuffer('SingleByte', [byte])
 HugeInt = namedbuffer('HugeInt', [hugeint])
+Mixed = namedbuffer('Mixed', [byte, pad(3), smallint, hugeint])
 
 
 def test_byte():
@@ -45,3 +49,48 @@ def test_decoder_long():
     huge = 2 ** (8 * 100) - 1
     packed_data.huge = huge
     assert packed_data.huge == huge
+
+
+def test_pack_unpack_fields():
+    data = bytearray(Mixed.size)
+    assert Mixed.size == 1 + 3 + 8 + 100
+
+    packed_data = Mixed(data)
+    packed_data.pack_fields(byte=b'\x01', small=2 ** 64 - 1, huge=3)
+    assert packed_data.unpack_fields() == {
+        'byte': b'\x01',
+        'small': 2 ** 64 - 1,
+        'huge': 3,
+    }
+
+    assert packed_data.small == 2 ** 64 - 1
+    assert data[4:12] == b'\xff' * 8
+    assert data[-1:] == b'\x03'
+
+    # fields without a value are kept
+    packed_data.pack_fields(small=7)
+    assert packed_data.byte == b'\x01'
+    assert packed_data.small == 7
+    assert packed_data.huge == 3
+
+    with pytest.raises(ValueError):
+        packed_data.pack_fields(small=2 ** 64)
+
+    with pytest.raises(ValueError):
+        packed_data.small = -1
+
+
+def test_native_integer_range():
+    # same range as the message fields, one more than fits in 8 bytes
+    nonce = Field('nonce', 8, '8s', integer(0, 2 ** 64))
+    Nonce = namedbuffer('Nonce', [nonce])
+    packed_data = Nonce(bytearray(Nonce.size))
+
+    with pytest.raises(ValueError):
+        packed_data.pack_fields(nonce=2 ** 64)
+
+    with pytest.raises(ValueError):
+        packed_data.nonce = 2 ** 64
+
+    packed_data.pack_fields(nonce=2 ** 64 - 1)
+    assert packed_data.nonce == 2 ** 64 - 1
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 import pytest
 import gevent
+from gevent.event import AsyncResult, Event
 from ethereum import slogging
 
-from raiden.utils import sha3
-from raiden.messages import Ping, Ack, decode
+from raiden.channel import InvalidNonce
+from raiden.utils import make_address, make_privkey_address, sha3
+from raiden.messages import DirectTransfer, Ping, Ack, decode
+from raiden.blockchain.blocksource import BlockTimers
+from raiden.network.protocol import (
+    ExpiringCache,
+    NotifyingQueue,
+    RetransmissionTimer,
+    SentMessage,
+)
 from raiden.network.transport import UnreliableTransport, UDPTransport, RaidenProtocol
+from raiden.network.signer import PendingSignature, SigningPool
+from raiden.raiden_service import HashlockIndex
 from raiden.tests.utils.messages import setup_messages_cb
 
 slogging.configure(':DEBUG')
@@ -121,6 +132,63 @@ def test_ping_udp(raiden_network):
     assert decoded.echo == sha3(ping.encode() + app1.raiden.address)
 
 
+@pytest.mark.parametrize('blockchain_type', ['mock'])
+@pytest.mark.parametrize('number_of_nodes', [2])
+def test_send_pending_signature(raiden_network):
+    app0, app1 = raiden_network  # pylint: disable=unbalanced-tuple-unpacking
+
+    messages = setup_messages_cb()
+
+    first = PendingSignature(Ping(nonce=0))
+    second = Ping(nonce=1)
+    app0.raiden.sign(second)
+
+    first_result = app0.raiden.protocol.send_async(app1.raiden.address, first)
+    second_result = app0.raiden.protocol.send_async(app1.raiden.address, second)
+
+    # the second message waits for the first to be signed
+    gevent.sleep(0.1)
+    assert not messages
+
+    app0.raiden.sign(first.message)
+    first.set(first.message)
+
+    assert first_result.wait(timeout=1)
+    assert second_result.wait(timeout=1)
+
+    pings = [decode(data) for data in messages if isinstance(decode(data), Ping)]
+    assert pings == [first.message, second]
+
+
+@pytest.mark.parametrize('blockchain_type', ['mock'])
+@pytest.mark.parametrize('number_of_nodes', [2])
+def test_register_transfer_async(raiden_network):
+    app0, app1 = raiden_network  # pylint: disable=unbalanced-tuple-unpacking
+
+    raiden = app0.raiden
+    asset_manager0 = raiden.managers_by_asset_address.values()[0]
+    channel0 = asset_manager0.partneraddress_channel[app1.raiden.address]
+
+    raiden.signing_pool = SigningPool(1, raiden.private_key.private_key)
+    try:
+        first = channel0.create_directtransfer(1, identifier=1)
+        pending = raiden.register_transfer_async(channel0, first)
+
+        # the transfer is registered once it is signed
+        assert channel0.unregistered_transfer is pending
+        assert not channel0.sent_transfers
+
+        raiden.wait_transfer_registered(channel0)
+        assert pending.get() is first
+        assert channel0.sent_transfers == [first]
+
+        second = channel0.create_directtransfer(1, identifier=2)
+        assert second.nonce == first.nonce + 1
+    finally:
+        raiden.signing_pool.stop()
+        raiden.signing_pool = None
+
+
 @pytest.mark.parametrize('privatekey_seed', ['ping_dropped_message:{}'])
 @pytest.mark.parametrize('blockchain_type', ['mock'])
 @pytest.mark.parametrize('number_of_nodes', [2])
@@ -163,3 +231,294 @@ def test_ping_ordering(raiden_network):
         assert decoded.echo == hashes[j]
 
     RaidenProtocol.repeat_messages = False
+
+
+def test_protocol_window():
+    protocol = RaidenProtocol(transport=None, discovery=None, raiden=None)
+    queue = NotifyingQueue()
+    inflight = list()
+
+    asset = make_address()
+    recipient = make_address()
+
+    def sent_message(message):
+        return SentMessage(message, None, None, None, protocol.max_retries)
+
+    assert not protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+
+    for nonce in range(1, protocol.window_size + 2):
+        transfer = DirectTransfer(1, nonce, asset, nonce, recipient, '')
+        queue.put((transfer, None, None))
+
+    # transfers are validated in order by the receiver and can be pipelined
+    for _ in range(protocol.window_size):
+        assert protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+        inflight.append(sent_message(queue.get()[0]))
+
+    assert not protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+
+    # any other message must wait for all the previous messages to be acknowledged
+    inflight = [inflight[0]]
+    queue = NotifyingQueue()
+    queue.put((Ping(nonce=0), None, None))
+    assert not protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+
+    inflight = list()
+    assert protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+    inflight.append(sent_message(queue.get()[0]))
+
+    transfer = DirectTransfer(1, 1, asset, 1, recipient, '')
+    queue.put((transfer, None, None))
+    assert not protocol._can_send_next(queue, inflight)  # pylint: disable=protected-access
+
+
+def test_protocol_retransmission_timer():
+    timer = RetransmissionTimer(
+        initial_timeout=1.,
+        min_timeout=0.05,
+        max_timeout=10.,
+        jitter=0,
+    )
+
+    # the initial timeout is used until a round trip time is measured
+    assert timer.next_timeout() == 1.
+
+    # the timeout of the node is doubled for every message that times out
+    timer.timed_out(timer.backoff)
+    assert timer.next_timeout() == 2.
+
+    # a message sent before the previous backoff does not double it again
+    timer.timed_out(0)
+    assert timer.next_timeout() == 2.
+
+    timer.timed_out(timer.backoff)
+    assert timer.next_timeout() == 4.
+
+    for _ in range(10):
+        timer.timed_out(timer.backoff)
+    assert timer.next_timeout() == 10.
+
+    # a measured round trip time resets the backoff
+    timer.add_sample(0.1)
+    assert timer.backoff == 0
+    assert timer.smoothed_rtt == 0.1
+    assert timer.rtt_variation == 0.05
+    assert timer.timeout == 0.1 + 4 * 0.05
+    assert timer.next_timeout() == timer.timeout
+
+    # a stable round trip time reduces the variation
+    for _ in range(50):
+        timer.add_sample(0.1)
+    assert 0.05 <= timer.timeout < 0.11
+
+    timer.add_sample(0.)
+    assert timer.timeout >= timer.min_timeout
+
+    timer.add_sample(100.)
+    assert timer.timeout == timer.max_timeout
+
+
+def test_protocol_expiring_cache():
+    cache = ExpiringCache(ttl=0.1, maxsize=3)
+
+    cache['a'] = 1
+    cache['b'] = 2
+    assert 'a' in cache
+    assert cache.get('b') == 2
+    assert len(cache) == 2
+
+    # the current generation is full, the entries are kept for another
+    # generation
+    cache['c'] = 3
+    cache['d'] = 4
+    assert len(cache) == 4
+    assert cache.get('a') == 1
+    assert cache.evicted == 0
+
+    cache['e'] = 5
+    cache['f'] = 6
+    assert 'a' not in cache
+    assert cache.get('d') == 4
+    assert cache.evicted == 3
+
+    assert cache.pop('d') == 4
+    assert cache.pop('d') is None
+
+    gevent.sleep(0.2)
+    assert 'e' not in cache
+    assert len(cache) == 0
+    assert cache.evicted == 5
+
+
+def test_protocol_inflight_messages():
+    privkey, address = make_privkey_address()
+    handled = Event()
+    received = list()
+
+    class Raiden(object):  # pylint: disable=too-few-public-methods
+        def __init__(self):
+            self.address = make_address()
+
+        def on_message(self, message, echohash):  # pylint: disable=unused-argument
+            received.append(message)
+            handled.wait()
+            raise InvalidNonce(message)
+
+    protocol = RaidenProtocol(transport=None, discovery=None, raiden=Raiden())
+
+    ping = Ping(nonce=0)
+    ping.sign(privkey, address)
+    data = ping.encode()
+
+    first = gevent.spawn(protocol.receive, data)
+    gevent.sleep(0)
+    assert protocol.get_stats()['inflight'] == 1
+
+    # a retransmission is dropped while the first message is being handled
+    protocol.receive(data)
+    assert len(received) == 1
+
+    handled.set()
+    first.join()
+    assert protocol.get_stats()['inflight'] == 0
+
+    protocol.receive(data)
+    assert len(received) == 2
+
+
+def test_protocol_recovered_message_error():
+    privkey, address = make_privkey_address()
+    publickey = privkey.pubkey.serialize(compressed=False)
+    received = list()
+
+    class RecoveryPool(object):  # pylint: disable=too-few-public-methods
+        def recover(self, message_data, signature):  # pylint: disable=unused-argument
+            async_result = AsyncResult()
+            async_result.set(publickey)
+            return async_result
+
+    class Raiden(object):  # pylint: disable=too-few-public-methods
+        def __init__(self):
+            self.address = make_address()
+
+        def on_message(self, message, echohash):  # pylint: disable=unused-argument
+            received.append(message)
+
+            if message.nonce == 0:
+                raise ValueError('invalid message')
+
+            raise InvalidNonce(message)
+
+    protocol = RaidenProtocol(
+        transport=None,
+        discovery=None,
+        raiden=Raiden(),
+        recovery_pool=RecoveryPool(),
+    )
+
+    for nonce in range(2):
+        ping = Ping(nonce=nonce)
+        ping.sign(privkey, address)
+        protocol.receive(ping.encode())
+
+    gevent.sleep(0.1)
+
+    # the error handling the first message does not stop the dispatcher
+    assert [message.nonce for message in received] == [0, 1]
+    assert all(message.sender == address for message in received)
+    assert protocol.get_stats()['inflight'] == 0
+
+
+class Alarm(object):  # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.timers = BlockTimers()
+        self.scheduled = list()
+
+    def schedule(self, block_number, callback):
+        self.scheduled.append(block_number)
+        return self.timers.schedule(block_number, callback)
+
+    def expire(self, block_number):
+        for callback in self.timers.expire(block_number):
+            callback(block_number)
+
+
+def test_hashlock_index():
+
+    alarm = Alarm()
+    index = HashlockIndex(alarm)
+    asset1, asset2 = make_address(), make_address()
+    hashlock = sha3('test_hashlock_index')
+
+    # lookups of unknown hashlocks don't add entries
+    assert index.get_tasks(hashlock) == []
+    assert index.get_channels(hashlock, asset1) == []
+    assert index.get_assets(hashlock) == []
+    assert not index.hashlock_tasks
+    assert not index.hashlock_channels
+
+    index.register_task(asset1, 'task1', hashlock)
+    index.register_task(asset2, 'task2', hashlock)
+    assert sorted(index.get_tasks(hashlock)) == ['task1', 'task2']
+
+    index.unregister_task(asset1, hashlock)
+    index.unregister_task(asset2, hashlock)
+    assert not index.hashlock_tasks
+
+    index.register_channel(asset1, 'channel1', hashlock)
+    index.register_channel(asset1, 'channel1', hashlock, expiration=10)
+    index.register_channel(asset2, 'channel2', hashlock, expiration=20)
+    assert index.get_channels(hashlock, asset1) == ['channel1']
+    assert sorted(index.get_assets(hashlock)) == sorted([asset1, asset2])
+    assert alarm.scheduled == [11, 21]
+
+    # a single timer is scheduled for the locks that expire together
+    index.register_channel(asset1, 'channel1', hashlock, expiration=10)
+    index.register_channel(asset1, 'channel3', hashlock, expiration=10)
+    assert alarm.scheduled == [11, 21]
+
+    # the withdrawn locks are removed and their timer cancelled
+    index.unregister_channel(asset1, 'channel1', hashlock)
+    index.unregister_channel(asset1, 'channel3', hashlock)
+    assert index.get_assets(hashlock) == [asset2]
+    assert alarm.timers.cancelled == 1
+
+    # and the expired one too
+    alarm.expire(21)
+    assert not index.hashlock_channels
+    assert not index.hashlock_expirations
+
+
+def test_hashlock_index_messages():
+    created = list()
+
+    def create():
+        created.append(AsyncResult())
+        return created[-1]
+
+    index = HashlockIndex(Alarm())
+    asset = make_address()
+    hashlock = sha3('test_hashlock_index_messages')
+
+    # without channels waiting for the secret the message is not kept
+    index.get_message(hashlock, 'key', create)
+    assert len(created) == 1
+    assert not index.hashlock_messages
+
+    index.register_channel(asset, 'channel', hashlock, expiration=10)
+
+    first = index.get_message(hashlock, 'key', create)
+    assert index.get_message(hashlock, 'key', create) is first
+    assert index.get_message(hashlock, 'other', create) is not first
+    assert len(created) == 3
+
+    # a message that could not be signed is not reused
+    first.set_exception(ValueError('could not be signed'))
+    second = index.get_message(hashlock, 'key', create)
+    assert second is not first
+    assert index.get_message(hashlock, 'key', create) is second
+    assert len(created) == 4
+
+    # the messages are dropped with the lock
+    index.unregister_channel(asset, 'channel', hashlock)
+    assert not index.hashlock_messages
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import os
+
+from raiden.channel import Channel, ChannelEndState, ChannelExternalState
+from raiden.storage import ChannelStore, read_records
+from raiden.utils import sha3, make_address, make_privkey_address
+
+# pylint: disable=too-many-locals
+
+
+class NettingChannelMock(object):
+    # pylint: disable=no-self-use
+    def __init__(self, address):
+        self.address = address
+
+    def opened(self):
+        return 1
+
+    def closed(self):
+        return 0
+
+    def settled(self):
+        return 0
+
+
+def make_channel(netting_address, address1, address2, channel_for_hashlock):
+    netting_channel = NettingChannelMock(netting_address)
+
+    external_state = ChannelExternalState(
+        lambda *args: None,
+        lambda *args: channel_for_hashlock.append(args),
+        lambda: 1,
+        netting_channel,
+    )
+
+    return Channel(
+        ChannelEndState(address1, 70, netting_channel.opened),
+        ChannelEndState(address2, 110, netting_channel.opened),
+        external_state,
+        make_address(),
+        reveal_timeout=5,
+        settle_timeout=15,
+    )
+
+
+def test_channel_store(tmpdir):
+    path = str(tmpdir)
+    netting_address = make_address()
+    privkey1, address1 = make_privkey_address()
+    address2 = make_address()
+
+    store = ChannelStore(path)
+    test_channel = make_channel(netting_address, address1, address2, list())
+    test_channel.channel_store = store
+
+    directtransfer = test_channel.create_directtransfer(10, 1)
+    directtransfer.sign(privkey1, address1)
+    test_channel.register_transfer(directtransfer)
+
+    hashlocks = list()
+    for identifier in (2, 3, 4):
+        secret = sha3('test_channel_store{}'.format(identifier))
+        hashlocks.append((secret, sha3(secret)))
+
+        mediatedtransfer = test_channel.create_mediatedtransfer(
+            address1,
+            address2,
+            0,
+            5,
+            identifier,
+            10,
+            sha3(secret),
+        )
+        mediatedtransfer.sign(privkey1, address1)
+        test_channel.register_transfer(mediatedtransfer)
+
+    test_channel.release_lock(hashlocks[0][0])
+
+    # the secret of the last lock is known but the lock is not unlocked yet
+    test_channel.register_secret(hashlocks[2][0])
+    store.commit()
+
+    # the full state is logged once, the following changes as deltas
+    records, _ = read_records(os.path.join(path, 'wal.0'))
+    assert [record[0] for record in records] == [
+        'transfer',
+        'state',
+        'transfer',
+        'transfer',
+        'transfer',
+        'release',
+        'secret',
+    ]
+
+    # a crash while a record is written leaves an incomplete record
+    with open(os.path.join(path, 'wal.0'), 'ab') as handler:
+        handler.write(b'\x00\x00\x01\x00\x00')
+
+    channel_for_hashlock = list()
+    restored = make_channel(netting_address, address1, address2, channel_for_hashlock)
+    restored_store = ChannelStore(path)
+    assert restored_store.restore(restored)
+
+    for end, restored_end in ((test_channel.our_state, restored.our_state),
+                              (test_channel.partner_state, restored.partner_state)):
+        assert restored_end.nonce == end.nonce
+        assert restored_end.transferred_amount == end.transferred_amount
+        assert restored_end.locked() == end.locked()
+        assert (
+            restored_end.balance_proof.merkleroot_for_unclaimed() ==
+            end.balance_proof.merkleroot_for_unclaimed()
+        )
+        assert (
+            restored_end.balance_proof.get_known_unlocks() ==
+            end.balance_proof.get_known_unlocks()
+        )
+
+    assert restored.transferred_amount == 15
+    assert restored.locked == 10
+    assert restored.received_transfers == list()
+    assert channel_for_hashlock == [
+        (restored, hashlocks[1][1], 10),
+        (restored, hashlocks[2][1], 10),
+    ]
+
+    # the transfers covered by the latest balance proof were dropped from the
+    # snapshot written when the store was opened
+    assert [transfer.hash for transfer in restored.sent_transfers] == [
+        test_channel.sent_transfers[-1].hash
+    ]
+
+    # the log was compacted into a snapshot when the store was opened
+    assert not os.path.exists(os.path.join(path, 'wal.0'))
+
+    restored_store.close()
+    assert ChannelStore(path).restore(restored)
+    assert not ChannelStore(path).restore(
+        make_channel(make_address(), address1, address2, list())
+    )
@@ -22,6 +22,7 @@ from raiden.messages import (
     TransferTimeout
 )
 from raiden.network.transport import UnreliableTransport
+from raiden.tasks import BLOCK_REACHED, BaseMediatedTransferTask
 from raiden.tests.utils.messages import setup_messages_cb, MessageLogger
 from raiden.tests.utils.transfer import assert_synched_channels, channel, direct_transfer, transfer
 from raiden.tests.utils.network import CHAIN
@@ -690,3 +691,74 @@ def test_receive_directtransfer_invalidlocksroot(raiden_network, private_keys):
     )
     app0_key = PrivateKey(private_keys[0])
     sign_and_send(direct_transfer, app0_key, app0.raiden.address, app1)
+
+
+@pytest.mark.parametrize('blockchain_type', ['mock'])
+@pytest.mark.parametrize('channels_per_node', [2])
+@pytest.mark.parametrize('number_of_nodes', [10])
+def test_get_best_routes_ranking(raiden_network):
+    app0 = raiden_network[0]
+    asset_manager0 = app0.raiden.managers_by_asset_address.values()[0]
+
+    node_address = app0.raiden.address
+    partner1, partner2 = asset_manager0.partneraddress_channel.keys()[:2]
+
+    target = next(
+        app.raiden.address
+        for app in raiden_network
+        if app.raiden.address not in asset_manager0.partneraddress_channel and
+        app.raiden.address != node_address
+    )
+
+    # make both partners a next hop to the target, so that the routes are
+    # ranked by the penalty of the first hop
+    asset_manager0.channelgraph.add_path(partner1, target)
+    asset_manager0.channelgraph.add_path(partner2, target)
+
+    amount = 10
+    routes = list(asset_manager0.get_best_routes(amount, target))
+    first_hops = [path[1] for path, _ in routes]
+    assert set([partner1, partner2]).issubset(first_hops)
+
+    scores = [
+        len(path) - 1 + asset_manager0.first_hop_penalty(channel, amount)
+        for path, channel in routes
+    ]
+    assert scores == sorted(scores)
+
+    # a partner that failed goes after the other
+    best_partner = first_hops[0]
+    asset_manager0.register_route_result(best_partner, success=False)
+    asset_manager0.register_route_result(best_partner, success=False)
+
+    routes = list(asset_manager0.get_best_routes(amount, target))
+    assert routes[-1][0][1] == best_partner
+
+
+def test_wait_response_or_block():
+    class Timer(object):  # pylint: disable=too-few-public-methods
+        def cancel(self):
+            pass
+
+    class Alarm(object):  # pylint: disable=too-few-public-methods
+        def schedule(self, block_number, callback):
+            # the block was already reached
+            callback(block_number)
+            return Timer()
+
+    class Raiden(object):  # pylint: disable=too-few-public-methods
+        alarm = Alarm()
+
+    raiden = Raiden()
+    task = BaseMediatedTransferTask()
+    task.response_queue.put('first')
+    task.response_queue.put('second')
+
+    # pylint: disable=protected-access
+    assert task._wait_response_or_block(raiden, 10) == 'first'
+    assert task._wait_response_or_block(raiden, 10) == 'second'
+
+    # the wakeups queued behind the responses were discarded
+    assert task.response_queue.empty()
+    assert task._wait_response_or_block(raiden, 10) is BLOCK_REACHED
+    assert task.response_queue.empty()
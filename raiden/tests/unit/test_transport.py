@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
+import errno
+import socket
+
 import pytest
 import gevent
 from ethereum import slogging
 
 from raiden.utils import sha3
 from raiden.messages import Ping, Ack, decode
-from raiden.network.transport import UDPTransport, TokenBucket, DummyPolicy
+from raiden.network.transport import (
+    DummyPolicy,
+    InvalidEnvelope,
+    TokenBucket,
+    UDPTransport,
+    group_messages,
+    pack_datagram,
+    unpack_datagram,
+)
 from raiden.tests.utils.messages import setup_messages_cb
 
 slogging.configure(':DEBUG')
@@ -58,3 +69,70 @@ def test_throttle_policy_ping(monkeypatch, raiden_network):
     last_ping = Ping(nonce=9)
     app0.raiden.sign(last_ping)
     assert decoded.echo == sha3(last_ping.encode() + app1.raiden.address)
+
+
+def test_datagram_envelope():
+    messages = ['\x01' * 100, '\x02' * 500, '\x03' * 600, '\x04' * 1300, '\x05' * 10]
+
+    groups = group_messages(messages, max_size=1200)
+    assert groups == [messages[:2], [messages[2]], [messages[3]], [messages[4]]]
+
+    for group in groups:
+        datagram = pack_datagram(group)
+        assert unpack_datagram(datagram) == group
+
+    # a single message is sent as is
+    assert pack_datagram([messages[0]]) == messages[0]
+
+    datagram = pack_datagram(messages[:2])
+    assert len(datagram) == 1 + 2 + 100 + 2 + 500
+
+    with pytest.raises(InvalidEnvelope):
+        unpack_datagram(datagram[:-1])
+
+    with pytest.raises(InvalidEnvelope):
+        unpack_datagram(datagram[:2])
+
+
+def test_udp_transport_errors():
+    class Protocol(object):  # pylint: disable=too-few-public-methods
+        raiden = None
+
+        def __init__(self):
+            self.received = list()
+
+        def receive(self, data):
+            self.received.append(data)
+
+            if data == 'invalid':
+                raise ValueError('invalid message')
+
+    protocol = Protocol()
+    transport = UDPTransport('127.0.0.1', 0, protocol=protocol)
+
+    try:
+        # an error handling a message does not drop the rest of the datagram
+        transport.receive(pack_datagram(['invalid', 'valid']), None)
+        assert protocol.received == ['invalid', 'valid']
+
+        sent = list()
+
+        def sendto(data, host_port):
+            if not sent:
+                sent.append(None)
+                raise socket.error(errno.ENETUNREACH, 'Network is unreachable')
+            sent.append(data)
+
+        transport.server.sendto = sendto
+        host_port = ('127.0.0.1', 1)
+
+        # a failed send does not stop the later sends to the same host
+        transport.send(None, host_port, 'first')
+        gevent.sleep(0.01)
+        assert not transport.hostport_flusher
+
+        transport.send(None, host_port, 'second')
+        gevent.sleep(0.01)
+        assert sent == [None, 'second']
+    finally:
+        transport.stop()
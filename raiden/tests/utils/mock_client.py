@@ -7,6 +7,7 @@ from ethereum.abi import encode_abi, encode_single
 
 from raiden import messages
 from raiden.utils import isaddress, make_address, pex
+from raiden.blockchain.blocksource import PushBlockSource
 from raiden.blockchain.net_contract import NettingChannelContract
 from raiden.blockchain.abi import (
     ASSETADDED_EVENT,
@@ -98,6 +99,7 @@ class BlockChainServiceMock(object):
         cls.address_registry = dict()
         cls.asset_manager = dict()
         cls.filters = defaultdict(list)
+        cls.block_sources = list()
 
         registry = RegistryMock(address=MOCK_REGISTRY_ADDRESS)
         cls.default_registry = registry
@@ -120,12 +122,21 @@ class BlockChainServiceMock(object):
             closing of a channel can be closed or not.
         """
         cls.block_number_ += 1
+
+        for block_source in cls.block_sources:
+            block_source.new_block(cls.block_number_)
+
         return cls.block_number_
 
     @classmethod
     def block_number(cls):
         return cls.block_number_
 
+    def block_source(self):
+        block_source = PushBlockSource(self)
+        self.block_sources.append(block_source)
+        return block_source
+
     def set_verbosity(self, level):
         pass
 
@@ -147,6 +158,10 @@ class BlockChainServiceMock(object):
     def registry(self, registry_address):
         return self.address_registry[registry_address]
 
+    def poll_filters(self, block_number):
+        # the events are added to the filters when they happen
+        pass
+
     def uninstall_filter(self, filter_id_raw):
         pass
 
@@ -9,6 +9,7 @@ from pyethapp.jsonrpc import address_decoder
 from pyethapp.rpc_client import deploy_dependencies_symbols, dependencies_order_of_build
 
 from raiden import messages
+from raiden.blockchain.blocksource import PollingBlockSource
 from raiden.utils import (
     get_contract_path,
     isaddress,
@@ -143,7 +144,7 @@ class ChannelExternalStateTester(object):
     def settle(self):
         return self.proxy.settle()
 
-    def register_channel_for_hashlock(self, channel, hashlock):
+    def register_channel_for_hashlock(self, channel, hashlock, expiration=None):
         channels_registered = self.hashlock_channel[hashlock]
 
         if channel not in channels_registered:
@@ -208,6 +209,10 @@ class BlockChainServiceTesterMock(object):
     def block_number(self):
         return self.tester_state.block.number
 
+    def block_source(self):
+        # blocks are mined by every transaction, the block time is unknown
+        return PollingBlockSource(self, block_time=0)
+
     def next_block(self):
         self.tester_state.mine(number_of_blocks=1)
         return self.tester_state.block.number
@@ -288,6 +293,10 @@ class BlockChainServiceTesterMock(object):
 
         return self.address_registry[registry_address]
 
+    def poll_filters(self, block_number):
+        # the events are added to the filters when they happen
+        pass
+
     def uninstall_filter(self, filter_id_raw):
         pass
 
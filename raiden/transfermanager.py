@@ -56,10 +56,6 @@ class TransferManager(object):
         self.on_task_completed_callbacks = list()
         self.on_result_callbacks = list()
 
-    # TODO: Move registration to raiden_service.py:Raiden. This is used to
-    # dispatch messages by hashlock and to expose callbacks to applications
-    # built on top of raiden, since hashlocks can be shared among assets this
-    # should be moved to an upper layer.
     def register_task_for_hashlock(self, task, hashlock):
         """ Register the task to receive messages based on hashlock.
 
@@ -72,8 +68,16 @@ class TransferManager(object):
             the message, eg. SecretRequest, or calculated from the message
             content, eg.  RevealSecret), this means the sender needs to be
             checked for the received messages.
+
+            The messages are dispatched with the node's hashlock index, since
+            hashlocks can be shared among assets.
         """
         self.transfertasks[hashlock] = task
+        self.assetmanager.raiden.hashlock_index.register_task(
+            self.assetmanager.asset_address,
+            task,
+            hashlock,
+        )
 
     def on_hashlock_result(self, hashlock, success):
         """ Set the result for a transfer based on hashlock.
@@ -83,6 +87,10 @@ class TransferManager(object):
         """
         task = self.transfertasks[hashlock]
         del self.transfertasks[hashlock]
+        self.assetmanager.raiden.hashlock_index.unregister_task(
+            self.assetmanager.asset_address,
+            hashlock,
+        )
 
         callbacks_to_remove = list()
         for callback in self.on_task_completed_callbacks:
@@ -168,6 +176,11 @@ class TransferManager(object):
         """ Check the direct channel and if possible use it, otherwise start a
         mediated transfer.
         """
+        raiden = self.assetmanager.raiden
+
+        # the distributable amount and the new transfer must include the
+        # transfer that is being signed
+        raiden.wait_transfer_registered(direct_channel)
 
         if not direct_channel.isopen:
             log.info(
@@ -202,15 +215,18 @@ class TransferManager(object):
 
         else:
             direct_transfer = direct_channel.create_directtransfer(amount, identifier)
-            self.assetmanager.raiden.sign(direct_transfer)
-            direct_channel.register_transfer(direct_transfer)
 
+            # the callback is called once the transfer is registered, which
+            # may happen after this returns if the transfer is signed by the
+            # signing pool
             if callback:
                 direct_channel.on_task_completed_callbacks.append(callback)
 
-            async_result = self.assetmanager.raiden.protocol.send_async(
+            pending_transfer = raiden.register_transfer_async(direct_channel, direct_transfer)
+
+            async_result = raiden.protocol.send_async(
                 direct_channel.partner_state.address,
-                direct_transfer,
+                pending_transfer,
             )
             return async_result
 
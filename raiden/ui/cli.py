@@ -91,6 +91,24 @@ OPTIONS = [
         default=60,
         type=int,
     ),
+    click.option(
+        '--channel-store-path',
+        help=(
+            'Directory used to persist the off-chain state of the channels, '
+            'the state is restored from it when the node starts.'
+        ),
+        default='',
+        type=str,
+    ),
+    click.option(
+        '--channel-graph-backend',
+        help=(
+            'Implementation of the routing graph, compact uses less memory '
+            'for large networks.'
+        ),
+        default='networkx',
+        type=click.Choice(['networkx', 'compact']),
+    ),
 ]
 
 
@@ -113,7 +131,9 @@ def app(address,
         logging,
         logfile,
         max_unresponsive_time,
-        send_ping_time):
+        send_ping_time,
+        channel_store_path,
+        channel_graph_backend):
 
     slogging.configure(logging, log_file=logfile)
 
@@ -125,6 +145,8 @@ def app(address,
     config['port'] = listen_port
     config['max_unresponsive_time'] = max_unresponsive_time
     config['send_ping_time'] = send_ping_time
+    config['channel_store_path'] = channel_store_path
+    config['channel_graph_backend'] = channel_graph_backend
 
     accmgr = AccountManager(keystore_path)
     if not accmgr.accounts:
@@ -58,6 +58,19 @@ def keccak(seed):
     return keccak_256(seed).digest()
 
 
+def keccak_parts(*parts):
+    """ Returns the keccak of the concatenation of `parts` without building
+    the concatenated string, the parts may be memoryviews (hashing a
+    memoryview requires pycryptodome 3.6.0).
+    """
+    hash_ = keccaklib.new(digest_bits=256)
+
+    for part in parts:
+        hash_.update(part)
+
+    return hash_.digest()
+
+
 def ishash(data):
     return isinstance(data, (bytes, bytearray)) and len(data) == 32
 